@@ -2,53 +2,132 @@ __copyright__ = 'Copyright 2024, 3Liz'
 __license__ = 'GPL version 3'
 __email__ = 'info@3liz.org'
 
+import time
+
 from typing import Annotated, List, Optional
 
 from qgis.core import (
     Qgis,
+    QgsCoordinateReferenceSystem,
     QgsFeature,
+    QgsGeometry,
+    QgsMapLayer,
     QgsProcessingFeedback,
     QgsProject,
+    QgsRectangle,
     QgsReferencedRectangle,
     QgsVectorLayer,
 )
 from qgis.PyQt.QtCore import NULL
 from qgis.utils import iface
 
+from dynamic_layers.core.expression_context import DynamicExpressionContext
 from dynamic_layers.core.layer_datasource_modifier import (
     LayerDataSourceModifier,
 )
+from dynamic_layers.core.provider_cache import ProviderMetadataCache
+from dynamic_layers.core.timings import PhaseTimings
 from dynamic_layers.definitions import (
     PLUGIN_SCOPE,
     CustomProperty,
+    ExtentSource,
+    LayerProperty,
+    Phase,
     PluginProjectProperty,
+    TemplateDependency,
+    Verbosity,
     WmsProjectProperty,
 )
-from dynamic_layers.tools import log_message, string_substitution, tr
+from dynamic_layers.tools import (
+    ExpressionCache,
+    is_gui_thread,
+    log_message,
+    referenced_columns,
+    string_substitution,
+    template_dependency,
+    tr,
+)
 
 
 class DynamicLayersEngine:
 
-    def __init__(self, feedback: QgsProcessingFeedback = None):
-        """ Dynamic Layers Engine constructor. """
+    def __init__(
+            self,
+            feedback: QgsProcessingFeedback = None,
+            expression_cache: ExpressionCache = None,
+            verbosity: int = Verbosity.Debug,
+            provider_cache: ProviderMetadataCache = None,
+            timings: PhaseTimings = None,
+    ):
+        """ Dynamic Layers Engine constructor.
+
+        The expression cache must only be given if variables do not change during the lifetime of the engine.
+        With a provider cache, the schema of each dynamic layer is read only for its first new datasource.
+        Timings of each dynamic layer are added to the given timings, if any.
+        """
         self.dynamic_layers: dict = {}
         self.variables: dict = {}
-        self.iface = iface
+        # The map canvas can be used only from the main thread, not from a Processing algorithm in a thread
+        self.iface = iface if is_gui_thread() else None
         self.feedback = feedback
+        self.expression_cache = expression_cache
+        self.verbosity = verbosity
+        self.provider_cache = provider_cache
+        self.timings = timings if timings else PhaseTimings()
 
         # For expressions
         self.project = None
         self.layer = None
         self.feature = None
+        self.expression_context = DynamicExpressionContext()
+
+        # What each template depends on, analysed only once
+        self.dependencies: dict[str, str] = {}
+        # Values of templates not depending on the feature, for each layer ID, LayerProperty and template
+        self.run_values: dict[tuple[str, str, str], str] = {}
+        # Variables used to evaluate these values
+        self.run_variables: dict = {}
+        # Values set on each layer, to not set them again
+        self.applied_values: dict[str, dict[str, str]] = {}
+        # Values evaluated before, for the current feature, see set_planned_values()
+        self.planned_layers: dict[str, dict[str, str]] | None = None
+        self.planned_properties: dict[str, str] | None = None
+
+        # Layers having a new datasource, their extent is updated only once
+        self.dirty_extents: dict[str, QgsVectorLayer] = {}
+        # Number of extent updates, and time spent to update and to read extents, in seconds
+        self.extent_counters = {'updates': 0, 'seconds': 0.0}
 
     def set_layer_and_feature(self, layer: QgsVectorLayer, feature: QgsFeature):
         """ Set a feature for the dictionary. """
         self.layer = layer
         self.feature = feature
+        self.planned_layers = None
+        self.planned_properties = None
+
+    def set_planned_values(self, layers: dict[str, dict[str, str]], properties: dict[str, str]):
+        """ Values of templates already evaluated for the current feature, they are used instead of templates.
+
+        Values of dynamic layers are indexed by layer ID and LayerProperty, values of project properties by
+        WmsProjectProperty.
+        """
+        self.planned_layers = layers
+        self.planned_properties = properties
+
+    def update_expression_context(self):
+        """ Swap the current feature and variables in the expression context. """
+        self.expression_context.set_variables(self.variables)
+        self.expression_context.set_feature(self.feature)
 
     def discover_dynamic_layers_from_project(self, project: QgsProject):
         """ Check all maplayers in the given project which are dynamic. """
         self.project = project
+        if project is not QgsProject.instance():
+            # The map canvas shows only the current project
+            self.iface = None
+        self.expression_context = DynamicExpressionContext(project)
+        self.run_values.clear()
+        self.applied_values.clear()
         self.dynamic_layers = {
             lid: layer for lid, layer in project.mapLayers().items() if
             layer.customProperty(CustomProperty.DynamicDatasourceActive) and layer.customProperty(
@@ -61,55 +140,196 @@ class DynamicLayersEngine:
         Change the datasource by using the dynamicDatasourceContent
         And the given search&replace dictionary
         """
+        self.update_expression_context()
+        # Layers having new graduated classes
+        classified = []
         for layer in self.dynamic_layers.values():
-            datasource_modifier = LayerDataSourceModifier(layer, self.project, self.layer, self.feature, self.feedback)
-            datasource_modifier.compute_new_uri(self.variables)
-
-            if not self.iface:
-                continue
-
-            if layer.renderer() and layer.renderer().type() == 'graduatedSymbol':
-                layer.triggerRepaint()
-
-            layer.updateExtents(True)
+            source = layer.source()
+            datasource_modifier = self.datasource_modifier(layer)
+            if self.planned_layers is not None:
+                values = self.planned_layers[layer.id()]
+            else:
+                with self.timings.measure(Phase.Evaluation, layer.id()):
+                    values = self.evaluate_layer(datasource_modifier)
+            with self.timings.measure(Phase.Datasource, layer.id()):
+                datasource_modifier.apply_values(values, self.applied_values.setdefault(layer.id(), {}))
+            if isinstance(layer, QgsVectorLayer) and layer.source() != source:
+                # Other layers have the extent of the provider
+                self.dirty_extents[layer.id()] = layer
+            if datasource_modifier.classes_updated:
+                classified.append(layer)
+
+        self.update_layer_extents()
 
         if not self.iface:
             return
 
+        for layer in classified:
+            layer.triggerRepaint()
+
         # self.iface.actionDraw().trigger()
         # self.iface.mapCanvas().refresh()
 
+    def datasource_modifier(self, layer: QgsMapLayer) -> LayerDataSourceModifier:
+        """ The datasource modifier for the given dynamic layer, with the current feature. """
+        return LayerDataSourceModifier(
+            layer,
+            self.project,
+            self.layer,
+            self.feature,
+            self.feedback,
+            self.expression_cache,
+            self.expression_context,
+            self.verbosity,
+            self.provider_cache,
+        )
+
+    def evaluate_dynamic_layers(self) -> dict[str, dict[str, str]]:
+        """ Evaluate all templates of dynamic layers, without modifying any layer.
+
+        For each layer ID, values are indexed by LayerProperty.
+        """
+        if self.planned_layers is not None:
+            return self.planned_layers
+
+        self.update_expression_context()
+        values = {}
+        for layer_id, layer in self.dynamic_layers.items():
+            with self.timings.measure(Phase.Evaluation, layer_id):
+                values[layer_id] = self.evaluate_layer(self.datasource_modifier(layer))
+        return values
+
+    def template_dependency(self, template: str) -> str:
+        """ What the template depends on, see TemplateDependency. """
+        dependency = self.dependencies.get(template)
+        if dependency is None:
+            dependency = template_dependency(template)
+            self.dependencies[template] = dependency
+        return dependency
+
+    def evaluate_layer(self, datasource_modifier: LayerDataSourceModifier) -> dict[str, str]:
+        """ Evaluate templates of a dynamic layer, indexed by LayerProperty.
+
+        Templates which do not depend on the feature are evaluated only once, as long as variables are the same.
+        """
+        if self.run_variables != self.variables:
+            self.run_values.clear()
+            self.run_variables = dict(self.variables)
+
+        layer_id = datasource_modifier.layer.id()
+        templates = {LayerProperty.Datasource: datasource_modifier.dynamic_datasource_content}
+        templates.update(datasource_modifier.property_templates())
+
+        values = {}
+        for layer_property, template in templates.items():
+            key = (layer_id, layer_property, template)
+            if key in self.run_values:
+                values[layer_property] = self.run_values[key]
+                continue
+
+            if layer_property == LayerProperty.Datasource:
+                values[layer_property] = datasource_modifier.evaluate_uri(self.variables)
+            else:
+                values[layer_property] = datasource_modifier.evaluate_property(layer_property, self.variables)
+
+            if self.template_dependency(template) != TemplateDependency.Feature:
+                self.run_values[key] = values[layer_property]
+            if layer_property == LayerProperty.Name:
+                # The title and the abstract are evaluated with the new name of the layer
+                self.expression_context.set_layer_name(layer_id, values[layer_property])
+
+        self.expression_context.set_layer_name(layer_id, None)
+        return values
+
+    def feature_dependent_layers(self) -> list[str]:
+        """ IDs of dynamic layers having at least one template depending on the feature. """
+        layer_ids = []
+        for layer_id, layer in self.dynamic_layers.items():
+            datasource_modifier = LayerDataSourceModifier(layer, self.project, self.layer, self.feature, self.feedback)
+            if any(
+                    self.template_dependency(template) == TemplateDependency.Feature
+                    for template in datasource_modifier.templates()
+            ):
+                layer_ids.append(layer_id)
+        return layer_ids
+
+    def project_property_templates(self) -> dict[str, str]:
+        """ Templates stored in the project, for each WMS project property. """
+        templates = {}
+        for wms_property, plugin_property in (
+                (WmsProjectProperty.Title, PluginProjectProperty.Title),
+                (WmsProjectProperty.ShortName, PluginProjectProperty.ShortName),
+                (WmsProjectProperty.Abstract, PluginProjectProperty.Abstract),
+        ):
+            val = self.project.readEntry(PLUGIN_SCOPE, plugin_property)
+            if val[1] and val[0]:
+                templates[wms_property] = val[0]
+        return templates
+
+    def templates(self) -> list[str]:
+        """ All expressions used by the dynamic layers and by the project properties. """
+        templates = []
+        for layer in self.dynamic_layers.values():
+            datasource_modifier = LayerDataSourceModifier(layer, self.project, self.layer, self.feature, self.feedback)
+            templates.extend(datasource_modifier.templates())
+        templates.extend(self.project_property_templates().values())
+        if self.extent_source() == ExtentSource.Expression:
+            templates.append(self.extent_expression())
+        return templates
+
+    def referenced_columns(self, templates: list[str] | None = None) -> tuple[set[str], bool]:
+        """ Columns of the feature used by all templates, and if one of them needs the geometry.
+
+        Other templates, such as the destination of a project, can be given.
+        """
+        columns, needs_geometry = referenced_columns(self.templates() + (templates or []))
+        if self.extent_source() == ExtentSource.Feature:
+            needs_geometry = True
+        return columns, needs_geometry
+
     def update_dynamic_project_properties(self):
         """
         Set some project properties : title, short name, abstract
         based on the templates stored in the project file in <PluginDynamicLayers>
         and by using the search and replace dictionary
         """
+        self.update_expression_context()
+
         # Make sure WMS Service is active
         if not self.project.readEntry(WmsProjectProperty.Capabilities, "/")[1]:
             self.project.writeEntry(WmsProjectProperty.Capabilities, "/", True)
 
-        # Title
-        val = self.project.readEntry(PLUGIN_SCOPE, PluginProjectProperty.Title)
-        if val[1] and val[0]:
-            self.set_project_property(WmsProjectProperty.Title, val[0])
+        # Title, short name and abstract
+        for project_property, value in self.evaluate_project_properties().items():
+            self.project.writeEntry(project_property, '', value)
 
-        # Shortname
-        val = self.project.readEntry(PLUGIN_SCOPE, PluginProjectProperty.ShortName)
-        if val[1] and val[0]:
-            self.set_project_property(WmsProjectProperty.ShortName, val[0])
+    def evaluate_project_properties(self) -> dict[str, str]:
+        """ Evaluate all templates of project properties, without modifying the project. """
+        if self.planned_properties is not None:
+            return self.planned_properties
 
-        # Abstract
-        val = self.project.readEntry(PLUGIN_SCOPE, PluginProjectProperty.Abstract)
-        if val[1] and val[0]:
-            self.set_project_property(WmsProjectProperty.Abstract, val[0])
+        self.update_expression_context()
+        return {
+            project_property: self.evaluate_project_property(project_property, template)
+            for project_property, template in self.project_property_templates().items()
+        }
 
     def set_project_property(self, project_property: Annotated[str, WmsProjectProperty], val: str):
         """ Set a project property.
 
         It replaces a variable if found in the properties.
         """
-        log_message(tr("Compute new project property for {}").format(project_property), Qgis.MessageLevel.Info, self.feedback)
+        val = self.evaluate_project_property(project_property, val)
+        self.project.writeEntry(project_property, '', val)
+
+    def evaluate_project_property(self, project_property: Annotated[str, WmsProjectProperty], val: str) -> str:
+        """ Evaluate the template of a project property. """
+        log_message(
+            lambda: tr("Compute new project property for {}").format(project_property),
+            Qgis.MessageLevel.Info,
+            self.feedback,
+            self.verbosity,
+        )
         # Replace variable in given val via dictionary
         val = string_substitution(
             input_string=val,
@@ -117,6 +337,9 @@ class DynamicLayersEngine:
             project=self.project,
             layer=self.layer,
             feature=self.feature,
+            cache=self.expression_cache,
+            context=self.expression_context.context(self.layer),
+            verbosity=self.verbosity,
         )
         if val is None or val == NULL:
             log_message(
@@ -124,6 +347,7 @@ class DynamicLayersEngine:
                 f'it has been set to an empty string.',
                 Qgis.MessageLevel.Warning,
                 self.feedback,
+                self.verbosity,
             )
             val = ""
 
@@ -138,72 +362,177 @@ class DynamicLayersEngine:
                     tr('No latest Lizmap plugin installed'),
                     Qgis.MessageLevel.Info,
                     self.feedback,
+                    self.verbosity,
                 )
                 # Fall back on a quick replace statement
                 # TODO, this is a quick fix
                 val = val.replace(" ", "_").replace("  ", "_").lower()
 
-        self.project.writeEntry(project_property, '', val)
+        return val
+
+    def update_layer_extents(self):
+        """ Update the extent of layers having a new datasource, once per layer. """
+        start = time.perf_counter()
+        for layer in self.dirty_extents.values():
+            with self.timings.measure(Phase.LayerExtent, layer.id()):
+                layer.updateExtents(True)
+            self.extent_counters['updates'] += 1
+        self.dirty_extents.clear()
+        self.extent_counters['seconds'] += time.perf_counter() - start
 
     def force_refresh_all_layer_extents(self):
         """ Force all layers in the project to refresh its extent. """
         for layer in self.project.mapLayers().values():
-            if hasattr(layer, 'updateExtents'):
+            if isinstance(layer, QgsVectorLayer):
                 layer.updateExtents(True)
 
-    def update_project_extent(self) -> Optional[List[str]]:
-        """ Update the project extent according to the property stored in the project. """
-        log_message(tr("Update project extent"), Qgis.MessageLevel.Info, self.feedback)
+    def extent_layer(self) -> QgsMapLayer | None:
+        """ The layer used for the project extent, stored in the project. """
+        extent_layer = self.project.readEntry(PLUGIN_SCOPE, PluginProjectProperty.ExtentLayer)[0]
+        return self.project.mapLayer(extent_layer)
+
+    def extent_source(self) -> str:
+        """ How the project extent is computed, stored in the project, see ExtentSource. """
+        extent_source = self.project.readEntry(PLUGIN_SCOPE, PluginProjectProperty.ExtentSource)[0]
+        if extent_source in (ExtentSource.Feature, ExtentSource.Expression):
+            return extent_source
+        return ExtentSource.Layer
+
+    def extent_expression(self) -> str:
+        """ The geometry expression used for the project extent, stored in the project. """
+        return self.project.readEntry(PLUGIN_SCOPE, PluginProjectProperty.ExtentExpression)[0]
 
-        extent_layer = self.project.readEntry(PLUGIN_SCOPE, PluginProjectProperty.ExtentLayer)
-        if extent_layer:
-            extent_layer = extent_layer[0]
-        extent_layer = self.project.mapLayer(extent_layer)
+    def feature_extent(self) -> tuple[QgsRectangle, QgsCoordinateReferenceSystem] | None:
+        """ The bounding box of the feature, or of the geometry expression, with the CRS of the coverage layer.
+
+        None if the extent is not computed from the feature, the extent layer is not read at all.
+        """
+        extent_source = self.extent_source()
+        if extent_source == ExtentSource.Layer or not self.feature or not self.layer:
+            return None
+
+        if extent_source == ExtentSource.Feature:
+            geometry = self.feature.geometry()
+        else:
+            self.update_expression_context()
+            geometry = string_substitution(
+                input_string=self.extent_expression(),
+                variables=self.variables,
+                project=self.project,
+                layer=self.layer,
+                feature=self.feature,
+                cache=self.expression_cache,
+                context=self.expression_context.context(self.layer),
+                verbosity=self.verbosity,
+            )
+
+        if not isinstance(geometry, QgsGeometry) or geometry.isNull() or geometry.isEmpty():
+            log_message(
+                tr("The feature {} has no geometry for the project extent").format(self.feature.id()),
+                Qgis.MessageLevel.Warning,
+                self.feedback,
+                self.verbosity,
+            )
+            return None
+
+        log_message(
+            lambda: tr("Extent from the feature {}").format(self.feature.id()),
+            Qgis.MessageLevel.Info,
+            self.feedback,
+            self.verbosity,
+        )
+        return geometry.boundingBox(), self.layer.crs()
 
+    def extent_margin(self) -> int:
+        """ The margin, in percent, around the project extent. """
         extent_margin = self.project.readEntry(PLUGIN_SCOPE, PluginProjectProperty.ExtentMargin)
         if extent_margin and extent_margin[0]:
-            extent_margin = int(extent_margin[0])
+            return int(extent_margin[0])
+        return 0
+
+    def buffered_extent(
+            self, extent: QgsRectangle, extent_margin: int, crs: QgsCoordinateReferenceSystem) -> QgsRectangle:
+        """ Add the margin around the extent. """
+        if not extent_margin:
+            return extent
+
+        margin_x = extent.width() * extent_margin / 100
+        margin_y = extent.height() * extent_margin / 100
+        margin = max(margin_x, margin_y)
+        # TODO add unit
+        log_message(
+            lambda: tr("with a margin of {}, unit {}").format(margin, crs.mapUnits()),
+            Qgis.MessageLevel.Info,
+            self.feedback,
+            self.verbosity,
+        )
+        return extent.buffered(margin)
+
+    @staticmethod
+    def wms_extent(extent: QgsRectangle) -> list[str]:
+        """ The extent as a list of strings, as stored in the project for the WMS extent. """
+        p_wms_extent = [extent.xMinimum(), extent.yMinimum(), extent.xMaximum(), extent.yMaximum()]
+        return [str(i) for i in p_wms_extent]
+
+    def update_project_extent(self) -> Optional[List[str]]:
+        """ Update the project extent according to the property stored in the project. """
+        log_message(tr("Update project extent"), Qgis.MessageLevel.Info, self.feedback, self.verbosity)
+
+        extent_layer = self.extent_layer()
+        extent_margin = self.extent_margin()
+
+        # Only layers having a new datasource, if it's not done yet
+        self.update_layer_extents()
 
         p_extent = None
-        if extent_layer:
-            extent_layer.updateExtents(True)
+        crs = None
+        feature_extent = self.feature_extent()
+        if feature_extent:
+            p_extent, crs = feature_extent
+        elif extent_layer and self.extent_source() == ExtentSource.Layer:
+            start = time.perf_counter()
             p_extent = extent_layer.extent()
-            log_message(tr("Extent from layer : {}").format(extent_layer.name()), Qgis.MessageLevel.Info, self.feedback)
+            self.extent_counters['seconds'] += time.perf_counter() - start
+            log_message(
+                lambda: tr("Extent from layer : {}").format(extent_layer.name()),
+                Qgis.MessageLevel.Info,
+                self.feedback,
+                self.verbosity,
+            )
 
         if p_extent and p_extent.width() <= 0 and self.iface:
-            log_message(tr("Extent from iface"), Qgis.MessageLevel.Info, self.feedback)
+            log_message(tr("Extent from iface"), Qgis.MessageLevel.Info, self.feedback, self.verbosity)
             p_extent = self.iface.mapCanvas().extent()
 
         if not p_extent:
             return None
 
-        if extent_margin:
-            margin_x = p_extent.width() * extent_margin / 100
-            margin_y = p_extent.height() * extent_margin / 100
-            margin = max(margin_x, margin_y)
-            p_extent = p_extent.buffered(margin)
-            # TODO add unit
-            log_message(
-                tr("with a margin of {}, unit {}").format(margin, extent_layer.crs().mapUnits()),
-                Qgis.MessageLevel.Info,
-                self.feedback,
-            )
+        if crs is None:
+            if extent_layer:
+                crs = extent_layer.crs()
+            elif self.iface:
+                crs = self.iface.mapCanvas().mapSettings().destinationCrs()
+            else:
+                crs = self.project.crs()
+
+        p_extent = self.buffered_extent(p_extent, extent_margin, crs)
 
         # Modify WMS extent
-        p_wms_extent = [p_extent.xMinimum(), p_extent.yMinimum(), p_extent.xMaximum(), p_extent.yMaximum()]
-        p_wms_extent = [str(i) for i in p_wms_extent]
+        p_wms_extent = self.wms_extent(p_extent)
         self.project.writeEntry(WmsProjectProperty.Extent, '', p_wms_extent)
-        log_message(tr("Writing the new extent to {}").format(WmsProjectProperty.Extent), Qgis.MessageLevel.Info, self.feedback)
+        log_message(
+            lambda: tr("Writing the new extent to {}").format(WmsProjectProperty.Extent),
+            Qgis.MessageLevel.Info,
+            self.feedback,
+            self.verbosity,
+        )
 
-        if extent_layer:
-            georef_rectangle = QgsReferencedRectangle(p_extent, extent_layer.crs())
-        else:
-            georef_rectangle = QgsReferencedRectangle(p_extent, iface.mapCanvas().mapSettings().destinationCrs())
+        georef_rectangle = QgsReferencedRectangle(p_extent, crs)
         self.project.viewSettings().setDefaultViewExtent(georef_rectangle)
 
         # Zoom canvas to extent
         if self.iface:
-            log_message(tr("Refresh map canvas"), Qgis.MessageLevel.Info, self.feedback)
+            log_message(tr("Refresh map canvas"), Qgis.MessageLevel.Info, self.feedback, self.verbosity)
             self.iface.mapCanvas().setExtent(p_extent)
             self.iface.mapCanvas().refresh()
 
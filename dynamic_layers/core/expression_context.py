@@ -0,0 +1,102 @@
+__copyright__ = 'Copyright 2024, 3Liz'
+__license__ = 'GPL version 3'
+__email__ = 'info@3liz.org'
+
+
+from qgis.core import (
+    QgsExpressionContext,
+    QgsExpressionContextScope,
+    QgsExpressionContextUtils,
+    QgsFeature,
+    QgsMapLayer,
+    QgsProject,
+)
+
+
+class DynamicExpressionContext:
+    """ Expression contexts reused during a whole run.
+
+    The global, project and layer scopes are built only once, for each layer used in an expression.
+    Between two features, only the feature and the scope holding the static variables are swapped.
+
+    The layer name is renamed for each feature by its template, so @layer_name is not static in the layer scope. It is
+    the name of the layer for the current feature, see set_layer_name(), or its name in the template project.
+    """
+
+    def __init__(self, project: QgsProject = None):
+        """ Constructor. """
+        self.project = project
+        self.variables: dict = {}
+        self.feature: QgsFeature | None = None
+        self._contexts: dict[str | None, QgsExpressionContext] = {}
+        # Names of layers in the template project, and for the current feature
+        self._layer_names: dict[str, str] = {}
+        self._feature_layer_names: dict[str, str] = {}
+
+    def set_variables(self, variables: dict):
+        """ Swap the scope holding static variables, if they have changed. """
+        if variables == self.variables:
+            return
+
+        self.variables = dict(variables)
+        for context in self._contexts.values():
+            # The feature is stored in the last scope, the one we are swapping
+            context.popScope()
+            context.appendScope(self._variables_scope())
+
+    def set_feature(self, feature: QgsFeature | None):
+        """ Set the current feature. """
+        self.feature = feature
+
+    def set_layer_name(self, layer_id: str, name: str | None):
+        """ The new name of the layer for the current feature, None to use its name in the template project. """
+        if name is None:
+            self._feature_layer_names.pop(layer_id, None)
+        else:
+            self._feature_layer_names[layer_id] = name
+
+    def context(self, layer: QgsMapLayer = None) -> QgsExpressionContext:
+        """ The expression context for the given layer, with the current feature and variables. """
+        key = layer.id() if layer else None
+        context = self._contexts.get(key)
+        if context is None:
+            context = QgsExpressionContext()
+            # noinspection PyArgumentList
+            context.appendScope(QgsExpressionContextUtils.globalScope())
+            if self.project:
+                # noinspection PyArgumentList
+                context.appendScope(QgsExpressionContextUtils.projectScope(self.project))
+            if layer:
+                # noinspection PyArgumentList
+                context.appendScope(QgsExpressionContextUtils.layerScope(layer))
+                self._layer_names[key] = layer.name()
+            context.appendScope(self._variables_scope())
+            self._contexts[key] = context
+
+        if layer:
+            # The layer scope is just before the one holding the feature
+            name = self._feature_layer_names.get(key, self._layer_names[key])
+            context.scope(context.scopeCount() - 2).setVariable('layer_name', name, False)
+
+        if self.feature:
+            context.lastScope().setFeature(self.feature)
+        else:
+            context.lastScope().removeFeature()
+        return context
+
+    def clear(self):
+        """ Remove all contexts, they will be built again on demand. """
+        self._contexts.clear()
+        self._layer_names.clear()
+        self._feature_layer_names.clear()
+
+    def _variables_scope(self) -> QgsExpressionContextScope:
+        """ A new scope with static variables.
+
+        Variables are not flagged as static for the expression engine, because they can change between two
+        evaluations of the same prepared expression.
+        """
+        scope = QgsExpressionContextScope()
+        for key, value in self.variables.items():
+            scope.addVariable(QgsExpressionContextScope.StaticVariable(key, value, True, False))
+        return scope
@@ -2,24 +2,60 @@ __copyright__ = 'Copyright 2024, 3Liz'
 __license__ = 'GPL version 3'
 __email__ = 'info@3liz.org'
 
+import gc
 import json
+import os
+import time
 
+from collections.abc import Iterator
 from pathlib import Path
-from shutil import copyfile, copytree
 
 from qgis.core import (
     Qgis,
+    QgsFeature,
     QgsFeatureRequest,
+    QgsProcessingException,
     QgsProcessingFeedback,
     QgsProject,
     QgsVectorLayer,
 )
-from qgis.PyQt.QtWidgets import QApplication
+from qgis.PyQt.QtCore import NULL
 
 from dynamic_layers.core.dynamic_layers_engine import DynamicLayersEngine
+from dynamic_layers.core.generation_plan import GenerationPlan
+from dynamic_layers.core.journal import (
+    GenerationJournal,
+    partial_path,
+    publish_partial,
+)
+from dynamic_layers.core.manifest import (
+    GenerationManifest,
+    content_hash,
+    datasource_stats,
+    file_hash,
+    file_stats,
+)
+from dynamic_layers.core.parallel_generation import (
+    can_run_in_parallel,
+    generate_in_parallel,
+)
+from dynamic_layers.core.profiling import GenerationProfiler
+from dynamic_layers.core.provider_cache import ProviderMetadataCache
+from dynamic_layers.core.side_car import SideCarFiles
+from dynamic_layers.core.timings import PhaseTimings
+from dynamic_layers.core.xml_template_renderer import XmlTemplateRenderer
+from dynamic_layers.definitions import (
+    CopyStrategy,
+    GenerationBackend,
+    LayerProperty,
+    Phase,
+    Verbosity,
+)
 from dynamic_layers.tools import (
+    ExpressionCache,
+    check_expressions,
+    group_features_by_value,
     log_message,
-    side_car_files,
     string_substitution,
     tr,
 )
@@ -37,8 +73,59 @@ class GenerateProjects:
             copy_side_car_files: bool,
             feedback: QgsProcessingFeedback = None,
             limit: int = None,
+            verbosity: int = Verbosity.Normal,
+            workers: int = 1,
+            feature_ids: list[int] | None = None,
+            backend: str = GenerationBackend.Project,
+            incremental: bool = False,
+            resume: bool = False,
+            deduplicate: bool = False,
+            copy_strategy: str = CopyStrategy.Copy,
+            reuse_provider_metadata: bool = False,
+            trace: Path | None = None,
+            profile: bool = False,
+            profile_interval: int = 100,
+            reload_interval: int = 0,
+            dry_run: Path | None = None,
     ):
-        """ Constructor. """
+        """ Constructor.
+
+        With more than one worker, projects are generated by many processes, each one reading its own copy of the
+        saved project. The output is the same as with a single process, as long as each feature has its own
+        destination. A list of feature IDs restricts the generation to these features only.
+
+        The backend is either the QGIS project, or the XML of the template project, see GenerationBackend.
+
+        In incremental mode, a manifest is kept in the destination folder. Only projects having new inputs are
+        generated, and outputs of features which are not in the coverage layer anymore are removed.
+
+        Generated projects are recorded in a journal in the destination folder, until the run is complete. With the
+        resume option, projects already recorded by the same run are not generated again.
+
+        With the deduplicate option, a single project is generated for each value of the field, from the feature
+        having the lowest ID.
+
+        Side-car files and media files are copied according to the copy strategy, see CopyStrategy. If the file
+        system refuses it, the file is copied.
+
+        With the option to reuse the provider metadata, the schema of each dynamic vector layer is read only for its
+        first new datasource. Next datasources of the same table only change the filter of the layer, other ones are
+        trusted by the provider. If the schema is not the same, the datasource is set again as usual.
+
+        Time spent in each phase is logged at the end of the run. With a trace file, timings of each feature are
+        written in this CSV file, or in JSON if the extension is ".json".
+
+        With the profile option, a cProfile file and the top allocation sites from tracemalloc, at the start and every
+        N features, are written in the destination folder.
+
+        With a reload interval, caches are cleared every N features. The saved template project is read again as well,
+        to release providers and layers used by previous projects. It's done only for a saved project which is not
+        the current project of QGIS, with the QGIS project backend.
+
+        Before generating any project, all templates are evaluated for all features, and errors of all features are
+        reported at once. With a dry run, this plan is written to the given CSV file, or to JSON if the extension is
+        ".json", and no project is generated.
+        """
         self.project = project
         self.coverage = coverage
         self.field = field
@@ -47,143 +134,324 @@ class GenerateProjects:
         self.copy_side_car_files = copy_side_car_files
         self.feedback = feedback
         self.limit = limit
+        self.verbosity = verbosity
+        self.workers = workers
+        self.feature_ids = feature_ids
+        self.backend = backend
+        self.incremental = incremental
+        self.resume = resume
+        self.deduplicate = deduplicate
+        self.copy_strategy = copy_strategy
+        self.reuse_provider_metadata = reuse_provider_metadata
+        self.trace = trace
+        self.profile = profile
+        self.profile_interval = profile_interval
+        self.profiler: GenerationProfiler | None = None
+        self.reload_interval = reload_interval
+        # Number of times the template project has been read again during the last run
+        self.reloads = 0
+        self.dry_run = dry_run
+        # Evaluated templates of the last run
+        self.plan: GenerationPlan | None = None
+        # Templates evaluated by the main process, for a slice of a run in a worker process, see process_slice()
+        self.slice_plan: GenerationPlan | None = None
+        # Side-car files of the template project, listed once per run
+        self.side_car: SideCarFiles | None = None
+        # Projects written during the last call to process(), for each feature ID
+        self.generated: dict[int, Path] = {}
+        # Time spent in each phase during the last call to process()
+        self.timings = PhaseTimings()
+
+        if self.backend == GenerationBackend.Xml:
+            # Before any file is written in the destination
+            XmlTemplateRenderer.check_template(Path(self.project.fileName()))
 
     def process(self) -> bool:
         """ Generate all projects needed according to the coverage layer. """
+        if not self.profile or self.profiler is not None:
+            # Without profile, or profiled by the worker process for all its slices
+            return self._process()
+
+        self.start_profiler()
+        try:
+            return self._process()
+        finally:
+            self.stop_profiler()
+
+    def start_profiler(self, suffix: str = ''):
+        """ Start the CPU profile and the memory allocations, until stop_profiler().
+
+        A worker process starts its own profiler, with its own suffix, and keeps it for all its slices.
+        """
+        self.destination.mkdir(parents=True, exist_ok=True)
+        self.profiler = GenerationProfiler(self.destination, self.profile_interval, suffix=suffix)
+        self.profiler.start()
+
+    def stop_profiler(self):
+        """ Write the CPU profile and the last memory allocations. """
+        self.profiler.stop()
+        log_message(
+            tr('Profile written to {}, memory allocations written to {}').format(
+                self.profiler.profile_path, self.profiler.memory_path),
+            Qgis.MessageLevel.Success,
+            self.feedback,
+            self.verbosity,
+        )
+        self.profiler = None
+
+    def process_slice(self, feature_ids: list[int], plan: GenerationPlan) -> bool:
+        """ Generate projects of a slice of a run, in a worker process, with templates evaluated by the main process.
+
+        The worker process keeps the same generator for all its slices, so expressions are not checked again and
+        side-car files are listed only once.
+        """
+        self.feature_ids = feature_ids
+        self.slice_plan = plan
+        try:
+            return self.process()
+        finally:
+            self.slice_plan = None
+
+    def _process(self) -> bool:
+        """ Generate all projects, see process(). """
         if self.feedback:
             self.feedback.setProgress(0)
-        engine = DynamicLayersEngine(self.feedback)
+        # Expressions are parsed and prepared only once for the whole run
+        expression_cache = ExpressionCache()
+        provider_cache = ProviderMetadataCache() if self.reuse_provider_metadata else None
+        self.timings = PhaseTimings(trace=self.trace is not None)
+        engine = DynamicLayersEngine(self.feedback, expression_cache, self.verbosity, provider_cache, self.timings)
         engine.discover_dynamic_layers_from_project(self.project)
 
+        # Check all expressions before touching any project, it's already done by the main process for a slice
+        error = None
+        if self.slice_plan is None:
+            error = check_expressions(engine.templates() + [self.expression_destination])
+        if error:
+            log_message(error, Qgis.MessageLevel.Critical, self.feedback, self.verbosity)
+            raise QgsProcessingException(error)
+
+        log_message(
+            lambda: tr('{} dynamic layers on {} depend on the feature').format(
+                len(engine.feature_dependent_layers()), len(engine.dynamic_layers)),
+            Qgis.MessageLevel.Info,
+            self.feedback,
+            self.verbosity,
+        )
+
         base_path = self.project.fileName()
+        self.generated = {}
+
+        feature_ids = self.feature_ids
+        if self.deduplicate:
+            feature_ids = self.representative_feature_ids()
+
+        # Evaluate all templates before touching any project or any file
+        if self.slice_plan is not None:
+            self.plan = self.slice_plan
+        else:
+            with self.timings.measure(Phase.Plan):
+                self.plan = self.evaluate_plan(engine, expression_cache, feature_ids)
+        if self.plan is None:
+            return False
+
+        if self.dry_run:
+            self.plan.export(self.dry_run)
+            log_message(
+                tr('Plan of {} projects written to {}, with {} errors').format(
+                    len(self.plan), self.dry_run, len(self.plan.errors)),
+                Qgis.MessageLevel.Success,
+                self.feedback,
+                self.verbosity,
+            )
+            return not self.plan.errors
+
+        for feature_id, key, message in self.plan.warnings:
+            log_message(
+                tr('Feature ID {} → "{}" = \'{}\' : {}').format(feature_id, self.field, key, message),
+                Qgis.MessageLevel.Warning,
+                self.feedback,
+                self.verbosity,
+            )
+
+        if self.plan.errors:
+            for feature_id, key, message in self.plan.errors:
+                log_message(
+                    tr('Feature ID {} → "{}" = \'{}\' : {}').format(feature_id, self.field, key, message),
+                    Qgis.MessageLevel.Critical,
+                    self.feedback,
+                    self.verbosity,
+                )
+            raise QgsProcessingException(
+                tr('{} features have errors in their templates, no project has been generated').format(
+                    len({feature_id for feature_id, _, _ in self.plan.errors})))
 
         if not self.destination.exists():
-            self.destination.mkdir()
+            self.destination.mkdir(parents=True, exist_ok=True)
+
+        if not self.copy_side_car_files:
+            self.side_car = None
+        elif self.slice_plan is None or self.side_car is None:
+            self.side_car = self.discover_side_car_files(Path(base_path))
+        else:
+            # Listed by a previous slice of the same worker process
+            self.side_car.fallbacks = 0
+
+        manifest = None
+        planned = {}
+        if self.incremental:
+            manifest = GenerationManifest.load(self.destination)
+            feature_ids, planned = self.plan_incremental(engine, manifest)
+
+        journal = None
+        if self.feature_ids is None:
+            # With a list of feature IDs, it's a slice of a run, the journal is kept by the main process
+            journal = GenerationJournal(self.destination)
+            completed = journal.start(self.run_id(), self.resume)
+            if completed:
+                if feature_ids is None:
+                    feature_ids = self.all_feature_ids()
+                feature_ids = [feature_id for feature_id in feature_ids if feature_id not in completed]
+                log_message(
+                    tr('Resuming the previous run, {} projects were already generated').format(len(completed)),
+                    Qgis.MessageLevel.Success,
+                    self.feedback,
+                    self.verbosity,
+                )
 
-        log_message(tr('Copying side-car files : {}').format(self.copy_side_car_files), Qgis.MessageLevel.Info, self.feedback)
+        if self.workers > 1 and self.feature_ids is None:
+            error = can_run_in_parallel(self.project, self.coverage)
+            if not error:
+                success = self.process_parallel(feature_ids, journal)
+                if manifest:
+                    self.update_manifest(manifest, planned)
+                self.report_timings(engine)
+                if success:
+                    journal.finish()
+                return success
+
+            log_message(
+                tr('Projects will be generated with a single process : {}').format(error),
+                Qgis.MessageLevel.Warning,
+                self.feedback,
+                self.verbosity,
+            )
 
-        log_message(tr('Starting the loop over features'), Qgis.MessageLevel.Info, self.feedback)
+        log_message(
+            lambda: tr('Copying side-car files : {}').format(self.copy_side_car_files),
+            Qgis.MessageLevel.Info,
+            self.feedback,
+            self.verbosity,
+        )
+
+        log_message(tr('Starting the loop over features'), Qgis.MessageLevel.Info, self.feedback, self.verbosity)
 
         total = 100.0 / self.coverage.featureCount() if self.coverage.featureCount() else 0
 
-        request = QgsFeatureRequest()
-        # noinspection PyUnresolvedReferences
-        request.setFlags(QgsFeatureRequest.NoGeometry)
+        request = self.coverage_request(engine)
+        if feature_ids is not None:
+            request.setFilterFids(feature_ids)
+            total = 100.0 / len(feature_ids) if feature_ids else 0
         if self.limit and self.limit >= 0:
             # For debug only
             request.setLimit(self.limit)
             if total >= self.limit:
                 total = self.limit
 
-        for i, feature in enumerate(self.coverage.getFeatures(request)):
-            if self.feedback:
-                if self.feedback.isCanceled():
-                    break
-                self.feedback.pushDebugInfo(tr(
-                    'Feature ID : {} → "{}" = \'{}\'').format(feature.id(), self.field, feature[self.field]))
+        renderer = None
+        if self.backend == GenerationBackend.Xml:
+            # The template is parsed only once
+            renderer = XmlTemplateRenderer(engine)
 
-            if hasattr(self.feedback, 'widget'):
-                # It's the own Feedback object
-                QApplication.processEvents()
-
-            engine.set_layer_and_feature(self.coverage, feature)
-            engine.update_dynamic_layers_datasource()
+        self.reloads = 0
+        reload_project = renderer is None and self.can_reload_project()
+        for i, feature in enumerate(self.coverage_features(request, engine, reload_project)):
             if self.feedback:
                 if self.feedback.isCanceled():
                     break
+                if self.verbosity >= Verbosity.Debug:
+                    self.feedback.pushDebugInfo(tr(
+                        'Feature ID : {} → "{}" = \'{}\'').format(feature.id(), self.field, feature[self.field]))
 
-            for layer in self.project.mapLayers().values():
-                # Force refresh layer extents
-                if hasattr(layer, 'updateExtents'):
-                    layer.updateExtents(True)
-            if self.feedback:
-                if self.feedback.isCanceled():
-                    break
-
-            engine.update_dynamic_project_properties()
-            if self.feedback:
-                if self.feedback.isCanceled():
-                    break
-
-            engine.force_refresh_all_layer_extents()
-
-            # Set new extent
-            extent = engine.update_project_extent()
+            self.timings.start_feature(feature.id())
+            engine.set_layer_and_feature(self.coverage, feature)
+            engine.set_planned_values(self.plan.layer_values(feature.id()), self.plan.property_values(feature.id()))
+            if renderer:
+                # Nothing is changed in the project, only in the XML document
+                with self.timings.measure(Phase.Render):
+                    extent = renderer.render()
+            else:
+                # Extents are updated only for layers having a new datasource
+                engine.update_dynamic_layers_datasource()
+                if self.feedback:
+                    if self.feedback.isCanceled():
+                        break
+
+                with self.timings.measure(Phase.ProjectProperties):
+                    engine.update_dynamic_project_properties()
+                if self.feedback:
+                    if self.feedback.isCanceled():
+                        break
+
+                # Set new extent
+                with self.timings.measure(Phase.ProjectExtent):
+                    extent = engine.update_project_extent()
 
             # Output file name
-            log_message(tr("Compute new value for output file name"), Qgis.MessageLevel.Info, self.feedback)
-            new_file = string_substitution(
-                input_string=self.expression_destination,
-                variables={},
-                project=self.project,
-                layer=self.coverage,
-                feature=feature,
-            )
-            new_path = Path(f"{self.destination}/{new_file}")
-            new_file_name = new_path.stem
+            new_path = self.output_path(feature.id())
 
             # The new path can contain new folder, specific to the evaluated expression
             if not new_path.parent.exists():
-                new_path.parent.mkdir()
+                new_path.parent.mkdir(parents=True, exist_ok=True)
 
             # First copy side-car files, to avoid Lizmap to have question about a new project without CFG file
             cfg_file = None
-            if self.copy_side_car_files:
-                base_path_obj = Path(base_path)
-                files = side_car_files(base_path_obj)
-                log_message(
-                    tr('List of side-car files 1/2 : {}').format(str([str(f) for f in files])),
-                    Qgis.MessageLevel.Info,
-                    self.feedback,
-                )
-                for a_file in files:
-                    destination = str(new_path) + a_file.suffix
-                    copyfile(a_file, destination)
+            cfg_source = None
+            if self.side_car:
+                side_car_start = time.perf_counter()
+                for a_file in self.side_car.files:
+                    destination = self.side_car.file_destination(a_file, new_path)
+                    self.side_car.copy_file(a_file, destination)
                     if a_file.suffix.lower() == '.cfg' and extent:
                         cfg_file = destination
-
-                try:
-                    from lizmap.toolbelt.lizmap import sidecar_media_dirs
-                    dirs = sidecar_media_dirs(base_path_obj)
-                    log_message(
-                        tr('List of side-car files 2/2 : {}').format(str([str(f) for f in dirs])),
-                        Qgis.MessageLevel.Info,
-                        self.feedback
-                    )
-                    for a_dir in dirs:
-                        rel_path = a_dir.relative_to(base_path_obj.parent)
-
-                        # Quick and replace "media/js/project_A/foo.js" to "media/js/project_B/foo.js"
-                        rel_path = Path(str(rel_path).replace(base_path_obj.stem, new_file_name))
-
-                        new_dir_path = new_path.parent.joinpath(rel_path)
-                        new_dir_path.mkdir(parents=True, exist_ok=True)
-
-                        copytree(a_dir, new_dir_path, dirs_exist_ok=True)
-
-                        # log_message(
-                        #     tr('Copy of directory : {}').format(str(rel_path)),
-                        #     Qgis.Info,
-                        #     self.feedback,
-                        # )
-                except ImportError:
-                    log_message(
-                        tr('No latest Lizmap plugin installed, if it is needed in your case.'),
-                        Qgis.MessageLevel.Info,
-                        self.feedback,
-                    )
-
-
-            log_message(tr('Project written to new file name {}').format(new_path.name), Qgis.MessageLevel.Info, self.feedback)
-            self.project.setFileName(str(new_path))
-            self.project.write()
-            self.project.setFileName(base_path)
+                        cfg_source = a_file
+
+                for a_dir in self.side_car.media_dirs:
+                    self.side_car.copy_media(a_dir, new_path)
+
+                    # log_message(
+                    #     tr('Copy of directory : {}').format(str(rel_path)),
+                    #     Qgis.Info,
+                    #     self.feedback,
+                    # )
+                self.timings.add(Phase.SideCar, time.perf_counter() - side_car_start)
+
+            log_message(
+                lambda path=new_path: tr('Project written to new file name {}').format(path.name),
+                Qgis.MessageLevel.Success,
+                self.feedback,
+                self.verbosity,
+            )
+            # The project is complete only when it has its final name
+            part_path = partial_path(new_path)
+            with self.timings.measure(Phase.Write):
+                if renderer:
+                    written = renderer.write(part_path)
+                else:
+                    self.project.setFileName(str(part_path))
+                    written = self.project.write()
+                    self.project.setFileName(base_path)
+            if not written:
+                raise QgsProcessingException(
+                    tr('Impossible to write the project {} : {}').format(new_path.name, self.project.error()))
+            publish_partial(new_path)
 
             if cfg_file:
                 # Specific for Lizmap file
+                lizmap_start = time.perf_counter()
                 try:
-                    with open(cfg_file, 'r') as f:
-                        content = json.load(f)
+                    # The content is read only once for the whole run
+                    content = json.loads(self.side_car.content(cfg_source))
                     content['options']['bbox'] = extent
                     content['options']['initialExtent'] = [float(f) for f in extent]
                     with open(cfg_file, 'w') as f:
@@ -193,18 +461,494 @@ class GenerateProjects:
                         tr('updating Lizmap configuration file about the extent'),
                         Qgis.MessageLevel.Info,
                         self.feedback,
+                        self.verbosity,
                     )
                 except Exception as e:
                     log_message(
                         tr('Error with the Lizmap configuration file : {}').format(e),
                         Qgis.MessageLevel.Critical,
                         self.feedback,
+                        self.verbosity,
                     )
-
+                self.timings.add(Phase.LizmapConfig, time.perf_counter() - lizmap_start)
+
+            self.generated[feature.id()] = new_path
+            if journal:
+                journal.record(feature.id(), new_path)
+            self.timings.finish_feature()
+            if self.profiler:
+                self.profiler.feature_done()
             if self.feedback:
                 self.feedback.setProgress(int(i * total))
 
+        if manifest:
+            self.update_manifest(manifest, planned)
+
+        self.report_timings(engine)
+
+        log_message(
+            lambda: tr('Layer extents updated {} times, {:.3f} seconds spent on extents').format(
+                engine.extent_counters['updates'], engine.extent_counters['seconds']),
+            Qgis.MessageLevel.Info,
+            self.feedback,
+            self.verbosity,
+        )
+
+        if provider_cache:
+            log_message(
+                lambda: tr(
+                    'Datasources set with a new filter only : {filters}, trusted by the provider : {trusted}, '
+                    'set again because the schema is different : {fallbacks}').format(**provider_cache.counters),
+                Qgis.MessageLevel.Info,
+                self.feedback,
+                self.verbosity,
+            )
+
+        if self.side_car and self.side_car.fallbacks:
+            log_message(
+                tr('{} files have been copied, because the file system does not support "{}"').format(
+                    self.side_car.fallbacks, self.copy_strategy),
+                Qgis.MessageLevel.Warning,
+                self.feedback,
+                self.verbosity,
+            )
+
+        if journal and not (self.feedback and self.feedback.isCanceled()):
+            journal.finish()
+
         if self.feedback:
             # Should be OK without it, but let's increase it manually.
             self.feedback.setProgress(100)
         return True
+
+    def report_timings(self, engine: DynamicLayersEngine):
+        """ Log the time spent in each phase, and write the trace if needed. """
+        if self.feature_ids is not None:
+            # It's a slice of a run, timings are sent to the main process
+            return
+
+        layer_names = {layer_id: layer.name() for layer_id, layer in engine.dynamic_layers.items()}
+        log_message(
+            lambda: self.timings.summary(layer_names),
+            Qgis.MessageLevel.Success,
+            self.feedback,
+            self.verbosity,
+        )
+        if self.trace is None:
+            return
+
+        self.timings.write_trace(self.trace)
+        log_message(
+            tr('Timings of each feature written to {}').format(self.trace),
+            Qgis.MessageLevel.Success,
+            self.feedback,
+            self.verbosity,
+        )
+
+    def coverage_request(self, engine: DynamicLayersEngine) -> QgsFeatureRequest:
+        """ Request on the coverage layer, with only the columns used by templates, and the geometry if needed. """
+        columns, needs_geometry = engine.referenced_columns([self.expression_destination])
+        log_message(
+            lambda: tr('Columns used by templates : {}, with the geometry : {}').format(
+                ', '.join(sorted(columns)), needs_geometry),
+            Qgis.MessageLevel.Info,
+            self.feedback,
+            self.verbosity,
+        )
+
+        request = QgsFeatureRequest()
+        if not needs_geometry:
+            # noinspection PyUnresolvedReferences
+            request.setFlags(QgsFeatureRequest.NoGeometry)
+        if QgsFeatureRequest.ALL_ATTRIBUTES not in columns:
+            # The field is always used in logs and in the manifest
+            request.setSubsetOfAttributes(sorted(columns | {self.field}), self.coverage.fields())
+        return request
+
+    def evaluate_destination(
+            self, engine: DynamicLayersEngine, expression_cache: ExpressionCache, feature: QgsFeature) -> str:
+        """ Evaluate the destination of the project for the current feature of the engine. """
+        log_message(
+            tr("Compute new value for output file name"),
+            Qgis.MessageLevel.Info,
+            self.feedback,
+            self.verbosity,
+        )
+        engine.update_expression_context()
+        return string_substitution(
+            input_string=self.expression_destination,
+            variables={},
+            project=self.project,
+            layer=self.coverage,
+            feature=feature,
+            cache=expression_cache,
+            context=engine.expression_context.context(self.coverage),
+            verbosity=self.verbosity,
+        )
+
+    def output_path(self, feature_id: int) -> Path:
+        """ The destination of the project of the feature, from the plan. """
+        return Path(f"{self.destination}/{self.plan.destination(feature_id)}")
+
+    def evaluate_plan(
+            self, engine: DynamicLayersEngine, expression_cache: ExpressionCache, feature_ids: list[int] | None = None,
+    ) -> GenerationPlan | None:
+        """ Evaluate all templates for each feature, in a single pass over the coverage layer.
+
+        Errors of each feature are kept in the plan. Features having the same destination are only warnings, the last
+        one overwrites the project of the previous ones. None if it has been canceled.
+        """
+        plan = GenerationPlan(list(engine.dynamic_layers.keys()), list(engine.project_property_templates().keys()))
+
+        request = self.coverage_request(engine)
+        if feature_ids is not None:
+            request.setFilterFids(feature_ids)
+        if self.limit and self.limit >= 0:
+            request.setLimit(self.limit)
+
+        # Value of the field for each destination
+        destinations = {}
+        for feature in self.coverage.getFeatures(request):
+            if self.feedback and self.feedback.isCanceled():
+                return None
+
+            key = str(feature[self.field])
+            engine.set_layer_and_feature(self.coverage, feature)
+            try:
+                layers = engine.evaluate_dynamic_layers()
+                properties = engine.evaluate_project_properties()
+                destination = self.evaluate_destination(engine, expression_cache, feature)
+            except QgsProcessingException as e:
+                plan.add_error(feature.id(), key, str(e))
+                continue
+
+            error = None
+            if destination is None or destination == NULL or not str(destination):
+                error = tr('The destination is empty')
+            elif not str(destination).lower().endswith(('.qgs', '.qgz')):
+                error = tr('The destination {} must end with .qgs or .qgz').format(destination)
+            if error:
+                plan.add_error(feature.id(), key, error)
+                continue
+
+            if str(destination) in destinations:
+                plan.add_warning(
+                    feature.id(),
+                    key,
+                    tr(
+                        'The destination {} is the same as for the value \'{}\', the project will be overwritten'
+                    ).format(destination, destinations[str(destination)]))
+
+            destinations[str(destination)] = key
+            plan.add(feature.id(), key, str(destination), layers, properties)
+
+        log_message(
+            tr('Templates evaluated for {} features, {} errors, {} warnings').format(
+                len(plan), len(plan.errors), len(plan.warnings)),
+            Qgis.MessageLevel.Success,
+            self.feedback,
+            self.verbosity,
+        )
+        return plan
+
+    def discover_side_car_files(self, project_path: Path) -> SideCarFiles:
+        """ List side-car files and media folders of the template project. """
+        side_car = SideCarFiles(project_path, self.copy_strategy)
+        log_message(
+            lambda: tr('List of side-car files 1/2 : {}').format(str([str(f) for f in side_car.files])),
+            Qgis.MessageLevel.Info,
+            self.feedback,
+            self.verbosity,
+        )
+        if not side_car.lizmap_installed:
+            log_message(
+                tr('No latest Lizmap plugin installed, if it is needed in your case.'),
+                Qgis.MessageLevel.Info,
+                self.feedback,
+                self.verbosity,
+            )
+        log_message(
+            lambda: tr('List of side-car files 2/2 : {}').format(str([str(f) for f in side_car.media_dirs])),
+            Qgis.MessageLevel.Info,
+            self.feedback,
+            self.verbosity,
+        )
+        return side_car
+
+    def outputs(self, new_path: Path) -> list[str]:
+        """ All files and folders written for a new project, relative to the destination folder. """
+        outputs = [new_path]
+        if self.side_car:
+            outputs.extend(self.side_car.outputs(new_path))
+        return [Path(os.path.relpath(output, self.destination)).as_posix() for output in outputs]
+
+    def inputs_fingerprint(self) -> str | None:
+        """ Hash of inputs shared by all projects : the template project, the settings and the side-car files.
+
+        None if the project has unsaved changes, the file is not the same as the project in memory.
+        """
+        if not self.project.fileName() or self.project.isDirty():
+            return None
+
+        base_path = Path(self.project.fileName())
+        side_car = {}
+        if self.side_car:
+            for a_file in self.side_car.all_files():
+                side_car[a_file.relative_to(base_path.parent).as_posix()] = file_stats(a_file)
+
+        return content_hash(
+            file_hash(base_path),
+            self.field,
+            self.expression_destination,
+            self.copy_side_car_files,
+            self.copy_strategy,
+            self.backend,
+            side_car,
+        )
+
+    def plan_incremental(
+            self,
+            engine: DynamicLayersEngine,
+            manifest: GenerationManifest,
+    ) -> tuple[list[int], dict[int, tuple[str, dict]]]:
+        """ Compare evaluated templates of each feature of the plan with the manifest, to find projects to generate.
+
+        Entries of the manifest are keyed by the destination of the project, features having the same value in the
+        field have their own entry. Outputs of features which are not in the coverage layer anymore are removed.
+        Return the list of feature IDs to generate, and the new entry of the manifest for each of them.
+        """
+        fingerprint = self.inputs_fingerprint()
+        if fingerprint is None:
+            log_message(
+                tr('The project has unsaved changes, all projects will be generated.'),
+                Qgis.MessageLevel.Warning,
+                self.feedback,
+                self.verbosity,
+            )
+
+        # The coverage layer is not read again, the plan has the destination and the templates of each feature
+        feature_ids = []
+        planned = {}
+        outputs = {}
+        for feature_id in self.plan.feature_ids:
+            if self.feedback and self.feedback.isCanceled():
+                return [], {}
+
+            layers = self.plan.layer_values(feature_id)
+            properties = self.plan.property_values(feature_id)
+            key = self.plan.destination(feature_id)
+            outputs[key] = self.outputs(self.output_path(feature_id))
+
+            inputs_hash = None
+            if fingerprint:
+                data = {
+                    layer_id: datasource_stats(
+                        engine.dynamic_layers[layer_id].providerType(), values[LayerProperty.Datasource])
+                    for layer_id, values in layers.items()
+                }
+                inputs_hash = content_hash(fingerprint, layers, properties, outputs[key], data)
+
+            if manifest.is_up_to_date(key, inputs_hash, outputs[key]):
+                continue
+
+            feature_ids.append(feature_id)
+            planned[feature_id] = (key, {'hash': inputs_hash, 'outputs': outputs[key]})
+
+        # Outputs which are not written anymore, for features removed from the coverage layer or moved elsewhere
+        kept = {output for key_outputs in outputs.values() for output in key_outputs}
+        keys = list(outputs)
+        if self.feature_ids is None and not self.limit:
+            keys = list(manifest.entries)
+        obsolete = [output for output in manifest.outputs(keys) if output not in kept]
+        removed = manifest.remove_outputs(dict.fromkeys(obsolete))
+        if self.feature_ids is None and not self.limit:
+            for key in [key for key in manifest.entries if key not in outputs]:
+                del manifest.entries[key]
+        manifest.save()
+
+        log_message(
+            tr('{} projects to generate, {} projects unchanged, {} outdated files removed').format(
+                len(feature_ids), len(self.plan) - len(feature_ids), len(removed)),
+            Qgis.MessageLevel.Success,
+            self.feedback,
+            self.verbosity,
+        )
+        return feature_ids, planned
+
+    def update_manifest(self, manifest: GenerationManifest, planned: dict[int, tuple[str, dict]]):
+        """ Save the new entries of generated projects in the manifest. """
+        for feature_id in self.generated:
+            key, entry = planned[feature_id]
+            manifest.entries[key] = entry
+        manifest.save()
+
+    def representative_feature_ids(self) -> list[int]:
+        """ A single feature ID for each value of the field, the lowest one. """
+        groups = group_features_by_value(self.coverage, self.field, self.feature_ids)
+        feature_ids = sorted(min(group) for group in groups.values())
+        if self.limit and self.limit >= 0:
+            # For debug only
+            feature_ids = feature_ids[:self.limit]
+
+        log_message(
+            lambda: tr('{} features, {} distinct values in the field "{}"').format(
+                sum(len(group) for group in groups.values()), len(groups), self.field),
+            Qgis.MessageLevel.Success,
+            self.feedback,
+            self.verbosity,
+        )
+        return feature_ids
+
+    def can_reload_project(self) -> bool:
+        """ If the template project can be read again from its file during the run, see reload_interval. """
+        if not self.reload_interval:
+            return False
+
+        error = None
+        if self.project is QgsProject.instance():
+            error = tr('it is the current project')
+        elif not self.project.fileName() or self.project.isDirty():
+            error = tr('the project must be saved')
+        elif self.project.mapLayer(self.coverage.id()) and self.coverage.providerType() == 'memory':
+            error = tr('the coverage is a memory layer of the project')
+
+        if error:
+            log_message(
+                tr('The template project will not be read again : {}').format(error),
+                Qgis.MessageLevel.Warning,
+                self.feedback,
+                self.verbosity,
+            )
+            return False
+        return True
+
+    def coverage_features(
+            self, request: QgsFeatureRequest, engine: DynamicLayersEngine, reload_project: bool,
+    ) -> Iterator[QgsFeature]:
+        """ Features of the coverage layer for the loop.
+
+        With a reload interval, features are read by batches. Memory is released between two batches, while no feature
+        iterator is open on the coverage layer.
+        """
+        if not self.reload_interval:
+            yield from self.coverage.getFeatures(request)
+            return
+
+        ids_request = QgsFeatureRequest(request)
+        # noinspection PyUnresolvedReferences
+        ids_request.setFlags(QgsFeatureRequest.NoGeometry)
+        ids_request.setNoAttributes()
+        feature_ids = [feature.id() for feature in self.coverage.getFeatures(ids_request)]
+
+        for start in range(0, len(feature_ids), self.reload_interval):
+            if start:
+                self.release_memory(engine, reload_project)
+            batch_request = QgsFeatureRequest(request)
+            batch_request.setFilterFids(feature_ids[start:start + self.reload_interval])
+            batch_request.setLimit(-1)
+            yield from list(self.coverage.getFeatures(batch_request))
+
+    def release_memory(self, engine: DynamicLayersEngine, reload_project: bool):
+        """ Clear caches, and read the template project again if possible. """
+        if engine.expression_cache:
+            engine.expression_cache.clear()
+        if engine.provider_cache:
+            engine.provider_cache.clear()
+
+        if reload_project:
+            coverage_id = self.coverage.id()
+            owned = self.project.mapLayer(coverage_id) is not None
+            # Layers of the previous projects are deleted, with their providers
+            if not self.project.read(self.project.fileName()):
+                raise QgsProcessingException(
+                    tr('Impossible to read the project {} again').format(self.project.fileName()))
+            engine.discover_dynamic_layers_from_project(self.project)
+            if owned:
+                self.coverage = self.project.mapLayer(coverage_id)
+            self.reloads += 1
+        else:
+            self.project.undoStack().clear()
+            for layer in self.project.mapLayers().values():
+                layer.undoStack().clear()
+
+        gc.collect()
+        log_message(
+            lambda: tr('Memory released, the template project has been read again : {}').format(reload_project),
+            Qgis.MessageLevel.Info,
+            self.feedback,
+            self.verbosity,
+        )
+
+    def run_id(self) -> str:
+        """ Identifier of the run in the journal, a run can only be resumed with the same settings. """
+        return content_hash(
+            self.project.fileName(),
+            self.coverage.source(),
+            self.field,
+            self.expression_destination,
+            self.copy_side_car_files,
+            self.copy_strategy,
+            self.backend,
+            self.limit,
+            self.deduplicate,
+        )
+
+    def all_feature_ids(self) -> list[int]:
+        """ IDs of all features of the coverage layer. """
+        request = QgsFeatureRequest()
+        # noinspection PyUnresolvedReferences
+        request.setFlags(QgsFeatureRequest.NoGeometry)
+        request.setNoAttributes()
+        if self.limit and self.limit >= 0:
+            # For debug only
+            request.setLimit(self.limit)
+        return [feature.id() for feature in self.coverage.getFeatures(request)]
+
+    def process_parallel(self, feature_ids: list[int] | None = None, journal: GenerationJournal = None) -> bool:
+        """ Generate all projects with many processes. """
+        if feature_ids is None:
+            feature_ids = self.all_feature_ids()
+        # Only features having evaluated templates
+        feature_ids = [feature_id for feature_id in feature_ids if feature_id in self.plan]
+
+        log_message(
+            lambda: tr('Generating {} projects with {} processes').format(len(feature_ids), self.workers),
+            Qgis.MessageLevel.Success,
+            self.feedback,
+            self.verbosity,
+        )
+
+        options = {
+            'project': self.project.fileName(),
+            'coverage_id': self.coverage.id(),
+            'coverage_source': self.coverage.source(),
+            'coverage_name': self.coverage.name(),
+            'coverage_provider': self.coverage.providerType(),
+            'field': self.field,
+            'expression_destination': self.expression_destination,
+            'destination': str(self.destination),
+            'copy_side_car_files': self.copy_side_car_files,
+            'copy_strategy': self.copy_strategy,
+            'verbosity': self.verbosity,
+            'backend': self.backend,
+            'reuse_provider_metadata': self.reuse_provider_metadata,
+            'trace': str(self.trace) if self.trace else None,
+            'profile': self.profile,
+            'profile_interval': self.profile_interval,
+            'reload_interval': self.reload_interval,
+        }
+
+        def chunk_finished(result: dict):
+            """ Record projects generated by a worker. """
+            for feature_id, output in result['generated'].items():
+                self.generated[feature_id] = Path(output)
+                if journal:
+                    journal.record(feature_id, Path(output))
+            self.timings.merge(result['timings'])
+
+        success = generate_in_parallel(
+            options, feature_ids, self.plan, self.workers, self.feedback, chunk_finished)
+
+        if self.feedback:
+            self.feedback.setProgress(100)
+        return success
@@ -0,0 +1,167 @@
+__copyright__ = 'Copyright 2024, 3Liz'
+__license__ = 'GPL version 3'
+__email__ = 'info@3liz.org'
+
+import csv
+import json
+
+from array import array
+from pathlib import Path
+
+from dynamic_layers.definitions import LayerProperty
+
+""" Values of all templates for all features of the coverage layer, evaluated before generating any project. """
+
+# Properties of each dynamic layer in the plan
+LAYER_PROPERTIES = (LayerProperty.Datasource, LayerProperty.Title, LayerProperty.Name, LayerProperty.Abstract)
+
+
+class Column:
+    """ Values of a column, each distinct value is stored only once. """
+
+    def __init__(self):
+        """ Constructor. """
+        self.values: list[str] = []
+        self.codes = array('l')
+        self._index: dict[str, int] = {}
+
+    def __len__(self) -> int:
+        return len(self.codes)
+
+    def __getitem__(self, row: int) -> str:
+        return self.values[self.codes[row]]
+
+    def append(self, value: str):
+        """ Add the value of the next row. """
+        code = self._index.get(value)
+        if code is None:
+            code = len(self.values)
+            self.values.append(value)
+            self._index[value] = code
+        self.codes.append(code)
+
+
+class GenerationPlan:
+    """ Evaluated templates, a row for each feature and a column for each template.
+
+    Columns are the destination, the datasource, the title, the name and the abstract of each dynamic layer, and
+    project properties. Errors and warnings of all features are kept, to be reported at once.
+    """
+
+    def __init__(self, layer_ids: list[str], project_properties: list[str]):
+        """ Constructor. """
+        self.feature_ids = array('q')
+        # Row of each feature ID
+        self.rows: dict[int, int] = {}
+        self.keys = Column()
+        self.destinations = Column()
+        self.layers = {layer_id: {p: Column() for p in LAYER_PROPERTIES} for layer_id in layer_ids}
+        self.properties = {p: Column() for p in project_properties}
+        # Feature ID, value of the field and message
+        self.errors: list[tuple[int, str, str]] = []
+        # Feature ID, value of the field and message, the feature is in the plan
+        self.warnings: list[tuple[int, str, str]] = []
+
+    def __len__(self) -> int:
+        return len(self.feature_ids)
+
+    def __contains__(self, feature_id: int) -> bool:
+        return feature_id in self.rows
+
+    def add(
+            self,
+            feature_id: int,
+            key: str,
+            destination: str,
+            layers: dict[str, dict[str, str]],
+            properties: dict[str, str],
+    ):
+        """ Add the values of a feature. """
+        self.rows[feature_id] = len(self.feature_ids)
+        self.feature_ids.append(feature_id)
+        self.keys.append(key)
+        self.destinations.append(destination)
+        for layer_id, columns in self.layers.items():
+            for layer_property, column in columns.items():
+                column.append(layers[layer_id][layer_property])
+        for project_property, column in self.properties.items():
+            column.append(properties[project_property])
+
+    def subset(self, feature_ids: list[int]) -> 'GenerationPlan':
+        """ A plan with only the given features, to be sent to a worker process, without errors nor warnings. """
+        plan = GenerationPlan(list(self.layers), list(self.properties))
+        for feature_id in feature_ids:
+            row = self.rows.get(feature_id)
+            if row is None:
+                continue
+            plan.add(
+                feature_id,
+                self.keys[row],
+                self.destinations[row],
+                self.layer_values(feature_id),
+                self.property_values(feature_id),
+            )
+        return plan
+
+    def add_error(self, feature_id: int, key: str, message: str):
+        """ Add an error for a feature. """
+        self.errors.append((feature_id, key, message))
+
+    def add_warning(self, feature_id: int, key: str, message: str):
+        """ Add a warning for a feature, the project is still generated. """
+        self.warnings.append((feature_id, key, message))
+
+    def destination(self, feature_id: int) -> str:
+        """ Evaluated destination of the project, relative to the destination folder. """
+        return self.destinations[self.rows[feature_id]]
+
+    def layer_values(self, feature_id: int) -> dict[str, dict[str, str]]:
+        """ Evaluated templates of each dynamic layer, indexed by LayerProperty. """
+        row = self.rows[feature_id]
+        return {
+            layer_id: {layer_property: column[row] for layer_property, column in columns.items()}
+            for layer_id, columns in self.layers.items()
+        }
+
+    def property_values(self, feature_id: int) -> dict[str, str]:
+        """ Evaluated templates of project properties. """
+        row = self.rows[feature_id]
+        return {project_property: column[row] for project_property, column in self.properties.items()}
+
+    def header(self) -> list[str]:
+        """ Names of columns, "layer_id:property" for dynamic layers and "project:property" for the project. """
+        header = ['feature_id', 'key', 'destination']
+        for layer_id, columns in self.layers.items():
+            header.extend(f'{layer_id}:{layer_property}' for layer_property in columns)
+        header.extend(f'project:{project_property}' for project_property in self.properties)
+        return header
+
+    def records(self) -> list[dict]:
+        """ Rows of the plan, as dictionaries using the header. """
+        records = []
+        for row, feature_id in enumerate(self.feature_ids):
+            record = {'feature_id': feature_id, 'key': self.keys[row], 'destination': self.destinations[row]}
+            for layer_id, columns in self.layers.items():
+                for layer_property, column in columns.items():
+                    record[f'{layer_id}:{layer_property}'] = column[row]
+            for project_property, column in self.properties.items():
+                record[f'project:{project_property}'] = column[row]
+            records.append(record)
+        return records
+
+    def export(self, path: Path):
+        """ Write the plan, its errors and warnings, in JSON if the extension is ".json", otherwise in a CSV file. """
+        errors = [{'feature_id': f, 'key': k, 'error': message} for f, k, message in self.errors]
+        warnings = [{'feature_id': f, 'key': k, 'warning': message} for f, k, message in self.warnings]
+        if path.suffix.lower() == '.json':
+            path.write_text(json.dumps({'rows': self.records(), 'errors': errors, 'warnings': warnings}, indent=4))
+            return
+
+        records = self.records()
+        for warning in warnings:
+            records[self.rows[warning['feature_id']]]['warning'] = warning['warning']
+        with open(path, 'w', newline='', encoding='utf8') as f:
+            writer = csv.DictWriter(f, fieldnames=self.header() + ['warning', 'error'], restval='')
+            writer.writeheader()
+            writer.writerows(records)
+            writer.writerows(errors)
@@ -0,0 +1,159 @@
+__copyright__ = 'Copyright 2024, 3Liz'
+__license__ = 'GPL version 3'
+__email__ = 'info@3liz.org'
+
+from pathlib import Path
+
+from qgis.core import (
+    QgsFeature,
+    QgsMemoryProviderUtils,
+    QgsProcessingFeedback,
+    QgsProject,
+    QgsTask,
+    QgsVectorLayer,
+)
+from qgis.PyQt.QtCore import pyqtSignal
+
+from dynamic_layers.tools import tr
+
+""" Generate projects in a background task, with a copy of the saved project. """
+
+
+class TaskFeedback(QgsProcessingFeedback):
+    """ Feedback sending messages and progress to the task, they are received by the main thread with signals. """
+
+    def __init__(self, task: 'GenerationTask'):
+        super().__init__()
+        self.task = task
+
+    def setProgress(self, progress: float):
+        super().setProgress(progress)
+        self.task.setProgress(progress)
+
+    def pushInfo(self, text):
+        self.task.message.emit('pushInfo', text)
+
+    def pushCommandInfo(self, text):
+        self.task.message.emit('pushCommandInfo', text)
+
+    def pushDebugInfo(self, text):
+        self.task.message.emit('pushDebugInfo', text)
+
+    def pushConsoleInfo(self, text):
+        self.task.message.emit('pushConsoleInfo', text)
+
+    def pushWarning(self, text):
+        self.task.message.emit('pushWarning', text)
+
+    def reportError(self, text, fatal_error=False):
+        _ = fatal_error
+        self.task.message.emit('reportError', text)
+
+
+class GenerationTask(QgsTask):
+    """ Generate projects with GenerateProjects, in a task of the task manager.
+
+    The project is read again from its file in the task, the project must be saved. The project of the main thread is
+    not modified.
+
+    A memory coverage layer is copied in the task, its features get new IDs. The feature IDs given to the task and the
+    IDs of generated projects are the ones of the original layer. The journal records IDs of the copy, so a run can be
+    resumed only if the memory layer has not been edited since.
+    """
+
+    # Name of the feedback method and the message
+    message = pyqtSignal(str, str)
+
+    def __init__(
+            self,
+            project: QgsProject,
+            coverage: QgsVectorLayer,
+            field: str,
+            expression_destination: str,
+            destination: Path,
+            copy_side_car_files: bool,
+            **kwargs,
+    ):
+        """ Constructor, other keyword arguments are given to GenerateProjects. """
+        super().__init__(tr('Generate projects'), QgsTask.Flag.CanCancel)
+        self.project_path = project.fileName()
+        self.coverage_id = coverage.id()
+        self.coverage_source = coverage.source()
+        self.coverage_name = coverage.name()
+        self.coverage_provider = coverage.providerType()
+        # Features of a memory layer are not saved in the project, they are copied to a new memory layer in the task.
+        # Only features and fields are kept here, a layer can not be used in another thread than its own one.
+        self.coverage_features: list[QgsFeature] = []
+        self.coverage_fields = coverage.fields()
+        self.coverage_wkb_type = coverage.wkbType()
+        self.coverage_crs = coverage.crs()
+        if self.coverage_provider == 'memory':
+            self.coverage_features = list(coverage.getFeatures())
+        self.field = field
+        self.expression_destination = expression_destination
+        self.destination = destination
+        self.copy_side_car_files = copy_side_car_files
+        self.kwargs = kwargs
+        self.feedback = TaskFeedback(self)
+        # Result of the task
+        self.success = False
+        self.generated: dict[int, Path] = {}
+
+    def cancel(self):
+        self.feedback.cancel()
+        super().cancel()
+
+    def run(self) -> bool:
+        # Imported here, to not have a circular import
+        from dynamic_layers.core.generate_projects import GenerateProjects
+
+        # noinspection PyArgumentList
+        project = QgsProject()
+        if not project.read(self.project_path):
+            self.feedback.reportError(tr("Impossible to read the project {}").format(self.project_path))
+            return False
+
+        kwargs = dict(self.kwargs)
+        # Original feature IDs, for each feature ID of the copy of a memory layer
+        original_ids = {}
+        coverage = project.mapLayer(self.coverage_id)
+        if self.coverage_provider == 'memory':
+            coverage, original_ids = self.memory_coverage()
+            if kwargs.get('feature_ids') is not None:
+                new_ids = {original_id: new_id for new_id, original_id in original_ids.items()}
+                kwargs['feature_ids'] = [new_ids[fid] for fid in kwargs['feature_ids'] if fid in new_ids]
+        elif not isinstance(coverage, QgsVectorLayer):
+            coverage = QgsVectorLayer(self.coverage_source, self.coverage_name, self.coverage_provider)
+
+        generator = GenerateProjects(
+            project,
+            coverage,
+            self.field,
+            self.expression_destination,
+            self.destination,
+            self.copy_side_car_files,
+            self.feedback,
+            **kwargs,
+        )
+        try:
+            self.success = generator.process()
+        except Exception as e:
+            # QgsProcessingException or any other error, the task manager does not send it to the dialog
+            self.feedback.reportError(str(e))
+            self.success = False
+        finally:
+            self.generated = {original_ids.get(fid, fid): path for fid, path in generator.generated.items()}
+
+        return self.success and not self.isCanceled()
+
+    def memory_coverage(self) -> tuple[QgsVectorLayer, dict[int, int]]:
+        """ A new memory layer with features of the coverage layer, in the thread of the task.
+
+        The memory provider gives new IDs to features, the original ID of each new ID is returned as well.
+        """
+        # noinspection PyArgumentList
+        layer = QgsMemoryProviderUtils.createMemoryLayer(
+            self.coverage_name, self.coverage_fields, self.coverage_wkb_type, self.coverage_crs)
+        _, added = layer.dataProvider().addFeatures(self.coverage_features)
+        original_ids = {feature.id(): original.id() for feature, original in zip(added, self.coverage_features)}
+        return layer, original_ids
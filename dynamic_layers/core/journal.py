@@ -0,0 +1,121 @@
+__copyright__ = 'Copyright 2024, 3Liz'
+__license__ = 'GPL version 3'
+__email__ = 'info@3liz.org'
+
+import json
+import os
+import zipfile
+
+from pathlib import Path
+
+""" Journal of a generation run, to resume it after a crash or a cancellation. """
+
+JOURNAL_FILE = '.dynamic_layers_journal.jsonl'
+
+
+def partial_path(path: Path) -> Path:
+    """ Temporary path used while writing a file, "project.qgs" is written as "project.part.qgs" first.
+
+    It stays in the same folder, because relative paths are written by QGIS from the folder of the project.
+    """
+    return path.with_name(f"{path.stem}.part{path.suffix}")
+
+
+def publish_partial(path: Path):
+    """ Give their final names to the project written with partial_path() and to its auxiliary storage.
+
+    QGIS names the auxiliary storage and the files inside a QGZ archive from the name of the project, they are renamed
+    to be the same as if the project had been written directly. The project itself is renamed last.
+    """
+    part_path = partial_path(path)
+    if path.suffix.lower() == '.qgz' and zipfile.is_zipfile(part_path):
+        rename_archive_files(part_path, part_path.stem, path.stem)
+    else:
+        part_storage = part_path.with_suffix('.qgd')
+        if part_storage.exists():
+            os.replace(part_storage, path.with_suffix('.qgd'))
+    os.replace(part_path, path)
+
+
+def rename_archive_files(archive: Path, old_stem: str, new_stem: str):
+    """ Rename files of a QGZ archive named from the project, "project.part.qgs" becomes "project.qgs". """
+    temporary = archive.with_name(f"{archive.name}.tmp")
+    with zipfile.ZipFile(archive) as source, zipfile.ZipFile(temporary, 'w') as target:
+        for info in source.infolist():
+            content = source.read(info)
+            name = Path(info.filename)
+            if name.stem == old_stem:
+                info.filename = f"{new_stem}{name.suffix}"
+            target.writestr(info, content)
+    os.replace(temporary, archive)
+
+
+class GenerationJournal:
+    """ Append-only journal of generated projects, one JSON object per line.
+
+    The first line identifies the run. Each following line is written, flushed and synced in one go, after the
+    project has been written. A line truncated by a crash is ignored when reading the journal.
+    """
+
+    def __init__(self, destination: Path):
+        """ Constructor. """
+        self.destination = destination
+        self.path = destination.joinpath(JOURNAL_FILE)
+
+    def read(self, run: str) -> dict[int, str]:
+        """ Feature IDs and output paths already generated by the given run. """
+        completed = {}
+        try:
+            with open(self.path, encoding='utf8') as f:
+                lines = f.readlines()
+        except OSError:
+            return completed
+
+        header = self._parse(lines[0]) if lines else None
+        if not header or header.get('run') != run:
+            return completed
+
+        for line in lines[1:]:
+            entry = self._parse(line)
+            if entry and self.destination.joinpath(entry['output']).exists():
+                completed[entry['feature_id']] = entry['output']
+        return completed
+
+    def start(self, run: str, resume: bool) -> dict[int, str]:
+        """ Start the journal of the given run.
+
+        When resuming the same run, projects already generated are returned and the journal is kept. Otherwise, a new
+        journal is started.
+        """
+        completed = self.read(run) if resume else {}
+        if completed:
+            return completed
+
+        self._append({'run': run}, 'w')
+        return completed
+
+    def record(self, feature_id: int, output: Path):
+        """ Add a generated project in the journal. """
+        self._append({'feature_id': feature_id, 'output': Path(os.path.relpath(output, self.destination)).as_posix()})
+
+    def finish(self):
+        """ Remove the journal, at the end of a complete run. """
+        try:
+            self.path.unlink()
+        except OSError:
+            pass
+
+    def _append(self, entry: dict, mode: str = 'a'):
+        """ Write a line and sync it to the disk. """
+        with open(self.path, mode, encoding='utf8') as f:
+            f.write(json.dumps(entry) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+    @staticmethod
+    def _parse(line: str) -> dict | None:
+        """ Parse a line of the journal, None if it is truncated. """
+        try:
+            return json.loads(line)
+        except ValueError:
+            return None
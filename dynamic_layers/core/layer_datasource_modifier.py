@@ -6,16 +6,39 @@ import typing
 
 from qgis.core import (
     Qgis,
+    QgsAggregateCalculator,
+    QgsDataProvider,
+    QgsExpression,
+    QgsExpressionContext,
+    QgsExpressionContextUtils,
     QgsFeature,
+    QgsFeatureRequest,
     QgsMapLayer,
     QgsProcessingException,
     QgsProcessingFeedback,
     QgsProject,
+    QgsRasterLayer,
     QgsVectorLayer,
 )
+from qgis.PyQt.QtCore import NULL
 
-from dynamic_layers.definitions import CustomProperty
-from dynamic_layers.tools import log_message, string_substitution, tr
+from dynamic_layers.core.expression_context import DynamicExpressionContext
+from dynamic_layers.core.provider_cache import ProviderMetadataCache
+from dynamic_layers.definitions import (
+    CustomProperty,
+    GraduatedClassification,
+    LayerProperty,
+    Verbosity,
+)
+from dynamic_layers.tools import (
+    ExpressionCache,
+    log_message,
+    string_substitution,
+    tr,
+)
+
+# Number of features read to compute the range of a graduated renderer, with the sample policy
+SAMPLE_SIZE = 1000
 
 
 class LayerDataSourceModifier:
@@ -27,6 +50,10 @@ class LayerDataSourceModifier:
             layer_context: QgsVectorLayer,
             feature: QgsFeature,
             feedback: QgsProcessingFeedback = None,
+            expression_cache: ExpressionCache = None,
+            expression_context: DynamicExpressionContext = None,
+            verbosity: int = Verbosity.Debug,
+            provider_cache: ProviderMetadataCache = None,
     ):
         """
         Initialize class instance
@@ -36,10 +63,17 @@ class LayerDataSourceModifier:
         self.layer_context = layer_context
         self.feature = feature
         self.feedback = feedback
+        self.expression_cache = expression_cache
+        self.expression_context = expression_context
+        self.verbosity = verbosity
+        # Schema of layers, known from previous datasources
+        self.provider_cache = provider_cache
         # Datasource can be changed from dynamicDatasourceContent or not
         self.dynamic_datasource_active = layer.customProperty(CustomProperty.DynamicDatasourceActive)
         # Content of the dynamic datasource
         self.dynamic_datasource_content = layer.customProperty(CustomProperty.DynamicDatasourceContent)
+        # If the range of the graduated renderer has been updated with the new datasource
+        self.classes_updated = False
 
     def compute_new_uri(self, search_and_replace_dictionary: dict = None):
         """
@@ -47,6 +81,16 @@ class LayerDataSourceModifier:
         Replace variable with passed data,
         And set the layer datasource from this content if possible
         """
+        new_uri = self.evaluate_uri(search_and_replace_dictionary)
+
+        # Set the layer datasource
+        self.set_data_source(new_uri)
+
+        # Set other properties
+        self.set_dynamic_layer_properties(search_and_replace_dictionary)
+
+    def evaluate_uri(self, search_and_replace_dictionary: dict | None = None) -> str:
+        """ Evaluate the dynamic datasource template, without modifying the layer. """
         if search_and_replace_dictionary is None:
             search_and_replace_dictionary = {}
 
@@ -57,6 +101,9 @@ class LayerDataSourceModifier:
             layer=self.layer_context,
             feature=self.feature,
             feedback=self.feedback,
+            cache=self.expression_cache,
+            context=self.context(self.layer_context),
+            verbosity=self.verbosity,
         )
 
         if not new_uri:
@@ -64,15 +111,50 @@ class LayerDataSourceModifier:
                 "New URI is invalid. Was it a valid QGIS expression ?"
             ) + " " + str(new_uri))
 
-        # Set the layer datasource
-        self.set_data_source(new_uri)
+        return new_uri
 
-        # Set other properties
-        self.set_dynamic_layer_properties(search_and_replace_dictionary)
+    def context(self, layer: QgsMapLayer) -> QgsExpressionContext | None:
+        """ The shared expression context for the given layer, if any. """
+        if self.expression_context is None:
+            return None
+        return self.expression_context.context(layer)
+
+    def provider_flags(self) -> QgsDataProvider.ReadFlags:
+        """ Flags to load the new provider, according to the layer type.
+
+        The default style of the datasource is never loaded, the current style of the layer is kept, for instance the
+        style of a vector tile layer. Raster, mesh, point cloud and vector tile layers trust their datasource, it has
+        already been checked when the layer has been added in the project.
+
+        These flags don't prevent QGIS from computing the statistics of a raster band for its default renderer, when
+        the provider is loaded. The renderer of the layer is set again afterwards, with the min/max values of the
+        template, see set_data_source().
+        """
+        # noinspection PyUnresolvedReferences
+        flags = QgsDataProvider.ReadFlags()
+        if not isinstance(self.layer, QgsVectorLayer):
+            # noinspection PyUnresolvedReferences
+            flags |= QgsDataProvider.FlagTrustDataSource
+        return flags
 
     def set_data_source(self, new_source_uri: str):
-        """ Method to apply a new datasource to a vector layer. """
-        self.layer.setDataSource(new_source_uri, self.layer.name(), self.layer.dataProvider().name())
+        """ Method to apply a new datasource to a layer, according to its type. """
+        if self.provider_cache is not None and isinstance(self.layer, QgsVectorLayer):
+            self.provider_cache.set_data_source(self.layer, new_source_uri)
+        else:
+            # The raster renderer, with its min/max values, is set again after the new provider
+            renderer = None
+            if isinstance(self.layer, QgsRasterLayer) and self.layer.renderer():
+                renderer = self.layer.renderer().clone()
+
+            options = QgsDataProvider.ProviderOptions()
+            options.transformContext = self.layer.transformContext()
+            # The provider type is known even if the current datasource is not valid
+            self.layer.setDataSource(
+                new_source_uri, self.layer.name(), self.layer.providerType(), options, self.provider_flags())
+
+            if renderer and self.layer.isValid():
+                self.layer.setRenderer(renderer)
 
         if not self.layer.isValid():
             log_message(
@@ -81,22 +163,131 @@ class LayerDataSourceModifier:
                 ).format(name=self.layer.name(), error=self.layer.error()),
                 Qgis.MessageLevel.Critical,
                 self.feedback,
+                self.verbosity,
             )
             return
 
-        # Update layer extent
-        self.layer.updateExtents(True)
+        if not isinstance(self.layer, QgsVectorLayer):
+            # Nothing else to do, the extent and the style are not computed from features
+            return
+
+        # The layer extent is updated by the engine, once all datasources are set
 
         # Update graduated symbol renderer
-        if self.layer.renderer() and self.layer.renderer().type() == 'graduatedSymbol':
-            ranges = self.layer.renderer().ranges()
-            if len(ranges) == 1:
-                self.layer.renderer().updateClasses(self.layer, self.layer.renderer().mode(), len(ranges))
+        self.classes_updated = self.update_graduated_classes()
 
         # Reload layer
         # self.layer.reload()
         # self.layer.triggerRepaint()
 
+    def classification_policy(self) -> str:
+        """ How the graduated renderer is updated, see GraduatedClassification. """
+        policy = self.layer.customProperty(CustomProperty.GraduatedClassification)
+        return policy or GraduatedClassification.Always
+
+    def update_graduated_classes(self) -> bool:
+        """ Update the single range of a graduated renderer, according to the policy of the layer.
+
+        Return True if the range has been updated.
+        """
+        renderer = self.layer.renderer()
+        if not renderer or renderer.type() != 'graduatedSymbol':
+            return False
+
+        ranges = renderer.ranges()
+        if len(ranges) != 1:
+            return False
+
+        policy = self.classification_policy()
+        if policy == GraduatedClassification.Never:
+            return False
+
+        if policy == GraduatedClassification.Always:
+            renderer.updateClasses(self.layer, renderer.mode(), len(ranges))
+            return True
+
+        if policy == GraduatedClassification.Sample:
+            bounds = self.sampled_bounds(renderer.classAttribute())
+        else:
+            bounds = self.statistics_bounds(renderer.classAttribute())
+
+        if bounds is None:
+            log_message(
+                lambda: tr("No value to classify the layer '{}'").format(self.layer.name()),
+                Qgis.MessageLevel.Info,
+                self.feedback,
+                self.verbosity,
+            )
+            return False
+
+        minimum, maximum = bounds
+        renderer.updateRangeLowerValue(0, minimum)
+        renderer.updateRangeUpperValue(0, maximum)
+        renderer.updateRangeLabel(0, renderer.classificationMethod().labelForRange(minimum, maximum))
+        return True
+
+    def statistics_bounds(self, attribute: str) -> tuple[float, float] | None:
+        """ Minimum and maximum values of a field computed by the provider, without fetching features.
+
+        For an expression, aggregates are computed by QGIS instead.
+        """
+        index = self.layer.fields().lookupField(attribute)
+        if index >= 0:
+            values = self.layer.minimumAndMaximumValue(index)
+        else:
+            values = []
+            # noinspection PyUnresolvedReferences
+            for aggregate in (QgsAggregateCalculator.Min, QgsAggregateCalculator.Max):
+                value, ok = self.layer.aggregate(aggregate, attribute)
+                if not ok:
+                    return None
+                values.append(value)
+
+        return self.bounds(values)
+
+    def sampled_bounds(self, attribute: str) -> tuple[float, float] | None:
+        """ Minimum and maximum values of a field or an expression, from the first features only. """
+        request = QgsFeatureRequest()
+        request.setLimit(SAMPLE_SIZE)
+
+        index = self.layer.fields().lookupField(attribute)
+        if index >= 0:
+            # noinspection PyUnresolvedReferences
+            request.setFlags(QgsFeatureRequest.NoGeometry)
+            request.setSubsetOfAttributes([index])
+            return self.bounds(feature.attribute(index) for feature in self.layer.getFeatures(request))
+
+        expression = QgsExpression(attribute)
+        # noinspection PyArgumentList
+        context = QgsExpressionContext(QgsExpressionContextUtils.globalProjectLayerScopes(self.layer))
+        expression.prepare(context)
+        if not expression.needsGeometry():
+            # noinspection PyUnresolvedReferences
+            request.setFlags(QgsFeatureRequest.NoGeometry)
+        request.setSubsetOfAttributes(expression.referencedColumns(), self.layer.fields())
+
+        values = []
+        for feature in self.layer.getFeatures(request):
+            context.setFeature(feature)
+            values.append(expression.evaluate(context))
+        return self.bounds(values)
+
+    @staticmethod
+    def bounds(values: typing.Iterable) -> tuple[float, float] | None:
+        """ Minimum and maximum of numeric values, NULL and other values are ignored. """
+        numbers = []
+        for value in values:
+            if value is None or value == NULL:
+                continue
+            try:
+                numbers.append(float(value))
+            except (TypeError, ValueError):
+                continue
+
+        if not numbers:
+            return None
+        return min(numbers), max(numbers)
+
     @staticmethod
     def split_source(source: str) -> typing.Tuple[str, str]:
         """ Split QGIS datasource into meaningful components. """
@@ -109,12 +300,8 @@ class LayerDataSourceModifier:
             uri = source.replace('\\', '/')
         return datasource_type, uri
 
-    def set_dynamic_layer_properties(self, search_and_replace_dictionary: dict = None):
-        """ Set layer title, abstract etc. """
-        if search_and_replace_dictionary is None:
-            search_and_replace_dictionary = {}
-
-        # Layer title
+    def title_template(self) -> str:
+        """ The expression used for the layer title, the current title if there isn't any template. """
         # First check that we have a title
         source_title = self.layer.name().strip()
         title = self.layer.title().strip()
@@ -126,37 +313,19 @@ class LayerDataSourceModifier:
         title_template = self.layer.customProperty(CustomProperty.TitleTemplate)
         if title_template and title_template not in ("", "''"):
             source_title = title_template
+        return source_title
 
-        # Search and replace content
-        log_message(tr("Compute new value for layer title"), Qgis.MessageLevel.Info, self.feedback)
-        title = string_substitution(
-            input_string=source_title,
-            variables=search_and_replace_dictionary,
-            project=self.project,
-            layer=self.layer,
-            feature=self.feature,
-        )
-        self.layer.setTitle(title)
-
-        # Name
+    def name_template(self) -> str:
+        """ The expression used for the layer name, the current name if there isn't any template. """
         source_name = self.layer.name().strip()
         source_name = f"'{source_name}'"
         name_template = self.layer.customProperty(CustomProperty.NameTemplate)
         if name_template and name_template not in ("", "''"):
             source_name = name_template
+        return source_name
 
-        # Search and replace content
-        log_message(tr("Compute new value for layer name"), Qgis.MessageLevel.Info, self.feedback)
-        name = string_substitution(
-            input_string=source_name,
-            variables=search_and_replace_dictionary,
-            project=self.project,
-            layer=self.layer,
-            feature=self.feature,
-        )
-        self.layer.setName(name)
-
-        # Abstract
+    def abstract_template(self) -> str:
+        """ The expression used for the layer abstract, the current abstract if there isn't any template. """
         source_abstract = ''
         if self.layer.abstract().strip() != '':
             source_abstract = self.layer.abstract().strip()
@@ -165,16 +334,82 @@ class LayerDataSourceModifier:
         abstract_template = self.layer.customProperty(CustomProperty.AbstractTemplate)
         if abstract_template and abstract_template not in ("", "''"):
             source_abstract = abstract_template
+        return source_abstract
+
+    def templates(self) -> list[str]:
+        """ All expressions used by this layer. """
+        return [
+            self.dynamic_datasource_content,
+            self.title_template(),
+            self.name_template(),
+            self.abstract_template(),
+        ]
+
+    def property_templates(self) -> dict[str, str]:
+        """ Templates of the layer name, title and abstract, indexed by LayerProperty.
+
+        The name is the first one, @layer_name is the new name of the layer in the title and abstract templates.
+        """
+        return {
+            LayerProperty.Name: self.name_template(),
+            LayerProperty.Title: self.title_template(),
+            LayerProperty.Abstract: self.abstract_template(),
+        }
+
+    def evaluate_property(self, layer_property: str, search_and_replace_dictionary: dict | None = None) -> str:
+        """ Evaluate the template of the layer title, name or abstract, without modifying the layer. """
+        if search_and_replace_dictionary is None:
+            search_and_replace_dictionary = {}
 
-        log_message(tr("Compute new value for layer abstract"), Qgis.MessageLevel.Info, self.feedback)
-        abstract = string_substitution(
-            input_string=source_abstract,
+        # Search and replace content
+        log_message(
+            lambda: tr("Compute new value for layer {}").format(layer_property),
+            Qgis.MessageLevel.Info,
+            self.feedback,
+            self.verbosity,
+        )
+        return string_substitution(
+            input_string=self.property_templates()[layer_property],
             variables=search_and_replace_dictionary,
             project=self.project,
             layer=self.layer,
             feature=self.feature,
+            cache=self.expression_cache,
+            context=self.context(self.layer),
+            verbosity=self.verbosity,
         )
-        self.layer.setAbstract(abstract)
+
+    def evaluate_properties(self, search_and_replace_dictionary: dict | None = None) -> dict[str, str]:
+        """ Evaluate the layer title, name and abstract templates, without modifying the layer. """
+        return {
+            layer_property: self.evaluate_property(layer_property, search_and_replace_dictionary)
+            for layer_property in self.property_templates()
+        }
+
+    def apply_values(self, values: dict[str, str], previous: dict[str, str]):
+        """ Set the datasource, the title, the name and the abstract of the layer, indexed by LayerProperty.
+
+        Values equal to the previous ones are not set again. Previous values are updated.
+        """
+        if values[LayerProperty.Datasource] != previous.get(LayerProperty.Datasource):
+            self.set_data_source(values[LayerProperty.Datasource])
+
+        for layer_property, setter in (
+                (LayerProperty.Title, self.layer.setTitle),
+                (LayerProperty.Name, self.layer.setName),
+                (LayerProperty.Abstract, self.layer.setAbstract),
+        ):
+            if values[layer_property] != previous.get(layer_property):
+                setter(values[layer_property])
+
+        previous.update(values)
+
+    def set_dynamic_layer_properties(self, search_and_replace_dictionary: dict | None = None):
+        """ Set layer title, abstract etc. """
+        values = self.evaluate_properties(search_and_replace_dictionary)
+        self.layer.setTitle(values[LayerProperty.Title])
+        self.layer.setName(values[LayerProperty.Name])
+        self.layer.setAbstract(values[LayerProperty.Abstract])
 
         return
 
@@ -0,0 +1,125 @@
+__copyright__ = 'Copyright 2024, 3Liz'
+__license__ = 'GPL version 3'
+__email__ = 'info@3liz.org'
+
+import hashlib
+import json
+import os
+import shutil
+
+from collections.abc import Iterable
+from pathlib import Path
+
+from qgis.core import QgsProviderRegistry
+
+""" Manifest of generated projects, to generate only projects having new inputs. """
+
+MANIFEST_FILE = '.dynamic_layers_manifest.json'
+MANIFEST_VERSION = 2
+
+
+def file_stats(path: Path) -> list[int] | None:
+    """ Modification time and size of a file, None if the file doesn't exist. """
+    try:
+        stat = path.stat()
+    except OSError:
+        return None
+    return [stat.st_mtime_ns, stat.st_size]
+
+
+def file_hash(path: Path) -> str:
+    """ SHA-256 of the content of a file. """
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def content_hash(*values) -> str:
+    """ SHA-256 of JSON serializable values. """
+    content = json.dumps(values, sort_keys=True, default=str)
+    return hashlib.sha256(content.encode('utf-8')).hexdigest()
+
+
+def datasource_stats(provider: str, source: str) -> list[int] | None:
+    """ Statistics of the file behind a datasource, None if it's not a local file. """
+    path = QgsProviderRegistry.instance().decodeUri(provider, source).get('path')
+    if not path:
+        return None
+    return file_stats(Path(path))
+
+
+class GenerationManifest:
+    """ Hash of inputs and list of outputs, for each generated project.
+
+    Entries are keyed by the destination of the project, relative to the destination folder. The hash of an entry
+    covers the template project, the side-car files and the evaluated templates of the feature, so a project is
+    generated again if any of them has changed.
+    """
+
+    def __init__(self, destination: Path):
+        """ Constructor. """
+        self.destination = destination
+        self.path = destination.joinpath(MANIFEST_FILE)
+        self.entries: dict[str, dict] = {}
+
+    @classmethod
+    def load(cls, destination: Path) -> 'GenerationManifest':
+        """ Read the manifest from the destination folder, it's empty if the file is missing or not valid. """
+        manifest = cls(destination)
+        try:
+            with open(manifest.path, encoding='utf8') as f:
+                content = json.load(f)
+        except (OSError, ValueError):
+            return manifest
+
+        if content.get('version') == MANIFEST_VERSION:
+            manifest.entries = content.get('entries', {})
+        return manifest
+
+    def save(self):
+        """ Write the manifest, the previous file is replaced only when the new one is complete. """
+        temporary = self.path.with_name(self.path.name + '.tmp')
+        with open(temporary, 'w', encoding='utf8') as f:
+            json.dump({'version': MANIFEST_VERSION, 'entries': self.entries}, f, indent=1, sort_keys=True)
+            f.write("\n")
+        os.replace(temporary, self.path)
+
+    def is_up_to_date(self, key: str, inputs_hash: str | None, outputs: list[str]) -> bool:
+        """ If the project for this key has been generated with the same inputs, and its outputs are still there. """
+        if inputs_hash is None:
+            return False
+
+        entry = self.entries.get(key)
+        if not entry or entry.get('hash') != inputs_hash or entry.get('outputs') != outputs:
+            return False
+
+        return all(self.destination.joinpath(output).exists() for output in outputs)
+
+    def outputs(self, keys: Iterable[str] | None = None) -> list[str]:
+        """ All outputs of the given keys, or of all entries. """
+        if keys is None:
+            keys = self.entries.keys()
+        outputs = []
+        for key in keys:
+            outputs.extend(self.entries.get(key, {}).get('outputs', []))
+        return outputs
+
+    def remove_outputs(self, outputs: Iterable[str]) -> list[str]:
+        """ Remove files and folders from the destination, only if they are inside the destination folder. """
+        destination = self.destination.resolve()
+        removed = []
+        for output in outputs:
+            path = self.destination.joinpath(output)
+            if destination not in path.resolve().parents:
+                continue
+
+            if path.is_dir() and not path.is_symlink():
+                shutil.rmtree(path, ignore_errors=True)
+            elif path.exists() or path.is_symlink():
+                path.unlink()
+            else:
+                continue
+            removed.append(output)
+        return removed
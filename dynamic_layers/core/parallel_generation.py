@@ -0,0 +1,264 @@
+__copyright__ = 'Copyright 2024, 3Liz'
+__license__ = 'GPL version 3'
+__email__ = 'info@3liz.org'
+
+import atexit
+import multiprocessing
+import multiprocessing.spawn
+import os
+import sys
+
+from collections.abc import Callable
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from pathlib import Path
+
+from qgis.core import (
+    QgsApplication,
+    QgsProcessingException,
+    QgsProcessingFeedback,
+    QgsProject,
+    QgsVectorLayer,
+)
+
+from dynamic_layers.core.generation_plan import GenerationPlan
+from dynamic_layers.core.timings import PhaseTimings
+from dynamic_layers.tools import tr
+
+""" Generate projects with many processes, each process has its own copy of the template project. """
+
+# The QGIS application of a worker process, it must stay alive during the lifetime of the process
+_application = None
+# The generator of a worker process, with its own copy of the template project, kept for all slices
+_generator = None
+# The error if the worker process can not read the template project
+_error = None
+
+
+class CollectingFeedback(QgsProcessingFeedback):
+    """ Feedback storing all messages of a worker, to send them back to the main process. """
+
+    def __init__(self):
+        super().__init__()
+        self.messages: list[tuple[str, str]] = []
+
+    def pushInfo(self, text):
+        self.messages.append(('pushInfo', text))
+
+    def pushCommandInfo(self, text):
+        self.messages.append(('pushCommandInfo', text))
+
+    def pushDebugInfo(self, text):
+        self.messages.append(('pushDebugInfo', text))
+
+    def pushConsoleInfo(self, text):
+        self.messages.append(('pushConsoleInfo', text))
+
+    def pushWarning(self, text):
+        self.messages.append(('pushWarning', text))
+
+    def reportError(self, text, fatal_error=False):
+        _ = fatal_error
+        self.messages.append(('reportError', text))
+
+
+def python_executable() -> str | None:
+    """ The Python interpreter to start worker processes, None if it is unknown.
+
+    Inside QGIS Desktop, sys.executable is often the QGIS binary itself. Another interpreter found on the system may
+    not have the QGIS libraries, so it is never guessed.
+    """
+    executable = Path(sys.executable)
+    if executable.name.lower().startswith('python'):
+        return str(executable)
+    return None
+
+
+def can_run_in_parallel(project: QgsProject, coverage: QgsVectorLayer) -> str | None:
+    """ Check if a worker process can open the template project and the coverage layer.
+
+    Return an error message if it's not possible.
+    """
+    if not project.fileName() or project.isDirty():
+        return tr("The project must be saved to be opened by each process.")
+
+    if coverage.providerType() == 'memory':
+        # Memory layers are saved without their features in the project
+        return tr("A memory coverage layer can not be shared between processes.")
+
+    if not python_executable():
+        return tr(
+            "The Python interpreter is unknown, {} is not a Python executable. Use the command line to generate "
+            "projects with many processes.").format(sys.executable)
+
+    return None
+
+
+def _init_worker(options: dict):
+    """ Start a headless QGIS application in the worker process, and read the template project only once. """
+    global _application, _generator, _error
+    os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+    _application = QgsApplication([], False)
+    _application.initQgis()
+
+    # Imported here, to not have a circular import
+    from dynamic_layers.core.generate_projects import GenerateProjects
+
+    # noinspection PyArgumentList
+    project = QgsProject()
+    if not project.read(options['project']):
+        _error = tr("Impossible to read the project {} in the worker process").format(options['project'])
+        return
+
+    coverage = project.mapLayer(options['coverage_id'])
+    if not coverage:
+        coverage = QgsVectorLayer(options['coverage_source'], options['coverage_name'], options['coverage_provider'])
+
+    _generator = GenerateProjects(
+        project,
+        coverage,
+        options['field'],
+        options['expression_destination'],
+        Path(options['destination']),
+        options['copy_side_car_files'],
+        verbosity=options['verbosity'],
+        backend=options['backend'],
+        copy_strategy=options['copy_strategy'],
+        reuse_provider_metadata=options['reuse_provider_metadata'],
+        trace=Path(options['trace']) if options['trace'] else None,
+        profile=options['profile'],
+        profile_interval=options['profile_interval'],
+        reload_interval=options['reload_interval'],
+    )
+    if options['profile']:
+        # A single profile for all slices of the worker process, written when the process exits
+        _generator.start_profiler(f'_{os.getpid()}')
+        atexit.register(_generator.stop_profiler)
+
+
+def generate_chunk(feature_ids: list[int], plan: GenerationPlan) -> dict:
+    """ Generate projects for a slice of the coverage layer, in a worker process.
+
+    Templates have been evaluated by the main process, only the rows of the slice are sent.
+    """
+    feedback = CollectingFeedback()
+    if _generator is None:
+        feedback.reportError(_error)
+        return {
+            'success': False,
+            'count': 0,
+            'messages': feedback.messages,
+            'generated': {},
+            'timings': PhaseTimings().to_dict(),
+        }
+
+    _generator.feedback = feedback
+    try:
+        success = _generator.process_slice(feature_ids, plan)
+    except QgsProcessingException as e:
+        feedback.reportError(str(e))
+        success = False
+
+    return {
+        'success': success,
+        'count': len(feature_ids),
+        'messages': feedback.messages,
+        'generated': {feature_id: str(path) for feature_id, path in _generator.generated.items()},
+        'timings': _generator.timings.to_dict(),
+    }
+
+
+def chunks(feature_ids: list[int], workers: int) -> list[list[int]]:
+    """ Split feature IDs in small slices, to have a regular progress and to balance the load between workers. """
+    size = max(1, min(50, len(feature_ids) // (workers * 4)))
+    return [feature_ids[i:i + size] for i in range(0, len(feature_ids), size)]
+
+
+def generate_in_parallel(
+        options: dict,
+        feature_ids: list[int],
+        plan: GenerationPlan,
+        workers: int,
+        feedback: QgsProcessingFeedback = None,
+        callback: Callable[[dict], None] | None = None,
+) -> bool:
+    """ Dispatch all feature IDs between many worker processes, with the rows of the plan of each slice.
+
+    Messages and errors from workers are forwarded to the given feedback when a slice is finished. The callback is
+    called with the result of each slice, in the main process.
+    """
+    executable = python_executable()
+    if not executable:
+        raise QgsProcessingException(
+            tr("The Python interpreter is unknown, {} is not a Python executable").format(sys.executable))
+
+    # The executable is global to all spawned processes, it is restored when the pool is closed
+    previous_executable = multiprocessing.spawn.get_executable()
+    context = multiprocessing.get_context('spawn')
+    context.set_executable(executable)
+    try:
+        return _generate_in_pool(context, options, feature_ids, plan, workers, feedback, callback)
+    finally:
+        context.set_executable(previous_executable)
+
+
+def _generate_in_pool(
+        context: multiprocessing.context.SpawnContext,
+        options: dict,
+        feature_ids: list[int],
+        plan: GenerationPlan,
+        workers: int,
+        feedback: QgsProcessingFeedback | None,
+        callback: Callable[[dict], None] | None,
+) -> bool:
+    """ Generate projects in a pool of worker processes, see generate_in_parallel(). """
+    success = True
+    done = 0
+    total = len(feature_ids)
+    with ProcessPoolExecutor(
+            max_workers=workers, mp_context=context, initializer=_init_worker, initargs=(options,)) as executor:
+        # Feature IDs of each slice
+        slices = {
+            executor.submit(generate_chunk, ids, plan.subset(ids)): ids for ids in chunks(feature_ids, workers)}
+        pending = set(slices)
+        while pending:
+            finished, pending = wait(pending, timeout=1, return_when=FIRST_COMPLETED)
+            broken = None
+            for future in finished:
+                try:
+                    result = future.result()
+                except BrokenProcessPool as e:
+                    # A worker process has crashed, the pool can not be used anymore
+                    broken = e
+                    continue
+
+                success = success and result['success']
+                done += result['count']
+                if callback:
+                    callback(result)
+                if feedback:
+                    for method, text in result['messages']:
+                        getattr(feedback, method)(text)
+                    feedback.setProgress(int(done * 100 / total))
+
+            if broken:
+                # Slices not finished, or finished by the crash
+                lost = []
+                for future, ids in slices.items():
+                    if not future.done() or future.exception() is not None:
+                        lost.extend(ids)
+                if feedback:
+                    feedback.reportError(
+                        tr('A worker process has crashed : {}. No project for these feature IDs : {}').format(
+                            broken, ', '.join(str(feature_id) for feature_id in sorted(lost))),
+                        True)
+                executor.shutdown(wait=True, cancel_futures=True)
+                return False
+
+            if feedback and feedback.isCanceled():
+                for future in pending:
+                    future.cancel()
+                executor.shutdown(wait=True, cancel_futures=True)
+                return False
+
+    return success
@@ -0,0 +1,90 @@
+__copyright__ = 'Copyright 2024, 3Liz'
+__license__ = 'GPL version 3'
+__email__ = 'info@3liz.org'
+
+import cProfile
+import tracemalloc
+
+from pathlib import Path
+
+""" CPU profile and memory allocations of a generation run, to be attached to a bug report. """
+
+PROFILE_FILE = 'dynamic_layers{}.prof'
+MEMORY_FILE = 'dynamic_layers_memory{}.txt'
+
+# Number of frames kept for each allocation
+FRAMES = 10
+
+
+class GenerationProfiler:
+    """ cProfile around the run, and the top allocation sites from tracemalloc, at the start and every N features.
+
+    Allocation sites are compared to the snapshot taken at the start, to spot what keeps growing in the loop over
+    features. Files are written in the destination folder, with a suffix for each worker process.
+    """
+
+    def __init__(self, destination: Path, interval: int = 100, top: int = 20, suffix: str = ''):
+        """ Constructor. """
+        self.profile_path = destination.joinpath(PROFILE_FILE.format(suffix))
+        self.memory_path = destination.joinpath(MEMORY_FILE.format(suffix))
+        self.interval = interval
+        self.top = top
+        self.profiler = cProfile.Profile()
+        self.first: tracemalloc.Snapshot | None = None
+        self.features = 0
+        # Only if tracemalloc has been started by the profiler
+        self.tracing = False
+
+    def start(self):
+        """ Take the first snapshot and start the CPU profile. """
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(FRAMES)
+            self.tracing = True
+
+        self.first = self.snapshot()
+        with open(self.memory_path, 'w', encoding='utf8') as f:
+            f.write(f"Top {self.top} allocation sites at the start\n")
+            f.writelines(f"{statistic}\n" for statistic in self.first.statistics('lineno')[0:self.top])
+
+        self.profiler.enable()
+
+    def feature_done(self):
+        """ Compare allocations with the start, every N features. """
+        self.features += 1
+        if self.interval and self.features % self.interval == 0:
+            self.write_allocations()
+
+    def stop(self):
+        """ Stop the CPU profile, and write the profile and the last allocations. """
+        self.profiler.disable()
+        if not self.interval or self.features % self.interval:
+            self.write_allocations()
+        self.profiler.dump_stats(str(self.profile_path))
+
+        self.first = None
+        if self.tracing:
+            tracemalloc.stop()
+            self.tracing = False
+
+    def write_allocations(self):
+        """ Append the top allocation sites, compared to the start. """
+        # The profile must not include the snapshot
+        self.profiler.disable()
+        snapshot = self.snapshot()
+        current, peak = tracemalloc.get_traced_memory()
+        with open(self.memory_path, 'a', encoding='utf8') as f:
+            f.write(
+                f"\nAfter {self.features} features, traced memory {current / 1024:.0f} kB, peak {peak / 1024:.0f} kB, "
+                f"top {self.top} allocation sites compared to the start\n")
+            f.writelines(f"{statistic}\n" for statistic in snapshot.compare_to(self.first, 'lineno')[0:self.top])
+        self.profiler.enable()
+
+    @staticmethod
+    def snapshot() -> tracemalloc.Snapshot:
+        """ Allocations, without the ones of the profiler, of tracemalloc itself and of imports. """
+        return tracemalloc.take_snapshot().filter_traces((
+            tracemalloc.Filter(False, __file__),
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+            tracemalloc.Filter(False, '<frozen importlib._bootstrap_external>'),
+        ))
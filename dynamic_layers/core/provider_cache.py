@@ -0,0 +1,103 @@
+__copyright__ = 'Copyright 2024, 3Liz'
+__license__ = 'GPL version 3'
+__email__ = 'info@3liz.org'
+
+
+from qgis.core import (
+    QgsDataProvider,
+    QgsMapLayer,
+    QgsProviderRegistry,
+    QgsVectorLayer,
+)
+
+""" Schema of layers having a dynamic datasource, to not read it again from the provider for each project. """
+
+# Keys of a decoded URI which only filter features, "sql" for databases and "subset" for OGR
+FILTER_KEYS = ('sql', 'subset')
+
+
+def table_key(provider: str, uri: str) -> tuple[tuple[str, str], ...] | None:
+    """ Identity of the table of a datasource, the decoded URI without the filter.
+
+    None if the URI can not be decoded by the provider.
+    """
+    # noinspection PyArgumentList
+    parts = QgsProviderRegistry.instance().decodeUri(provider, uri)
+    if not parts:
+        return None
+    return tuple(sorted((key, str(value)) for key, value in parts.items() if key not in FILTER_KEYS))
+
+
+def filter_of(provider: str, uri: str) -> str:
+    """ Filter of a datasource, an empty string if there isn't any. """
+    # noinspection PyArgumentList
+    parts = QgsProviderRegistry.instance().decodeUri(provider, uri)
+    for key in FILTER_KEYS:
+        if parts.get(key):
+            return str(parts[key])
+    return ''
+
+
+def schema_fingerprint(layer: QgsVectorLayer) -> tuple:
+    """ Fields, geometry type, CRS and primary key of the layer. """
+    fields = tuple(
+        (field.name(), field.type(), field.typeName(), field.length(), field.precision()) for field in layer.fields())
+    return fields, layer.wkbType(), layer.crs().authid(), tuple(layer.primaryKeyAttributes())
+
+
+class ProviderMetadataCache:
+    """ Schema of each dynamic vector layer, known after the first new datasource of the layer.
+
+    For the next datasources of the layer :
+    * if only the filter is different, the filter is set on the current provider, the table is not read again,
+    * otherwise, the datasource is set with the provider trusting it, without checking the primary key, the geometry
+      type and the CRS. If the schema is not the same as the known one, the datasource is set again as usual.
+
+    It is meant to be shared during a single generation run only.
+    """
+
+    def __init__(self):
+        """ Constructor. """
+        self.schemas: dict[str, tuple] = {}
+        # Number of datasources set only with a new filter, with a trusted provider, and set again as usual
+        self.counters = {'filters': 0, 'trusted': 0, 'fallbacks': 0}
+
+    def clear(self):
+        """ Forget all schemas. """
+        self.schemas.clear()
+
+    def set_data_source(self, layer: QgsMapLayer, uri: str):
+        """ Set the new datasource of the layer, reusing the known schema if possible. """
+        schema = self.schemas.get(layer.id())
+        if not isinstance(layer, QgsVectorLayer) or schema is None or not layer.isValid():
+            self._set_data_source(layer, uri)
+            return
+
+        provider = layer.providerType()
+        key = table_key(provider, uri)
+        same_table = key is not None and key == table_key(provider, layer.source())
+        if same_table and layer.setSubsetString(filter_of(provider, uri)):
+            self.counters['filters'] += 1
+            return
+
+        self._set_data_source(layer, uri, trusted=True)
+        if layer.isValid() and schema_fingerprint(layer) == schema:
+            self.counters['trusted'] += 1
+            return
+
+        # Not the same schema, the provider must not trust the datasource
+        self.counters['fallbacks'] += 1
+        self._set_data_source(layer, uri)
+
+    def _set_data_source(self, layer: QgsMapLayer, uri: str, trusted: bool = False):
+        """ Set the datasource with the same provider, and keep the schema of the layer. """
+        if trusted:
+            options = QgsDataProvider.ProviderOptions()
+            options.transformContext = layer.transformContext()
+            # noinspection PyUnresolvedReferences
+            layer.setDataSource(uri, layer.name(), layer.providerType(), options, QgsDataProvider.FlagTrustDataSource)
+        else:
+            layer.setDataSource(uri, layer.name(), layer.providerType())
+
+        if isinstance(layer, QgsVectorLayer) and layer.isValid():
+            self.schemas[layer.id()] = schema_fingerprint(layer)
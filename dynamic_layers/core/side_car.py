@@ -0,0 +1,168 @@
+__copyright__ = 'Copyright 2024, 3Liz'
+__license__ = 'GPL version 3'
+__email__ = 'info@3liz.org'
+
+import os
+
+from pathlib import Path
+from shutil import copy2
+
+from dynamic_layers.definitions import CopyStrategy
+from dynamic_layers.tools import media_dirs, side_car_files
+
+try:
+    import fcntl
+except ImportError:
+    # Not available on Windows
+    fcntl = None
+
+""" Side-car files of the template project, discovered once per generation run. """
+
+# Side-car files up to this size are kept in memory during the run
+MAX_SIZE_IN_MEMORY = 16 * 1024 * 1024
+
+# ioctl to clone a file on Linux, _IOW(0x94, 9, int)
+FICLONE = 0x40049409
+
+
+def reflink(source: Path, destination: Path):
+    """ Clone a file, the content is shared until one of the files is modified. """
+    if fcntl is None:
+        raise OSError("Reflink is not supported on this platform")
+
+    with open(source, 'rb') as source_file, open(destination, 'wb') as destination_file:
+        fcntl.ioctl(destination_file.fileno(), FICLONE, source_file.fileno())
+
+
+def remove_file(path: Path):
+    """ Remove a file or a link, it's never written in place because it can be a link to the template. """
+    if path.is_symlink() or path.exists():
+        path.unlink()
+
+
+def link_or_copy(source: Path, destination: Path, strategy: str = CopyStrategy.Copy) -> str:
+    """ Copy a file with the given strategy, with a copy as a fallback if the file system refuses it.
+
+    Return the strategy which has been used. If the destination is the source itself, such as a template saved in the
+    destination folder, the file is kept as is.
+    """
+    if not destination.is_symlink() and destination.resolve() == source.resolve():
+        return strategy
+
+    remove_file(destination)
+    try:
+        if strategy == CopyStrategy.Hardlink:
+            os.link(source, destination)
+            return strategy
+        if strategy == CopyStrategy.Symlink:
+            os.symlink(source.resolve(), destination)
+            return strategy
+        if strategy == CopyStrategy.Reflink:
+            reflink(source, destination)
+            return strategy
+    except OSError:
+        remove_file(destination)
+
+    copy2(source, destination)
+    return CopyStrategy.Copy
+
+
+class SideCarFiles:
+    """ Side-car files and Lizmap media folders of the template project.
+
+    The folder of the project and the media folders are listed only once. Small side-car files are read only once too,
+    so for each new project, only bytes are written.
+    """
+
+    def __init__(self, project_path: Path, strategy: str = CopyStrategy.Copy):
+        """ Constructor, it lists all files.
+
+        With another strategy than a copy, files are linked to the files of the template project. The Lizmap
+        configuration file is always copied, because it is edited for each project.
+        """
+        self.project_path = project_path
+        self.strategy = strategy
+        # Number of files copied, because the file system refused the strategy
+        self.fallbacks = 0
+        self.files: list[Path] = side_car_files(project_path)
+        self.contents: dict[Path, bytes] = {}
+        for a_file in self.files:
+            if a_file.is_file() and a_file.stat().st_size <= MAX_SIZE_IN_MEMORY:
+                self.contents[a_file] = a_file.read_bytes()
+
+        dirs = media_dirs(project_path)
+        # None if the Lizmap plugin is not installed
+        self.lizmap_installed = dirs is not None
+        self.media_dirs: list[Path] = dirs or []
+
+        # Sub folders and files of each media folder, relative to the media folder
+        self.media_folders: dict[Path, list[Path]] = {}
+        self.media_files: dict[Path, list[Path]] = {}
+        for a_dir in self.media_dirs:
+            self.media_folders[a_dir] = []
+            self.media_files[a_dir] = []
+            for root, folders, files in os.walk(a_dir):
+                root = Path(root)
+                self.media_folders[a_dir].extend(root.joinpath(f).relative_to(a_dir) for f in folders)
+                self.media_files[a_dir].extend(root.joinpath(f).relative_to(a_dir) for f in files)
+
+    @staticmethod
+    def file_destination(a_file: Path, new_path: Path) -> Path:
+        """ Destination of a side-car file, for the new project. """
+        return Path(str(new_path) + a_file.suffix)
+
+    def media_destination(self, media_dir: Path, new_path: Path) -> Path:
+        """ Destination of a Lizmap media folder, for the new project. """
+        rel_path = media_dir.relative_to(self.project_path.parent)
+
+        # Quick and replace "media/js/project_A/foo.js" to "media/js/project_B/foo.js"
+        rel_path = Path(str(rel_path).replace(self.project_path.stem, new_path.stem))
+
+        return new_path.parent.joinpath(rel_path)
+
+    def outputs(self, new_path: Path) -> list[Path]:
+        """ All files and folders written for the new project. """
+        outputs = [self.file_destination(a_file, new_path) for a_file in self.files]
+        outputs.extend(self.media_destination(a_dir, new_path) for a_dir in self.media_dirs)
+        return outputs
+
+    def all_files(self) -> list[Path]:
+        """ All side-car files and media files of the template project. """
+        files = list(self.files)
+        for a_dir in self.media_dirs:
+            files.extend(a_dir.joinpath(a_file) for a_file in self.media_files[a_dir])
+        return files
+
+    def content(self, a_file: Path) -> bytes:
+        """ Content of a side-car file, from the memory if possible. """
+        content = self.contents.get(a_file)
+        if content is None:
+            content = a_file.read_bytes()
+        return content
+
+    def copy_file(self, a_file: Path, destination: Path):
+        """ Copy a side-car file with the strategy, from the memory if possible. """
+        content = self.contents.get(a_file)
+        if self.strategy != CopyStrategy.Copy and a_file.suffix.lower() != '.cfg':
+            self._link_or_copy(a_file, destination)
+        elif content is None:
+            link_or_copy(a_file, destination)
+        else:
+            remove_file(destination)
+            with open(destination, 'wb') as f:
+                f.write(content)
+
+    def copy_media(self, media_dir: Path, new_path: Path) -> Path:
+        """ Copy a media folder for the new project, from the list of files. """
+        new_dir_path = self.media_destination(media_dir, new_path)
+        new_dir_path.mkdir(parents=True, exist_ok=True)
+        for folder in self.media_folders[media_dir]:
+            new_dir_path.joinpath(folder).mkdir(parents=True, exist_ok=True)
+        for a_file in self.media_files[media_dir]:
+            self._link_or_copy(media_dir.joinpath(a_file), new_dir_path.joinpath(a_file))
+        return new_dir_path
+
+    def _link_or_copy(self, source: Path, destination: Path):
+        """ Copy a file with the strategy, and count fallbacks. """
+        if link_or_copy(source, destination, self.strategy) != self.strategy:
+            self.fallbacks += 1
@@ -0,0 +1,117 @@
+__copyright__ = 'Copyright 2024, 3Liz'
+__license__ = 'GPL version 3'
+__email__ = 'info@3liz.org'
+
+import csv
+import json
+import time
+
+from contextlib import contextmanager
+from pathlib import Path
+
+from dynamic_layers.tools import tr
+
+""" Time spent in each phase of a generation run, for each dynamic layer and optionally for each feature. """
+
+
+class PhaseTimings:
+    """ Monotonic timings and counts for each phase, see Phase.
+
+    With the trace, timings of each feature are kept as well, to be written in a CSV or JSON file.
+    """
+
+    def __init__(self, trace: bool = False):
+        """ Constructor. """
+        self.trace = trace
+        self.seconds: dict[str, float] = {}
+        self.counts: dict[str, int] = {}
+        # Seconds for each dynamic layer ID and each phase
+        self.layers: dict[str, dict[str, float]] = {}
+        # Seconds for each phase of each feature, with the trace only
+        self.rows: list[dict] = []
+        self.row: dict | None = None
+
+    @contextmanager
+    def measure(self, phase: str, layer_id: str | None = None):
+        """ Time the block of code, for the given phase and the given dynamic layer if any. """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(phase, time.perf_counter() - start, layer_id)
+
+    def add(self, phase: str, seconds: float, layer_id: str | None = None):
+        """ Add the duration of a phase. """
+        self.seconds[phase] = self.seconds.get(phase, 0.0) + seconds
+        self.counts[phase] = self.counts.get(phase, 0) + 1
+        if layer_id:
+            layer = self.layers.setdefault(layer_id, {})
+            layer[phase] = layer.get(phase, 0.0) + seconds
+        if self.row is not None:
+            self.row[phase] = self.row.get(phase, 0.0) + seconds
+
+    def start_feature(self, feature_id: int):
+        """ Next durations are recorded for this feature too, with the trace only. """
+        if self.trace:
+            self.row = {'feature_id': feature_id}
+
+    def finish_feature(self):
+        """ The feature is done. """
+        if self.row is not None:
+            self.rows.append(self.row)
+        self.row = None
+
+    def totals(self) -> dict[str, float]:
+        """ Seconds spent in each phase. """
+        return dict(self.seconds)
+
+    def to_dict(self) -> dict:
+        """ All timings, to be sent from a worker process to the main process. """
+        return {
+            'seconds': self.seconds,
+            'counts': self.counts,
+            'layers': self.layers,
+            'rows': self.rows,
+        }
+
+    def merge(self, timings: dict):
+        """ Add timings of a worker process, from to_dict(). """
+        for phase, seconds in timings['seconds'].items():
+            self.seconds[phase] = self.seconds.get(phase, 0.0) + seconds
+        for phase, count in timings['counts'].items():
+            self.counts[phase] = self.counts.get(phase, 0) + count
+        for layer_id, phases in timings['layers'].items():
+            layer = self.layers.setdefault(layer_id, {})
+            for phase, seconds in phases.items():
+                layer[phase] = layer.get(phase, 0.0) + seconds
+        if self.trace:
+            self.rows.extend(timings['rows'])
+
+    def summary(self, layer_names: dict[str, str] | None = None) -> str:
+        """ A table of phases sorted by time, and of the slowest dynamic layers. """
+        total = sum(self.seconds.values())
+        lines = [tr('Time spent in each phase :')]
+        for phase, seconds in sorted(self.seconds.items(), key=lambda item: item[1], reverse=True):
+            percent = seconds * 100 / total if total else 0
+            lines.append(f'{phase:<20} {seconds:>10.3f}s {percent:>5.1f}% {self.counts[phase]:>8}')
+
+        if self.layers:
+            lines.append(tr('Slowest dynamic layers :'))
+            layers = sorted(self.layers.items(), key=lambda item: sum(item[1].values()), reverse=True)
+            for layer_id, phases in layers[0:10]:
+                name = (layer_names or {}).get(layer_id, layer_id)
+                details = ', '.join(f'{phase} {seconds:.3f}s' for phase, seconds in sorted(phases.items()))
+                lines.append(f'{name} : {sum(phases.values()):.3f}s ({details})')
+        return '\n'.join(lines)
+
+    def write_trace(self, path: Path):
+        """ Write timings of each feature, in a JSON file if the extension is ".json", otherwise in a CSV file. """
+        if path.suffix.lower() == '.json':
+            path.write_text(json.dumps(self.rows, indent=4))
+            return
+
+        phases = sorted({phase for row in self.rows for phase in row if phase != 'feature_id'})
+        with open(path, 'w', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=['feature_id'] + phases, restval=0.0)
+            writer.writeheader()
+            writer.writerows(self.rows)
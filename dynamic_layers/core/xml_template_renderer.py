@@ -0,0 +1,348 @@
+__copyright__ = 'Copyright 2024, 3Liz'
+__license__ = 'GPL version 3'
+__email__ = 'info@3liz.org'
+
+import time
+
+from pathlib import Path
+
+from qgis.core import (
+    Qgis,
+    QgsCoordinateReferenceSystem,
+    QgsMapLayer,
+    QgsPathResolver,
+    QgsProcessingException,
+    QgsRasterLayer,
+    QgsReadWriteContext,
+    QgsRectangle,
+    QgsVectorLayer,
+)
+from qgis.PyQt.QtXml import QDomDocument, QDomElement, QDomNode
+
+from dynamic_layers.core.dynamic_layers_engine import DynamicLayersEngine
+from dynamic_layers.definitions import (
+    ExtentSource,
+    LayerProperty,
+    Phase,
+    WmsProjectProperty,
+)
+from dynamic_layers.tools import log_message, tr
+
+# Relative paths are written by QgsPathResolver with one of these prefixes
+RELATIVE_PATH_PREFIXES = ('./', '../')
+
+
+def double_to_string(value: float) -> str:
+    """ Same as qgsDoubleToString, used by QGIS when writing coordinates in the project. """
+    text = f"{value:.17f}"
+    if '.' in text:
+        text = text.rstrip('0').rstrip('.')
+    if text == '-0':
+        text = '0'
+    return text
+
+
+class XmlTemplateRenderer:
+    """ Write projects by patching the XML of the template project.
+
+    The template is parsed only once. For each feature, only the nodes driven by the plugin are updated : datasource,
+    name, title and abstract of dynamic layers, WMS project properties and the default view extent. Neither
+    setDataSource() nor QgsProject.write() are called, so the layer extents stored in the project are the ones of the
+    template.
+
+    If the project uses relative paths, all relative paths of the document are rebased from the folder of the template
+    to the folder of each new project : datasources of other layers, SVG files, layout pictures etc.
+    """
+
+    def __init__(self, engine: DynamicLayersEngine):
+        """ Constructor, it parses the template project. """
+        self.engine = engine
+        self.project = engine.project
+        self.values: dict[str, dict[str, str]] = {}
+        # Extents of new datasources, a datasource is opened only once for all features
+        self.extents: dict[tuple[str, str], QgsRectangle | None] = {}
+
+        path = Path(self.project.fileName())
+        self.template_path = path
+        self.check_template(path)
+
+        self.document = QDomDocument()
+        with open(path, 'rb') as f:
+            result = self.document.setContent(f.read())
+        if not (result[0] if isinstance(result, tuple) else bool(result)):
+            raise QgsProcessingException(tr("Impossible to parse the XML of the project '{}'").format(path.name))
+
+        root = self.document.documentElement()
+        self.properties = root.firstChildElement('properties')
+        if self.properties.isNull():
+            self.properties = self.document.createElement('properties')
+            root.appendChild(self.properties)
+
+        self.view_settings = root.firstChildElement('ProjectViewSettings')
+
+        # Nodes of dynamic layers, in the list of layers and in the layer tree
+        self.layer_elements: dict[str, QDomElement] = {}
+        # Nodes of other layers, only their datasource is written again, from the folder of the new project
+        self.static_layer_elements: dict[str, QDomElement] = {}
+        nodes = self.document.elementsByTagName('maplayer')
+        for i in range(nodes.count()):
+            element = nodes.at(i).toElement()
+            layer_id = element.firstChildElement('id').text()
+            if layer_id in self.engine.dynamic_layers:
+                self.layer_elements[layer_id] = element
+            elif self.project.mapLayer(layer_id):
+                self.static_layer_elements[layer_id] = element
+
+        self.tree_elements: dict[str, QDomElement] = {}
+        self.static_tree_elements: dict[str, QDomElement] = {}
+        nodes = self.document.elementsByTagName('layer-tree-layer')
+        for i in range(nodes.count()):
+            element = nodes.at(i).toElement()
+            layer_id = element.attribute('id')
+            if layer_id in self.engine.dynamic_layers:
+                self.tree_elements[layer_id] = element
+            elif self.project.mapLayer(layer_id):
+                self.static_tree_elements[layer_id] = element
+
+        # Relative paths of the document are relative to this folder
+        self.folder = path.parent.resolve()
+        self.relative_paths: list[tuple[QDomNode, str, str]] = []
+        if self.project.filePathStorage() != Qgis.FilePathType.Absolute:
+            self.relative_paths = self._relative_paths()
+
+    @staticmethod
+    def check_template(path: Path):
+        """ Raise an exception if the template project can not be rendered from its XML. """
+        if path.suffix.lower() != '.qgs':
+            raise QgsProcessingException(
+                tr("Only a QGS project file can be used to render projects from the XML, not '{}'").format(path.name))
+
+    def render(self) -> list[str] | None:
+        """ Evaluate all templates for the current feature of the engine and patch the XML document.
+
+        The datasources are written in the document only when the destination is known, in write().
+        Return the WMS extent, if any.
+        """
+        self.values = self.engine.evaluate_dynamic_layers()
+        for layer_id, values in self.values.items():
+            element = self.layer_elements.get(layer_id)
+            if element is None:
+                continue
+            self._set_text(element, 'layername', values[LayerProperty.Name])
+            self._set_text(element, 'title', values[LayerProperty.Title])
+            self._set_text(element, 'abstract', values[LayerProperty.Abstract])
+
+            tree_element = self.tree_elements.get(layer_id)
+            if tree_element is not None:
+                tree_element.setAttribute('name', values[LayerProperty.Name])
+
+        # Make sure WMS Service is active
+        if self.properties.firstChildElement(WmsProjectProperty.Capabilities).isNull():
+            self._set_property(WmsProjectProperty.Capabilities, True)
+
+        for project_property, value in self.engine.evaluate_project_properties().items():
+            self._set_property(project_property, value)
+
+        return self._update_extent()
+
+    def write(self, path: Path) -> bool:
+        """ Write the patched document to the given path. """
+        resolver = QgsPathResolver(str(path))
+        if self.project.filePathStorage() == Qgis.FilePathType.Absolute:
+            resolver = QgsPathResolver()
+        context = QgsReadWriteContext()
+        context.setPathResolver(resolver)
+
+        folder = path.parent.resolve()
+        if self.project.filePathStorage() != Qgis.FilePathType.Absolute and folder != self.folder:
+            self._rebase_paths(resolver, context)
+            self.folder = folder
+
+        for layer_id, values in self.values.items():
+            layer = self.engine.dynamic_layers[layer_id]
+            source = layer.encodedSource(values[LayerProperty.Datasource], context)
+
+            element = self.layer_elements.get(layer_id)
+            if element is not None:
+                self._set_text(element, 'datasource', source)
+
+            tree_element = self.tree_elements.get(layer_id)
+            if tree_element is not None and tree_element.hasAttribute('source'):
+                tree_element.setAttribute('source', source)
+
+        with open(path, 'wb') as f:
+            f.write(self.document.toByteArray(2).data())
+        return True
+
+    def _relative_paths(self) -> list[tuple[QDomNode, str, str]]:
+        """ Text nodes and attributes having a relative path, with the name of the attribute and the original value.
+
+        Datasources of layers of the project are not included, they are encoded by each layer.
+        """
+        layer_ids = set(self.layer_elements) | set(self.static_layer_elements)
+        nodes = []
+        stack = [self.document.documentElement()]
+        while stack:
+            node = stack.pop()
+            if node.isText():
+                value = node.toText().data()
+                if value.startswith(RELATIVE_PATH_PREFIXES):
+                    nodes.append((node, '', value))
+                continue
+
+            if not node.isElement():
+                continue
+
+            element = node.toElement()
+            parent = element.parentNode().toElement()
+            if (
+                    element.tagName() == 'datasource'
+                    and parent.tagName() == 'maplayer'
+                    and parent.firstChildElement('id').text() in layer_ids
+            ):
+                continue
+
+            # The source in the layer tree is the datasource of the layer
+            is_tree_layer = element.tagName() == 'layer-tree-layer' and element.attribute('id') in layer_ids
+
+            attributes = element.attributes()
+            for i in range(attributes.count()):
+                attribute = attributes.item(i).toAttr()
+                if is_tree_layer and attribute.name() == 'source':
+                    continue
+                if attribute.value().startswith(RELATIVE_PATH_PREFIXES):
+                    nodes.append((element, attribute.name(), attribute.value()))
+
+            child = element.firstChild()
+            while not child.isNull():
+                stack.append(child)
+                child = child.nextSibling()
+        return nodes
+
+    def _rebase_paths(self, resolver: QgsPathResolver, context: QgsReadWriteContext):
+        """ Write all relative paths of the document from the folder of the new project. """
+        for layer_id, element in self.static_layer_elements.items():
+            layer = self.project.mapLayer(layer_id)
+            source = layer.encodedSource(layer.source(), context)
+            self._set_text(element, 'datasource', source)
+
+            tree_element = self.static_tree_elements.get(layer_id)
+            if tree_element is not None and tree_element.hasAttribute('source'):
+                tree_element.setAttribute('source', source)
+
+        template = QgsPathResolver(str(self.template_path))
+        for node, attribute, value in self.relative_paths:
+            new_value = resolver.writePath(template.readPath(value))
+            if attribute:
+                node.toElement().setAttribute(attribute, new_value)
+            else:
+                node.toText().setData(new_value)
+
+    def _update_extent(self) -> list[str] | None:
+        """ Compute the project extent, from the feature or from the new datasource of the extent layer. """
+        feature_extent = self.engine.feature_extent()
+        if feature_extent:
+            extent, crs = feature_extent
+        else:
+            extent_layer = self.engine.extent_layer()
+            if not extent_layer or self.engine.extent_source() != ExtentSource.Layer:
+                return None
+
+            extent = self._layer_extent(extent_layer)
+            if not extent:
+                return None
+            crs = extent_layer.crs()
+
+        extent = self.engine.buffered_extent(extent, self.engine.extent_margin(), crs)
+        wms_extent = self.engine.wms_extent(extent)
+        self._set_property(WmsProjectProperty.Extent, wms_extent)
+        self._set_default_view_extent(extent, crs)
+        return wms_extent
+
+    def _layer_extent(self, layer: QgsMapLayer) -> QgsRectangle | None:
+        """ The extent of the layer, with its new datasource if it's a dynamic layer.
+
+        The extent of a datasource is read only once, features sharing the same datasource reuse it.
+        """
+        values = self.values.get(layer.id())
+        if not values:
+            return layer.extent()
+
+        if not isinstance(layer, (QgsVectorLayer, QgsRasterLayer)):
+            return layer.extent()
+
+        key = (layer.id(), values[LayerProperty.Datasource])
+        if key in self.extents:
+            return self.extents[key]
+
+        # A lightweight layer, only to read the extent of the new datasource
+        log_message(
+            lambda: tr("Extent from layer : {}").format(layer.name()),
+            Qgis.MessageLevel.Info,
+            self.engine.feedback,
+            self.engine.verbosity,
+        )
+        start = time.perf_counter()
+        with self.engine.timings.measure(Phase.LayerExtent, layer.id()):
+            if isinstance(layer, QgsVectorLayer):
+                new_layer = QgsVectorLayer(values[LayerProperty.Datasource], layer.name(), layer.providerType())
+            else:
+                new_layer = QgsRasterLayer(values[LayerProperty.Datasource], layer.name(), layer.providerType())
+            extent = new_layer.extent() if new_layer.isValid() else None
+        self.engine.extent_counters['updates'] += 1
+        self.engine.extent_counters['seconds'] += time.perf_counter() - start
+        self.extents[key] = extent
+        return extent
+
+    def _set_default_view_extent(self, extent: QgsRectangle, crs: QgsCoordinateReferenceSystem):
+        """ Set the default view extent of the project. """
+        if self.view_settings.isNull():
+            return
+
+        element = self.view_settings.firstChildElement('DefaultViewExtent')
+        if element.isNull():
+            element = self.document.createElement('DefaultViewExtent')
+            self.view_settings.appendChild(element)
+
+        element.setAttribute('xmin', double_to_string(extent.xMinimum()))
+        element.setAttribute('ymin', double_to_string(extent.yMinimum()))
+        element.setAttribute('xmax', double_to_string(extent.xMaximum()))
+        element.setAttribute('ymax', double_to_string(extent.yMaximum()))
+
+        while element.hasChildNodes():
+            element.removeChild(element.firstChild())
+        crs.writeXml(element, self.document)
+
+    def _set_property(self, project_property: str, value: str | bool | list[str]):
+        """ Set a project property, as QgsProject.writeEntry() with an empty key. """
+        element = self.properties.firstChildElement(project_property)
+        if element.isNull():
+            element = self.document.createElement(project_property)
+            self.properties.appendChild(element)
+
+        while element.hasChildNodes():
+            element.removeChild(element.firstChild())
+
+        if isinstance(value, bool):
+            element.setAttribute('type', 'bool')
+            element.appendChild(self.document.createTextNode('true' if value else 'false'))
+        elif isinstance(value, list):
+            element.setAttribute('type', 'QStringList')
+            for item in value:
+                child = self.document.createElement('value')
+                child.appendChild(self.document.createTextNode(item))
+                element.appendChild(child)
+        else:
+            element.setAttribute('type', 'QString')
+            element.appendChild(self.document.createTextNode(str(value)))
+
+    def _set_text(self, parent: QDomElement, tag: str, text: str):
+        """ Set the text of a child element, it's created if needed. """
+        element = parent.firstChildElement(tag)
+        if element.isNull():
+            element = self.document.createElement(tag)
+            parent.appendChild(element)
+
+        while element.hasChildNodes():
+            element.removeChild(element.firstChild())
+        element.appendChild(self.document.createTextNode(str(text)))
@@ -12,6 +12,15 @@ class CustomProperty:
     NameTemplate = 'nameTemplate'
     TitleTemplate = 'titleTemplate'
     AbstractTemplate = 'abstractTemplate'
+    GraduatedClassification = 'graduatedClassification'
+
+
+class LayerProperty:
+    """ Properties of a dynamic layer, evaluated from a template. """
+    Datasource = 'datasource'
+    Title = 'title'
+    Name = 'name'
+    Abstract = 'abstract'
 
 
 class WmsProjectProperty:
@@ -28,10 +37,44 @@ class PluginProjectProperty:
     ShortName = 'ProjectShortName'
     ExtentLayer = 'ExtentLayer'
     ExtentMargin = 'ExtentMargin'
+    ExtentSource = 'ExtentSource'
+    ExtentExpression = 'ExtentExpression'
     VariableSourceLayer = 'VariableSourceLayer'
     VariableList = 'VariableList'
 
 
+class ExtentSource:
+    """ How the project extent is computed for each feature. """
+    # Extent of the extent layer, with its new datasource
+    Layer = 'layer'
+    # Bounding box of the geometry of the feature
+    Feature = 'feature'
+    # Bounding box of a geometry expression, evaluated on the feature
+    Expression = 'expression'
+
+
+class GraduatedClassification:
+    """ How the single range of a graduated renderer is updated, after a new datasource. """
+    # The range is kept as is
+    Never = 'never'
+    # Classes are computed again by the renderer, all values of the layer are read
+    Always = 'always'
+    # Minimum and maximum values from the first features only
+    Sample = 'sample'
+    # Minimum and maximum values computed by the provider
+    Statistics = 'statistics'
+
+
+class TemplateDependency:
+    """ What the value of a template depends on, when generating many projects. """
+    # Always the same value
+    Constant = 'constant'
+    # Variables, the project or the layer, the same value for all features of a run
+    Run = 'run'
+    # The current feature, evaluated for each feature
+    Feature = 'feature'
+
+
 class WidgetType:
     PlainText = 'PlainText'
     Text = 'Text'
@@ -39,11 +82,56 @@ class WidgetType:
     SpinBox = 'SpinBox'
 
 
+class Verbosity:
+    """ Verbosity of the logs, a message is logged if the verbosity is greater or equal to its own level. """
+    Quiet = 0  # Only warnings and errors
+    Normal = 1  # One message per generated project
+    Debug = 2  # Every evaluated expression
+
+
+class GenerationBackend:
+    """ How projects are written when generating many projects. """
+    # Datasources are changed on layers and the project is written by QGIS
+    Project = 'project'
+    # The XML of the template project is patched, faster but layer extents are not updated
+    Xml = 'xml'
+
+
+class CopyStrategy:
+    """ How side-car files and media files are copied for each new project. """
+    Copy = 'copy'
+    # Files share the same content on the disk, they must not be edited in place
+    Hardlink = 'hardlink'
+    # Copy on write, if the file system supports it, such as Btrfs or XFS
+    Reflink = 'reflink'
+    Symlink = 'symlink'
+
+
+class Phase:
+    """ Phases of the generation of a project, timed for each feature. """
+    # All templates of all features, before generating any project
+    Plan = 'plan'
+    # Templates of dynamic layers
+    Evaluation = 'evaluation'
+    # New datasource, title, name and abstract of dynamic layers
+    Datasource = 'datasource'
+    # Extents of layers having a new datasource
+    LayerExtent = 'layer_extent'
+    ProjectProperties = 'project_properties'
+    ProjectExtent = 'project_extent'
+    # The XML of the template project, with the XML backend
+    Render = 'render'
+    SideCar = 'side_car'
+    Write = 'write'
+    LizmapConfig = 'lizmap_config'
+
+
 class LayerPropertiesXml:
     DynamicDatasourceContent = 'dynamicDatasourceContent'
     NameTemplate = 'nameTemplate'
     TitleTemplate = 'titleTemplate'
     AbstractTemplate = 'abstractTemplate'
+    GraduatedClassification = 'graduatedClassification'
 
 
 PLUGIN_SCOPE = 'PluginDynamicLayers'
@@ -11,6 +11,7 @@ from qgis.PyQt.QtWidgets import QAction, QMenu
 from dynamic_layers.definitions import PLUGIN_MESSAGE
 from dynamic_layers.dynamic_layers_dialog import DynamicLayersDialog
 from dynamic_layers.generate_projects import GenerateProjectsDialog
+from dynamic_layers.processing_provider.provider import Provider
 from dynamic_layers.tools import open_help, plugin_path, resources_path, tr
 
 
@@ -20,14 +21,15 @@ class DynamicLayers:
     def __init__(self, iface: QgisInterface):
         """Constructor."""
         self.iface = iface
-        # self.provider = None
+        self.provider = None
 
         self.help_action_about_menu = None
         self.menu = None
         self.main_dialog_action = None
         self.generate_projects_action = None
 
-        locale = QSettings().value('locale/userLocale')[0:2]
+        # The locale is not set with qgis_process
+        locale = (QSettings().value('locale/userLocale') or 'en')[0:2]
         locale_path = plugin_path('i18n', f'qgis_plugin_{locale}.qm')
         if locale_path.exists():
             # noinspection PyArgumentList
@@ -39,11 +41,11 @@ class DynamicLayers:
             QCoreApplication.installTranslator(self.translator)
 
     # noinspection PyPep8Naming
-    # def initProcessing(self):
-    #     """ Init processing provider. """
-    #     self.provider = Provider()
-    #     # noinspection PyArgumentList
-    #     QgsApplication.processingRegistry().addProvider(self.provider)
+    def initProcessing(self):
+        """ Init processing provider, also called by qgis_process without the GUI. """
+        self.provider = Provider()
+        # noinspection PyArgumentList
+        QgsApplication.processingRegistry().addProvider(self.provider)
 
     # noinspection PyPep8Naming
     def initGui(self):
@@ -70,7 +72,7 @@ class DynamicLayers:
 
         self.iface.pluginMenu().addMenu(self.menu)
 
-        # self.initProcessing()
+        self.initProcessing()
 
         # Open the online help
         self.help_action_about_menu = QAction(main_icon, tr('Project generator'), self.iface.mainWindow())
@@ -80,9 +82,9 @@ class DynamicLayers:
 
     def unload(self):
         """Removes the plugin menu item and icon from QGIS GUI."""
-        # if self.provider:
-        #     # noinspection PyArgumentList
-        #     QgsApplication.processingRegistry().removeProvider(self.provider)
+        if self.provider:
+            # noinspection PyArgumentList
+            QgsApplication.processingRegistry().removeProvider(self.provider)
 
         if self.generate_projects_action:
             self.iface.removePluginMenu("Dynamic Layers", self.generate_projects_action)
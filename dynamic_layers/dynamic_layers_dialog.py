@@ -46,6 +46,8 @@ from dynamic_layers.definitions import (
     PLUGIN_SCOPE,
     PLUGIN_SCOPE_KEY,
     CustomProperty,
+    ExtentSource,
+    GraduatedClassification,
     LayerPropertiesXml,
     PluginProjectProperty,
     QtVar,
@@ -95,6 +97,24 @@ class DynamicLayersDialog(QDialog, FORM_CLASS):
         self.inExtentLayer.setFilters(QgsMapLayerProxyModel.Filter.VectorLayer)
         self.inExtentLayer.setAllowEmptyLayer(True)
 
+        self.inExtentSource.addItem(tr('Extent of the extent layer'), ExtentSource.Layer)
+        self.inExtentSource.addItem(tr('Bounding box of the feature'), ExtentSource.Feature)
+        self.inExtentSource.addItem(tr('Bounding box of a geometry expression on the feature'), ExtentSource.Expression)
+        self.inExtentSource.setToolTip(tr(
+            "With the bounding box of the feature, the extent layer is not read again for each feature."
+        ))
+        self.inExtentExpression.setPlaceholderText("buffer($geometry, 100)")
+
+        self.graduatedClassification.addItem(tr('Computed again from all values'), GraduatedClassification.Always)
+        self.graduatedClassification.addItem(tr('Kept as is'), GraduatedClassification.Never)
+        self.graduatedClassification.addItem(
+            tr('Minimum and maximum of the first features'), GraduatedClassification.Sample)
+        self.graduatedClassification.addItem(
+            tr('Minimum and maximum computed by the provider'), GraduatedClassification.Statistics)
+        self.graduatedClassification.setToolTip(tr(
+            "Only for a graduated renderer having a single class. Reading all values can be slow for large layers."
+        ))
+
         self.inVariableSourceLayer.setFilters(QgsMapLayerProxyModel.Filter.VectorLayer)
         self.inVariableSourceLayer.setAllowEmptyLayer(False)
 
@@ -229,11 +249,19 @@ class DynamicLayersDialog(QDialog, FORM_CLASS):
                 'wType': WidgetType.PlainText,
                 'xml': LayerPropertiesXml.AbstractTemplate,
             },
+            'graduatedClassification': {
+                'widget': self.graduatedClassification,
+                'wType': WidgetType.List,
+                'xml': LayerPropertiesXml.GraduatedClassification,
+            },
         }
         for key, item in self.layerPropertiesInputs.items():
             control = item['widget']
             slot = partial(self.on_layer_property_change, key)
-            control.textChanged.connect(slot)
+            if item['wType'] == WidgetType.List:
+                control.currentIndexChanged.connect(slot)
+            else:
+                control.textChanged.connect(slot)
 
         # Actions of the Variable tab
         self.btAddVariable.clicked.connect(self.on_add_variable_clicked)
@@ -271,6 +299,16 @@ class DynamicLayersDialog(QDialog, FORM_CLASS):
                 'wType': WidgetType.SpinBox,
                 'xml': PluginProjectProperty.ExtentMargin,
             },
+            'extentSource': {
+                'widget': self.inExtentSource,
+                'wType': WidgetType.List,
+                'xml': PluginProjectProperty.ExtentSource,
+            },
+            'extentExpression': {
+                'widget': self.inExtentExpression,
+                'wType': WidgetType.Text,
+                'xml': PluginProjectProperty.ExtentExpression,
+            },
             'variableSourceLayer': {
                 'widget': self.inVariableSourceLayer,
                 'wType': WidgetType.List,
@@ -410,6 +448,8 @@ class DynamicLayersDialog(QDialog, FORM_CLASS):
             input_value = item['widget'].toPlainText()
         if item['wType'] == WidgetType.Text:
             input_value = item['widget'].text()
+        if item['wType'] == WidgetType.List:
+            input_value = item['widget'].currentData()
 
         if input_value == "''":
             input_value = ''
@@ -577,7 +617,7 @@ class DynamicLayersDialog(QDialog, FORM_CLASS):
     def on_project_property_changed(self, prop: str) -> Optional[str]:
         """ Save project dynamic property in the project. """
         widget = self.projectPropertiesInputs[prop]['widget']
-        if prop in ('title', 'shortname'):
+        if prop in ('title', 'shortname', 'extentExpression'):
             val = widget.text()
         elif prop == 'abstract':
             val = widget.toPlainText()
@@ -588,6 +628,8 @@ class DynamicLayersDialog(QDialog, FORM_CLASS):
             val = layer.id()
         elif prop == 'extentMargin':
             val = widget.value()
+        elif prop == 'extentSource':
+            val = widget.currentData()
         else:
             log_message(f'Unknown widget {prop}, please ask the developer', Qgis.MessageLevel.Critical, None)
             return None
@@ -809,8 +851,8 @@ class DynamicLayersDialog(QDialog, FORM_CLASS):
                 widget.setValue(int(val))
             elif item['wType'] == WidgetType.List:
                 list_dic = {widget.itemData(i): i for i in range(widget.count())}
-                if val in list_dic:
-                    widget.setCurrentIndex(list_dic[val])
+                # The first item is the default value
+                widget.setCurrentIndex(list_dic.get(val, 0))
 
         # "active" checkbox
         is_active = self.selected_layer.customProperty(CustomProperty.DynamicDatasourceActive)
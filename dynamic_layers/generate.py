@@ -0,0 +1,242 @@
+__copyright__ = 'Copyright 2024, 3Liz'
+__license__ = 'GPL version 3'
+__email__ = 'info@3liz.org'
+
+import argparse
+import gc
+import json
+import os
+import sys
+
+from pathlib import Path
+from typing import TextIO
+
+from qgis.core import (
+    QgsApplication,
+    QgsProcessingException,
+    QgsProcessingFeedback,
+    QgsProject,
+    QgsVectorLayer,
+)
+
+from dynamic_layers.definitions import (
+    CopyStrategy,
+    CustomProperty,
+    GenerationBackend,
+    Verbosity,
+)
+from dynamic_layers.tools import tr
+
+""" Generate projects without QGIS Desktop, progress and messages are written as JSON lines.
+
+    python -m dynamic_layers.generate project.qgs --coverage coverage.gpkg --field name \\
+        --expression "concat('project_', \"name\", '.qgs')" --destination /tmp/projects
+"""
+
+VERBOSITY = {
+    'quiet': Verbosity.Quiet,
+    'normal': Verbosity.Normal,
+    'debug': Verbosity.Debug,
+}
+
+
+class JsonLinesFeedback(QgsProcessingFeedback):
+    """ Feedback writing each message and each new progress value as a JSON object on a line. """
+
+    def __init__(self, stream: TextIO | None = None):
+        super().__init__()
+        self.stream = stream
+        self.last_progress = None
+        self.progressChanged.connect(self.write_progress)
+
+    def write(self, **kwargs):
+        """ Write a line and flush it, to be read while the generation is running. """
+        stream = self.stream or sys.stdout
+        stream.write(json.dumps(kwargs) + "\n")
+        stream.flush()
+
+    def write_progress(self, progress: float):
+        """ Write the progress, only if the integer value is new. """
+        progress = int(progress)
+        if progress == self.last_progress:
+            return
+        self.last_progress = progress
+        self.write(type='progress', progress=progress)
+
+    def pushInfo(self, text):
+        self.write(type='info', message=text)
+
+    def pushCommandInfo(self, text):
+        self.write(type='info', message=text)
+
+    def pushDebugInfo(self, text):
+        self.write(type='debug', message=text)
+
+    def pushConsoleInfo(self, text):
+        self.write(type='debug', message=text)
+
+    def pushWarning(self, text):
+        self.write(type='warning', message=text)
+
+    def reportError(self, text, fatal_error=False):
+        self.write(type='error', message=text, fatal=fatal_error)
+
+
+def parser() -> argparse.ArgumentParser:
+    """ Arguments of the command line. """
+    arguments = argparse.ArgumentParser(
+        prog='python -m dynamic_layers.generate',
+        description='Generate all projects for all unique values in the coverage layer.',
+    )
+    arguments.add_argument('project', help='The template project, with its dynamic layers.')
+    arguments.add_argument(
+        '--coverage', required=True,
+        help='The coverage layer : a layer ID of the project, a file or a connection string.')
+    arguments.add_argument(
+        '--coverage-provider', default='ogr', help='The provider of the coverage layer, "ogr" by default.')
+    arguments.add_argument('--field', required=True, help='The field having unique values.')
+    arguments.add_argument(
+        '--expression', required=True,
+        help='QGIS Expression to format the final filename. It must end with .qgs or .qgz.')
+    arguments.add_argument('--destination', required=True, help='The destination folder.')
+    arguments.add_argument(
+        '--no-side-car-files', action='store_true', help='Do not copy side-car files and Lizmap media files.')
+    arguments.add_argument(
+        '--copy-strategy', default=CopyStrategy.Copy,
+        choices=(CopyStrategy.Copy, CopyStrategy.Hardlink, CopyStrategy.Reflink, CopyStrategy.Symlink),
+        help='How side-car files and Lizmap media files are copied.')
+    arguments.add_argument(
+        '--backend', default=GenerationBackend.Project, choices=(GenerationBackend.Project, GenerationBackend.Xml),
+        help='How projects are written.')
+    arguments.add_argument('--workers', type=int, default=1, help='Number of processes generating projects.')
+    arguments.add_argument('--limit', type=int, default=None, help='Generate only the first projects, for debug.')
+    arguments.add_argument(
+        '--incremental', action='store_true', help='Only generate projects having new inputs.')
+    arguments.add_argument(
+        '--resume', action='store_true', help='Resume the previous run, if it has been cancelled or interrupted.')
+    arguments.add_argument(
+        '--deduplicate', action='store_true',
+        help='Generate a single project for each value of the field, from the feature having the lowest ID.')
+    arguments.add_argument(
+        '--reuse-provider-metadata', action='store_true',
+        help='Read the schema of each dynamic layer only once, for datasources having the same fields.')
+    arguments.add_argument(
+        '--trace', type=Path,
+        help='Write timings of each phase for each feature in this CSV file, or JSON if it ends with ".json".')
+    arguments.add_argument(
+        '--dry-run', type=Path,
+        help=(
+            'Do not generate projects, only write evaluated templates of each feature in this CSV file, or JSON if it '
+            'ends with ".json".'))
+    arguments.add_argument(
+        '--reload-interval', type=int, default=0,
+        help='Read the template project again every N features, to release memory, 0 to never read it again.')
+    arguments.add_argument(
+        '--profile', action='store_true',
+        help='Write a cProfile file and the top memory allocations in the destination folder.')
+    arguments.add_argument(
+        '--profile-interval', type=int, default=100, help='Number of features between two memory snapshots.')
+    arguments.add_argument('--verbosity', default='normal', choices=tuple(VERBOSITY.keys()))
+    return arguments
+
+
+def coverage_layer(project: QgsProject, coverage: str, provider: str) -> QgsVectorLayer | None:
+    """ The coverage layer, from the project or from its datasource. None if it's not valid. """
+    layer = project.mapLayer(coverage)
+    if not isinstance(layer, QgsVectorLayer):
+        layer = QgsVectorLayer(coverage, 'coverage', provider)
+    if not layer.isValid():
+        return None
+    return layer
+
+
+def main(argv: list[str] | None = None, stream: TextIO | None = None) -> int:
+    """ Generate projects, return the exit code. """
+    args = parser().parse_args(argv)
+
+    application = None
+    if not QgsApplication.instance():
+        os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+        application = QgsApplication([], False)
+        application.initQgis()
+
+    try:
+        return generate(args, JsonLinesFeedback(stream))
+    finally:
+        if application:
+            # The project, the coverage layer and the generator must be deleted before QGIS
+            gc.collect()
+            application.exitQgis()
+
+
+def generate(args: argparse.Namespace, feedback: JsonLinesFeedback) -> int:
+    """ Generate projects with parsed arguments, return the exit code.
+
+    QGIS objects created here are deleted when the function returns.
+    """
+    # Imported once QGIS is ready
+    from dynamic_layers.core.generate_projects import GenerateProjects
+
+    # noinspection PyArgumentList
+    project = QgsProject()
+    if not project.read(args.project):
+        feedback.reportError(tr("Impossible to read the project {}").format(args.project), True)
+        return 1
+
+    if not any(
+            layer.customProperty(CustomProperty.DynamicDatasourceActive)
+            for layer in project.mapLayers().values()
+    ):
+        feedback.reportError(tr("You must have at least one layer with the configuration."), True)
+        return 1
+
+    coverage = coverage_layer(project, args.coverage, args.coverage_provider)
+    if not coverage:
+        feedback.reportError(tr("The coverage layer {} is not valid").format(args.coverage), True)
+        return 1
+
+    if coverage.fields().indexFromName(args.field) < 0:
+        feedback.reportError(tr("The field {} does not exist in the coverage layer").format(args.field), True)
+        return 1
+
+    generator = GenerateProjects(
+        project,
+        coverage,
+        args.field,
+        args.expression,
+        Path(args.destination),
+        not args.no_side_car_files,
+        feedback,
+        limit=args.limit,
+        verbosity=VERBOSITY[args.verbosity],
+        workers=args.workers,
+        backend=args.backend,
+        incremental=args.incremental,
+        resume=args.resume,
+        deduplicate=args.deduplicate,
+        copy_strategy=args.copy_strategy,
+        reuse_provider_metadata=args.reuse_provider_metadata,
+        trace=args.trace,
+        reload_interval=args.reload_interval,
+        profile=args.profile,
+        profile_interval=args.profile_interval,
+        dry_run=args.dry_run,
+    )
+    try:
+        success = generator.process()
+    except QgsProcessingException as e:
+        feedback.reportError(str(e), True)
+        success = False
+
+    feedback.write(
+        type='result',
+        success=success,
+        destination=str(args.destination),
+        projects=[str(path) for path in generator.generated.values()],
+        timings=generator.timings.totals(),
+    )
+    return 0 if success else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
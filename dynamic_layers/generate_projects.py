@@ -2,6 +2,7 @@ __copyright__ = 'Copyright 2024, 3Liz'
 __license__ = 'GPL version 3'
 __email__ = 'info@3liz.org'
 
+import os
 
 from pathlib import Path
 
@@ -10,7 +11,6 @@ from qgis.core import (
     QgsExpressionContext,
     QgsExpressionContextUtils,
     QgsMapLayerProxyModel,
-    QgsProcessingException,
     QgsProcessingFeedback,
     QgsProject,
 )
@@ -23,16 +23,18 @@ from qgis.PyQt.QtWidgets import (
     QPlainTextEdit,
     QProgressBar,
 )
-from qgis.utils import OverrideCursor
 
-from dynamic_layers.core.generate_projects import GenerateProjects
-from dynamic_layers.definitions import QtVar
+from dynamic_layers.core.generation_task import GenerationTask
+from dynamic_layers.definitions import CopyStrategy, Verbosity
 from dynamic_layers.tools import open_help, tr
 
 folder = Path(__file__).resolve().parent
 ui_file = folder / 'resources' / 'ui' / 'generate_projects.ui'
 FORM_CLASS, _ = uic.loadUiType(ui_file)
 
+# Maximum number of messages kept in the log widget, older ones are removed
+MAX_LOG_LINES = 2000
+
 
 class GenerateProjectsDialog(QDialog, FORM_CLASS):
     # noinspection PyArgumentList
@@ -43,10 +45,13 @@ class GenerateProjectsDialog(QDialog, FORM_CLASS):
         self.setupUi(self)
         self.setWindowTitle(tr("Generate many QGIS projects"))
         self.project = QgsProject.instance()
+        # The running task, if any
+        self.task = None
+        self.feedback = None
 
         self.button_box.button(QDialogButtonBox.StandardButton.Apply).clicked.connect(self.generate_projects)
         self.button_box.button(QDialogButtonBox.StandardButton.Help).clicked.connect(open_help)
-        self.button_box.button(QDialogButtonBox.StandardButton.Cancel).clicked.connect(self.close)
+        self.button_box.button(QDialogButtonBox.StandardButton.Cancel).clicked.connect(self.cancel)
 
         self.expression.setText("")
         self.expression.setToolTip(tr("Open the expression builder"))
@@ -57,11 +62,57 @@ class GenerateProjectsDialog(QDialog, FORM_CLASS):
         self.coverage.layerChanged.connect(self.layer_changed)
 
         self.copy_side_care_files.setChecked(True)
+        self.copy_strategy.addItem(tr("Copy"), CopyStrategy.Copy)
+        self.copy_strategy.addItem(tr("Hard link"), CopyStrategy.Hardlink)
+        self.copy_strategy.addItem(tr("Copy on write (reflink), if supported"), CopyStrategy.Reflink)
+        self.copy_strategy.addItem(tr("Symbolic link"), CopyStrategy.Symlink)
+        self.copy_strategy.setToolTip(tr(
+            "Links are much faster and do not use disk space, but files are shared with the template project. "
+            "A file is copied if the file system refuses the link. The Lizmap configuration file is always copied."
+        ))
+        self.copy_side_care_files.toggled.connect(self.copy_strategy.setEnabled)
+        self.incremental.setChecked(False)
+        self.incremental.setToolTip(tr(
+            "A manifest is stored in the destination folder, to generate only projects having new inputs. "
+            "Projects of features which have been removed from the coverage layer are removed."
+        ))
+        self.resume.setChecked(False)
+        self.resume.setToolTip(tr(
+            "Projects already generated by the previous run, with the same settings, are not generated again."
+        ))
+        self.reuse_provider_metadata.setChecked(False)
+        self.reuse_provider_metadata.setToolTip(tr(
+            "Faster for databases, if only the filter or the table changes between projects. If the schema of a new "
+            "datasource is different, the datasource is set again as usual."
+        ))
 
         self.destination.setStorageMode(QgsFileWidget.StorageMode.GetDirectory)
         self.field.setAllowEmptyFieldName(False)
         self.layer_changed()
         self.debug_limit.setValue(0)
+        self.profile.setChecked(False)
+        self.profile.setToolTip(tr(
+            "A cProfile file and the top memory allocations, at the start and every 100 features, are written in the "
+            "destination folder. It slows down the generation."
+        ))
+
+        self.verbosity.addItem(tr("Quiet, only warnings and errors"), Verbosity.Quiet)
+        self.verbosity.addItem(tr("Normal, one message per project"), Verbosity.Normal)
+        self.verbosity.addItem(tr("Debug, every evaluated expression"), Verbosity.Debug)
+        self.verbosity.setCurrentIndex(self.verbosity.findData(Verbosity.Normal))
+
+        self.workers.setMinimum(1)
+        self.workers.setMaximum(os.cpu_count() or 1)
+        self.workers.setValue(1)
+
+        self.reload_interval.setMinimum(0)
+        self.reload_interval.setMaximum(100000)
+        self.reload_interval.setSingleStep(100)
+        self.reload_interval.setValue(0)
+        self.reload_interval.setToolTip(tr(
+            "For long runs, layers of previous projects are deleted with their providers and caches. Reading the "
+            "project takes some time, a few hundreds of features is a good start."
+        ))
 
         # DEBUG
         # self.file_name.setText('"schema" || \'/test_\' ||  "schema" || \'.qgs\'')
@@ -92,60 +143,94 @@ class GenerateProjectsDialog(QDialog, FORM_CLASS):
         self.file_name.setText(content)
 
     def generate_projects(self):
-        """The OK button to generate all projects. """
+        """The OK button to generate all projects, in a background task. """
         layer = self.coverage.currentLayer()
         if not layer:
             return
 
-        feedback = TextFeedBack(self.logs, self.progress)
+        self.logs.clear()
+        self.progress.setValue(0)
+        self.feedback = TextFeedBack(self.logs, self.progress)
 
-        if self.project.isDirty():
-            feedback.reportError(tr("You must save your project first."))
+        if self.project.isDirty() or not self.project.fileName():
+            # The task reads the saved project
+            self.feedback.reportError(tr("You must save your project first."))
+            return
 
         self.button_box.button(QDialogButtonBox.StandardButton.Apply).setEnabled(False)
-        result = False
-        with OverrideCursor(QtVar.WaitCursor):
-            self.logs.clear()
-
-            generator = GenerateProjects(
-                self.project,
-                layer,
-                self.field.currentField(),
-                self.file_name.text(),
-                Path(self.destination.filePath()),
-                self.copy_side_care_files.isChecked(),
-                feedback,
-                limit=self.debug_limit.value(),
-            )
-
-            try:
-                result = generator.process()
-            except QgsProcessingException as e:
-                feedback.reportError(str(e))
-            except Exception as e:
-                feedback.reportError(str(e))
-
-        if result:
-            feedback.pushInfo(tr("End") + " 👍")
-            feedback.pushInfo(tr("Dialog can be closed"))
+
+        self.task = GenerationTask(
+            self.project,
+            layer,
+            self.field.currentField(),
+            self.file_name.text(),
+            Path(self.destination.filePath()),
+            self.copy_side_care_files.isChecked(),
+            limit=self.debug_limit.value(),
+            verbosity=self.verbosity.currentData(),
+            workers=self.workers.value(),
+            incremental=self.incremental.isChecked(),
+            resume=self.resume.isChecked(),
+            deduplicate=self.deduplicate.isChecked(),
+            copy_strategy=self.copy_strategy.currentData(),
+            reuse_provider_metadata=self.reuse_provider_metadata.isChecked(),
+            reload_interval=self.reload_interval.value(),
+            profile=self.profile.isChecked(),
+        )
+        # Signals from the task are queued, they are received in the main thread
+        self.task.message.connect(self.log_message)
+        self.task.progressChanged.connect(self.feedback.setProgress)
+        self.task.taskCompleted.connect(self.task_finished)
+        self.task.taskTerminated.connect(self.task_finished)
+        # noinspection PyArgumentList
+        QgsApplication.taskManager().addTask(self.task)
+
+    def log_message(self, method: str, text: str):
+        """ Display a message sent by the task. """
+        if self.feedback:
+            getattr(self.feedback, method)(text)
+
+    def cancel(self):
+        """ Cancel the running task, or close the dialog. """
+        if self.task:
+            self.feedback.pushWarning(tr("Canceling…"))
+            self.task.cancel()
+            return
+        self.close()
+
+    def done(self, result: int):
+        """ The task is canceled when the dialog is closed. """
+        if self.task:
+            self.task.cancel()
+        super().done(result)
+
+    def task_finished(self):
+        """ When the task is completed, canceled or failed. """
+        task = self.task
+        self.task = None
+        if task.success and not task.isCanceled():
+            self.feedback.pushInfo(tr("End") + " 👍")
+            self.feedback.pushInfo(tr("Dialog can be closed"))
             # In case of success, the button is not enabled again
         else:
-            feedback.pushWarning(tr("End, but there was an error"))
+            self.feedback.pushWarning(tr("End, but there was an error"))
             self.button_box.button(QDialogButtonBox.StandardButton.Apply).setEnabled(True)
 
 
 class TextFeedBack(QgsProcessingFeedback):
 
-    def __init__(self, widget: QPlainTextEdit, progress: QProgressBar):
+    def __init__(self, widget: QPlainTextEdit, progress: QProgressBar, max_lines: int = MAX_LOG_LINES):
         super().__init__()
         self.widget = widget
+        # The widget behaves as a ring buffer, the oldest messages are removed
+        self.widget.setMaximumBlockCount(max_lines)
         self.progress = progress
 
     def setProgressText(self, text):
         pass
 
-    def setProgress(self, i: int):
-        self.progress.setValue(i)
+    def setProgress(self, i: float):
+        self.progress.setValue(int(i))
 
     def pushInfo(self, text):
         self.widget.appendHtml(f"<p>{text}</p>")
@@ -159,6 +244,9 @@ class TextFeedBack(QgsProcessingFeedback):
     def pushConsoleInfo(self, text):
         self.widget.appendHtml(f"<p style=\"color:grey\">{text}</p>")
 
+    def pushWarning(self, text):
+        self.widget.appendHtml(f"<p style=\"color:orange\">{text}</p>")
+
     def reportError(self, text, fatal_error=False):
         _ = fatal_error
         self.widget.appendHtml(f"<p style=\"color:red\">{text}</p>")
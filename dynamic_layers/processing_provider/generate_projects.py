@@ -2,25 +2,42 @@ __copyright__ = 'Copyright 2024, 3Liz'
 __license__ = 'GPL version 3'
 __email__ = 'info@3liz.org'
 
+import json
+import os
+
 from pathlib import Path
 from typing import Tuple
 
-from qgis.core import (  # QgsFeatureRequest,
+from qgis.core import (
     QgsExpression,
+    QgsFeatureRequest,
     QgsProcessing,
     QgsProcessingAlgorithm,
     QgsProcessingException,
+    QgsProcessingOutputNumber,
+    QgsProcessingOutputString,
     QgsProcessingParameterBoolean,
+    QgsProcessingParameterDefinition,
+    QgsProcessingParameterEnum,
     QgsProcessingParameterExpression,
     QgsProcessingParameterFeatureSource,
     QgsProcessingParameterField,
+    QgsProcessingParameterFileDestination,
     QgsProcessingParameterFolderDestination,
+    QgsProcessingParameterNumber,
+    QgsProject,
+    QgsVectorLayer,
 )
 from qgis.PyQt.QtGui import QIcon
 
 from dynamic_layers.core.generate_projects import GenerateProjects
-from dynamic_layers.definitions import CustomProperty
-from dynamic_layers.tools import resources_path, tr
+from dynamic_layers.definitions import (
+    CopyStrategy,
+    CustomProperty,
+    GenerationBackend,
+    Verbosity,
+)
+from dynamic_layers.tools import group_features_by_value, resources_path, tr
 
 
 class GenerateProjectsAlgorithm(QgsProcessingAlgorithm):
@@ -28,8 +45,32 @@ class GenerateProjectsAlgorithm(QgsProcessingAlgorithm):
     INPUT = 'INPUT'
     FIELD = 'FIELD'
     COPY_SIDE_CAR_FILES = "COPY_SIDE_CAR_FILES"
+    COPY_STRATEGY = 'COPY_STRATEGY'
     EXPRESSION_DESTINATION = "TEMPLATE_DESTINATION"
+    VERBOSITY = 'VERBOSITY'
+    BACKEND = 'BACKEND'
+    INCREMENTAL = 'INCREMENTAL'
+    RESUME = 'RESUME'
+    DEDUPLICATE = 'DEDUPLICATE'
+    REUSE_PROVIDER_METADATA = 'REUSE_PROVIDER_METADATA'
+    WORKERS = 'WORKERS'
+    LIMIT = 'LIMIT'
+    RELOAD_INTERVAL = 'RELOAD_INTERVAL'
+    TRACE = 'TRACE'
+    DRY_RUN = 'DRY_RUN'
+    PROFILE = 'PROFILE'
     OUTPUT = 'OUTPUT'
+    PROJECTS = 'PROJECTS'
+    TIMINGS = 'TIMINGS'
+
+    VERBOSITY_VALUES = (Verbosity.Quiet, Verbosity.Normal, Verbosity.Debug)
+    BACKEND_VALUES = (GenerationBackend.Project, GenerationBackend.Xml)
+    COPY_STRATEGY_VALUES = (CopyStrategy.Copy, CopyStrategy.Hardlink, CopyStrategy.Reflink, CopyStrategy.Symlink)
+
+    def __init__(self):
+        super().__init__()
+        # Saved project, read again by the algorithm in its own thread
+        self.project_path = None
 
     def createInstance(self):
         return type(self)()
@@ -75,6 +116,19 @@ class GenerateProjectsAlgorithm(QgsProcessingAlgorithm):
             )
         )
 
+        parameter = QgsProcessingParameterEnum(
+            self.COPY_STRATEGY,
+            tr('How side-car files and Lizmap media files are copied'),
+            options=[tr('Copy'), tr('Hard link'), tr('Copy on write (reflink), if supported'), tr('Symbolic link')],
+            defaultValue=self.COPY_STRATEGY_VALUES.index(CopyStrategy.Copy),
+        )
+        parameter.setHelp(tr(
+            "Links are much faster and do not use disk space, but files are shared with the template project. "
+            "A file is copied if the file system refuses the link. The Lizmap configuration file is always copied."
+        ))
+        parameter.setFlags(parameter.flags() | QgsProcessingParameterDefinition.FlagAdvanced)
+        self.addParameter(parameter)
+
         parameter = QgsProcessingParameterExpression(
             self.EXPRESSION_DESTINATION,
             tr('QGIS Expression to format the final filename. It must end with .qgs or .qgz.'),
@@ -86,6 +140,154 @@ class GenerateProjectsAlgorithm(QgsProcessingAlgorithm):
         ))
         self.addParameter(parameter)
 
+        parameter = QgsProcessingParameterBoolean(
+            self.DEDUPLICATE,
+            tr('Generate a single project for each value of the field'),
+            defaultValue=False,
+        )
+        parameter.setHelp(tr(
+            "If many features have the same value, the project is generated from the feature having the lowest ID. "
+            "If it's not checked, a project is generated for each feature, and values which are not unique are "
+            "reported as a warning."
+        ))
+        self.addParameter(parameter)
+
+        parameter = QgsProcessingParameterEnum(
+            self.VERBOSITY,
+            tr('Verbosity of the logs'),
+            options=[tr('Quiet'), tr('Normal'), tr('Debug')],
+            defaultValue=self.VERBOSITY_VALUES.index(Verbosity.Normal),
+        )
+        parameter.setHelp(tr(
+            "Quiet : only warnings and errors. Normal : one message per project. Debug : every evaluated expression, "
+            "it slows down the generation."
+        ))
+        parameter.setFlags(parameter.flags() | QgsProcessingParameterDefinition.FlagAdvanced)
+        self.addParameter(parameter)
+
+        parameter = QgsProcessingParameterEnum(
+            self.BACKEND,
+            tr('How projects are written'),
+            options=[tr('QGIS project'), tr('Patch the XML of the template project')],
+            defaultValue=self.BACKEND_VALUES.index(GenerationBackend.Project),
+        )
+        parameter.setHelp(tr(
+            "Patching the XML is faster, because layers are not loaded with their new datasources, but layer extents "
+            "are not updated. The project must be a QGS file."
+        ))
+        parameter.setFlags(parameter.flags() | QgsProcessingParameterDefinition.FlagAdvanced)
+        self.addParameter(parameter)
+
+        parameter = QgsProcessingParameterBoolean(
+            self.INCREMENTAL,
+            tr('Only generate projects having new inputs, and remove projects of features which have been removed'),
+            defaultValue=False,
+        )
+        parameter.setHelp(tr(
+            "A manifest is stored in the destination folder, with a hash of the template project, of side-car files "
+            "and of evaluated templates for each project. The project must be saved."
+        ))
+        self.addParameter(parameter)
+
+        parameter = QgsProcessingParameterBoolean(
+            self.RESUME,
+            tr('Resume the previous run, if it has been cancelled or interrupted'),
+            defaultValue=False,
+        )
+        parameter.setHelp(tr(
+            "Generated projects are recorded in a journal in the destination folder, until the run is complete. "
+            "Projects already generated by the previous run, with the same settings, are not generated again."
+        ))
+        self.addParameter(parameter)
+
+        parameter = QgsProcessingParameterBoolean(
+            self.REUSE_PROVIDER_METADATA,
+            tr('Read the schema of each dynamic layer only once, for datasources having the same fields'),
+            defaultValue=False,
+        )
+        parameter.setHelp(tr(
+            "Faster for databases, if only the filter or the table changes between projects. If the schema of a new "
+            "datasource is different, the datasource is set again as usual."
+        ))
+        parameter.setFlags(parameter.flags() | QgsProcessingParameterDefinition.FlagAdvanced)
+        self.addParameter(parameter)
+
+        parameter = QgsProcessingParameterNumber(
+            self.WORKERS,
+            tr('Number of processes generating projects at the same time'),
+            type=QgsProcessingParameterNumber.Integer,
+            defaultValue=1,
+            minValue=1,
+            maxValue=os.cpu_count() or 1,
+        )
+        parameter.setHelp(tr("The coverage layer can not be a memory layer with many processes."))
+        parameter.setFlags(parameter.flags() | QgsProcessingParameterDefinition.FlagAdvanced)
+        self.addParameter(parameter)
+
+        parameter = QgsProcessingParameterNumber(
+            self.LIMIT,
+            tr('Generate only the first projects, 0 to generate all projects'),
+            type=QgsProcessingParameterNumber.Integer,
+            defaultValue=0,
+            minValue=0,
+        )
+        parameter.setFlags(parameter.flags() | QgsProcessingParameterDefinition.FlagAdvanced)
+        self.addParameter(parameter)
+
+        parameter = QgsProcessingParameterNumber(
+            self.RELOAD_INTERVAL,
+            tr('Read the template project again every N features, to release memory, 0 to never read it again'),
+            type=QgsProcessingParameterNumber.Integer,
+            defaultValue=0,
+            minValue=0,
+        )
+        parameter.setHelp(tr(
+            "For long runs, layers of previous projects are deleted with their providers and caches. Reading the "
+            "project takes some time, a few hundreds of features is a good start."
+        ))
+        parameter.setFlags(parameter.flags() | QgsProcessingParameterDefinition.FlagAdvanced)
+        self.addParameter(parameter)
+
+        parameter = QgsProcessingParameterFileDestination(
+            self.TRACE,
+            tr('Timings of each phase, for each feature'),
+            fileFilter='CSV (*.csv);;JSON (*.json)',
+            optional=True,
+            createByDefault=False,
+        )
+        parameter.setHelp(tr(
+            "Seconds spent on expressions, datasources, extents, writing the project, side-car files for each "
+            "feature. Totals are always logged at the end, and returned as JSON in the TIMINGS result."
+        ))
+        parameter.setFlags(parameter.flags() | QgsProcessingParameterDefinition.FlagAdvanced)
+        self.addParameter(parameter)
+
+        parameter = QgsProcessingParameterFileDestination(
+            self.DRY_RUN,
+            tr('Dry run, only write evaluated templates of each feature'),
+            fileFilter='CSV (*.csv);;JSON (*.json)',
+            optional=True,
+            createByDefault=False,
+        )
+        parameter.setHelp(tr(
+            "The destination, the datasource, the title, the name and the abstract of each dynamic layer, and project "
+            "properties are written for each feature, with errors. No project is generated."
+        ))
+        parameter.setFlags(parameter.flags() | QgsProcessingParameterDefinition.FlagAdvanced)
+        self.addParameter(parameter)
+
+        parameter = QgsProcessingParameterBoolean(
+            self.PROFILE,
+            tr('Profile the generation, to attach the profile to a bug report'),
+            defaultValue=False,
+        )
+        parameter.setHelp(tr(
+            "A cProfile file and the top memory allocations, at the start and every 100 features, are written in the "
+            "destination folder. It slows down the generation."
+        ))
+        parameter.setFlags(parameter.flags() | QgsProcessingParameterDefinition.FlagAdvanced)
+        self.addParameter(parameter)
+
         self.addParameter(
             QgsProcessingParameterFolderDestination(
                 self.OUTPUT,
@@ -93,6 +295,10 @@ class GenerateProjectsAlgorithm(QgsProcessingAlgorithm):
             )
         )
 
+        self.addOutput(QgsProcessingOutputNumber(self.PROJECTS, tr('Number of generated projects')))
+        # A string output, QgsProcessingOutputVariant is not available in QGIS 3.28
+        self.addOutput(QgsProcessingOutputString(self.TIMINGS, tr('Seconds spent in each phase, as JSON')))
+
     def checkParameterValues(self, parameters, context) -> Tuple[bool, str]:
         layers = context.project().mapLayers().values()
         flag = False
@@ -143,13 +349,29 @@ class GenerateProjectsAlgorithm(QgsProcessingAlgorithm):
 
         return super().checkParameterValues(parameters, context)
 
+    def prepareAlgorithm(self, parameters, context, feedback):
+        _ = parameters
+        _ = feedback
+        self.project_path = context.project().fileName()
+        return True
+
     def processAlgorithm(self, parameters, context, feedback):
-        source = self.parameterAsVectorLayer(
-            parameters,
-            self.INPUT,
-            context
+        # The algorithm can run in a thread, the project of the context must not be modified
+        # noinspection PyArgumentList
+        project = QgsProject()
+        if not project.read(self.project_path):
+            raise QgsProcessingException(tr("Impossible to read the project {}").format(self.project_path))
+
+        source = self.coverage_layer(
+            project,
+            self.parameterAsVectorLayer(
+                parameters,
+                self.INPUT,
+                context
+            ),
         )
         copy_side_car_files = self.parameterAsBool(parameters, self.COPY_SIDE_CAR_FILES, context)
+        copy_strategy = self.COPY_STRATEGY_VALUES[self.parameterAsEnum(parameters, self.COPY_STRATEGY, context)]
         output_dir = Path(self.parameterAsString(parameters, self.OUTPUT, context))
         expression_destination = self.parameterAsExpression(parameters, self.EXPRESSION_DESTINATION, context)
         expression = QgsExpression(expression_destination)
@@ -159,14 +381,84 @@ class GenerateProjectsAlgorithm(QgsProcessingAlgorithm):
         if source is None:
             raise QgsProcessingException(self.invalidSourceError(parameters, self.INPUT))
 
+        verbosity = self.VERBOSITY_VALUES[self.parameterAsEnum(parameters, self.VERBOSITY, context)]
+        backend = self.BACKEND_VALUES[self.parameterAsEnum(parameters, self.BACKEND, context)]
+        incremental = self.parameterAsBool(parameters, self.INCREMENTAL, context)
+        resume = self.parameterAsBool(parameters, self.RESUME, context)
+        reuse_provider_metadata = self.parameterAsBool(parameters, self.REUSE_PROVIDER_METADATA, context)
+        workers = self.parameterAsInt(parameters, self.WORKERS, context)
+        limit = self.parameterAsInt(parameters, self.LIMIT, context) or None
+        trace = self.parameterAsFileOutput(parameters, self.TRACE, context)
+        profile = self.parameterAsBool(parameters, self.PROFILE, context)
+        dry_run = self.parameterAsFileOutput(parameters, self.DRY_RUN, context)
+        reload_interval = self.parameterAsInt(parameters, self.RELOAD_INTERVAL, context)
+
         field = self.parameterAsString(parameters, self.FIELD, context)
+        deduplicate = self.parameterAsBool(parameters, self.DEDUPLICATE, context)
         unique_values = source.uniqueValues(source.fields().indexFromName(field))
-        feedback.pushInfo(tr("Generating {} projects in {}").format(len(unique_values), output_dir))
-        feedback.pushDebugInfo(tr("List of uniques values") + " : " + ', '.join([str(i) for i in unique_values]))
-        feedback.pushDebugInfo(tr("Copy side car files") + " : " + str(copy_side_car_files))
+        count = len(unique_values) if deduplicate else source.featureCount()
+        if not deduplicate and len(unique_values) != source.featureCount():
+            groups = group_features_by_value(source, field)
+            duplicates = [f'{k} → {len(v)}' for k, v in groups.items() if len(v) >= 2]
+            feedback.pushWarning(tr(
+                "Your field '{}' does not have unique values within the given layer : {} unique values versus {} "
+                "features : {}. A project is generated for each feature."
+            ).format(
+                field,
+                len(unique_values),
+                source.featureCount(),
+                ', '.join(duplicates[:10]) + (', …' if len(duplicates) > 10 else ''),
+            ))
+        feedback.pushInfo(tr("Generating {} projects in {}").format(count, output_dir))
+        if verbosity >= Verbosity.Debug:
+            feedback.pushDebugInfo(tr("Number of uniques values") + " : " + str(len(unique_values)))
+            feedback.pushDebugInfo(tr("Copy side car files") + " : " + str(copy_side_car_files))
 
         generator = GenerateProjects(
-            context.project(), source, field, expression_destination, output_dir, copy_side_car_files, feedback)
+            project,
+            source,
+            field,
+            expression_destination,
+            output_dir,
+            copy_side_car_files,
+            feedback,
+            limit=limit,
+            verbosity=verbosity,
+            workers=workers,
+            backend=backend,
+            incremental=incremental,
+            resume=resume,
+            deduplicate=deduplicate,
+            copy_strategy=copy_strategy,
+            reuse_provider_metadata=reuse_provider_metadata,
+            trace=Path(trace) if trace else None,
+            profile=profile,
+            reload_interval=reload_interval,
+            dry_run=Path(dry_run) if dry_run else None,
+        )
         generator.process()
 
-        return {self.OUTPUT: str(output_dir)}
+        return {
+            self.OUTPUT: str(output_dir),
+            self.PROJECTS: len(generator.generated),
+            self.TRACE: trace or None,
+            self.DRY_RUN: dry_run or None,
+            # Seconds spent in each phase, see Phase
+            self.TIMINGS: json.dumps(generator.timings.totals()),
+        }
+
+    @staticmethod
+    def coverage_layer(project: QgsProject, layer: QgsVectorLayer) -> QgsVectorLayer | None:
+        """ The coverage layer, owned by the thread of the algorithm. """
+        if layer is None:
+            return None
+
+        coverage = project.mapLayer(layer.id())
+        if isinstance(coverage, QgsVectorLayer):
+            return coverage
+
+        if layer.providerType() == 'memory':
+            # Features of a memory layer are not saved in the project
+            return layer.materialize(QgsFeatureRequest())
+
+        return QgsVectorLayer(layer.source(), layer.name(), layer.providerType())
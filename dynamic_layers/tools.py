@@ -2,6 +2,8 @@ __copyright__ = 'Copyright 2024, 3Liz'
 __license__ = 'GPL version 3'
 __email__ = 'info@3liz.org'
 
+from collections import OrderedDict
+from collections.abc import Callable
 from pathlib import Path
 from typing import List
 
@@ -12,20 +14,139 @@ from qgis.core import (
     QgsExpressionContextScope,
     QgsExpressionContextUtils,
     QgsFeature,
+    QgsFeatureRequest,
+    QgsFeatureSource,
     QgsMessageLog,
     QgsProcessingException,
     QgsProcessingFeedback,
     QgsProject,
     QgsVectorLayer,
 )
-from qgis.PyQt.QtCore import QCoreApplication, QUrl
+from qgis.PyQt.QtCore import NULL, QCoreApplication, QThread, QUrl
 from qgis.PyQt.QtGui import QDesktopServices
 
-from dynamic_layers.definitions import PLUGIN_MESSAGE
+from dynamic_layers.definitions import (
+    PLUGIN_MESSAGE,
+    TemplateDependency,
+    Verbosity,
+)
 
 """ Tools to work with resources files. """
 
 
+class ExpressionCache:
+    """ Bounded cache of parsed and prepared QGIS expressions.
+
+    Expressions are keyed by their template and by the layer used in the expression context, because a prepared
+    expression keeps the field indexes of this layer. It is meant to be shared during a single generation run only.
+    """
+
+    def __init__(self, max_size: int = 512):
+        """ Constructor. """
+        self.max_size = max_size
+        self._expressions = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._expressions)
+
+    def clear(self):
+        """ Remove all expressions from the cache. """
+        self._expressions.clear()
+
+    def expression(
+            self, input_string: str, context: QgsExpressionContext, layer: QgsVectorLayer = None) -> QgsExpression:
+        """ Return a prepared expression for the given template, parsing it only the first time. """
+        key = (input_string, layer.id() if layer else None)
+        expression = self._expressions.get(key)
+        if expression is not None:
+            self._expressions.move_to_end(key)
+            return expression
+
+        expression = parse_expression(input_string)
+        expression.prepare(context)
+        self._expressions[key] = expression
+        if len(self._expressions) > self.max_size:
+            self._expressions.popitem(last=False)
+        return expression
+
+
+def parse_expression(input_string: str) -> QgsExpression:
+    """ Parse a QGIS expression, raise an exception if it's not valid. """
+    expression = QgsExpression(input_string)
+    if expression.hasEvalError() or expression.hasParserError():
+        raise QgsProcessingException(tr("Invalid QGIS expression : {}").format(input_string))
+    return expression
+
+
+def check_expressions(input_strings: list[str]) -> str | None:
+    """ Check all given expressions, return an error message listing all invalid expressions. """
+    errors = []
+    for input_string in dict.fromkeys(input_strings):
+        if not input_string:
+            continue
+        expression = QgsExpression(input_string)
+        if expression.hasParserError():
+            errors.append(f"{input_string} : {expression.parserErrorString()}")
+
+    if not errors:
+        return None
+
+    return tr("Invalid QGIS expressions :") + "\n" + "\n".join(errors)
+
+
+def referenced_columns(input_strings: list[str]) -> tuple[set[str], bool]:
+    """ Columns used by all given expressions, and if one of them needs the geometry.
+
+    QgsFeatureRequest.ALL_ATTRIBUTES is in the set if an expression can use any column.
+    """
+    columns = set()
+    needs_geometry = False
+    for input_string in dict.fromkeys(input_strings):
+        if not input_string:
+            continue
+        expression = QgsExpression(input_string)
+        columns.update(expression.referencedColumns())
+        needs_geometry = needs_geometry or expression.needsGeometry()
+    return columns, needs_geometry
+
+
+# Variables about the current feature
+FEATURE_VARIABLES = {'feature', 'id', 'geometry', 'parent', 'layer_name'}
+# Functions about the current feature, or having a new value for each call
+FEATURE_FUNCTIONS = {
+    '$id', '$currentfeature', 'attribute', 'attributes', 'represent_value', 'eval', 'eval_template',
+    'rand', 'randf', 'uuid', '$uuid', 'now', '$now',
+}
+
+
+def template_dependency(input_string: str) -> str:
+    """ What the value of an expression depends on, see TemplateDependency.
+
+    The analysis is conservative : if the expression might use the feature, it depends on the feature.
+    """
+    if not input_string:
+        return TemplateDependency.Constant
+
+    expression = QgsExpression(input_string)
+    if expression.hasParserError():
+        return TemplateDependency.Feature
+
+    variables = expression.referencedVariables()
+    functions = expression.referencedFunctions()
+    if (
+            expression.referencedColumns()
+            or expression.needsGeometry()
+            or variables & FEATURE_VARIABLES
+            or functions & FEATURE_FUNCTIONS
+    ):
+        return TemplateDependency.Feature
+
+    if variables or functions:
+        return TemplateDependency.Run
+
+    return TemplateDependency.Constant
+
+
 def string_substitution(
         input_string: str,
         variables: dict,
@@ -34,64 +155,115 @@ def string_substitution(
         feature: QgsFeature = None,
         is_template: bool = False,
         feedback: QgsProcessingFeedback = None,
+        cache: ExpressionCache = None,
+        context: QgsExpressionContext = None,
+        verbosity: int = Verbosity.Debug,
 ) -> str:
-    """ String substitution. """
+    """ String substitution.
+
+    If a cache is given, the parsed and prepared expression is reused between calls.
+    If a context is given, it is used as is, it must already contain the variables, the project, the layer and the
+    feature.
+    """
     if not input_string:
         msg = tr("No expression to evaluate, returning empty string")
-        log_message(msg, Qgis.MessageLevel.Info, feedback)
+        log_message(msg, Qgis.MessageLevel.Info, feedback, verbosity)
         return ""
 
-    msg = tr(
-        "Evaluation of the expression '{expression}' \n"
-        "with variables :\n").format(expression=input_string)
+    if is_log_enabled(Qgis.MessageLevel.Info, verbosity):
+        msg = tr(
+            "Evaluation of the expression '{expression}' \n"
+            "with variables :\n").format(expression=input_string)
+
+        for key, value in variables.items():
+            msg += f"→ {key} = {value}\n"
 
+        msg += tr("and project {project}\n").format(project=project.fileName() if project else "empty")
+        msg += tr("and layer {layer}\n").format(layer=layer.name() if layer else "empty")
+        msg += tr("and feature {feature}\n").format(feature=feature.id() if feature else "empty")
+        log_message(msg, Qgis.MessageLevel.Info, feedback, verbosity)
+
+    if context is None:
+        context = expression_context(variables, project, layer, feature)
+
+    if is_template:
+        # noinspection PyArgumentList
+        output = QgsExpression.replaceExpressionText(input_string, context)
+        return output
+
+    try:
+        if cache is not None:
+            expression = cache.expression(input_string, context, layer)
+        else:
+            expression = parse_expression(input_string)
+    except QgsProcessingException as e:
+        log_message(str(e), Qgis.MessageLevel.Critical, feedback, verbosity)
+        raise
+
+    output = expression.evaluate(context)
+    log_message(lambda: tr("Output is {}").format(output), Qgis.MessageLevel.Info, feedback, verbosity)
+
+    return output
+
+
+def expression_context(
+        variables: dict,
+        project: QgsProject = None,
+        layer: QgsVectorLayer = None,
+        feature: QgsFeature = None,
+) -> QgsExpressionContext:
+    """ Build a new expression context.
+
+    Variables are not flagged as static, an expression prepared from the cache is evaluated again with other values.
+    """
     scope = QgsExpressionContextScope()
     for key, value in variables.items():
-        scope.addVariable(QgsExpressionContextScope.StaticVariable(key, value, True, True))
-        msg += f"→ {key} = {value}\n"
+        scope.addVariable(QgsExpressionContextScope.StaticVariable(key, value, True, False))
 
     context = QgsExpressionContext()
     # noinspection PyArgumentList
     context.appendScope(QgsExpressionContextUtils.globalScope())
 
-    msg += tr("and project {project}\n").format(project=project.fileName() if project else "empty")
     if project:
         # noinspection PyArgumentList
         context.appendScope(QgsExpressionContextUtils.projectScope(project))
 
-    msg += tr("and layer {layer}\n").format(layer=layer.name() if layer else "empty")
     if layer:
         # noinspection PyArgumentList
         context.appendScope(QgsExpressionContextUtils.layerScope(layer))
 
-    msg += tr("and feature {feature}\n").format(feature=feature.id() if feature else "empty")
     if feature:
         context.setFeature(feature)
 
     context.appendScope(scope)
+    return context
 
-    log_message(msg, Qgis.MessageLevel.Info, feedback)
 
-    if is_template:
-        # noinspection PyArgumentList
-        output = QgsExpression.replaceExpressionText(input_string, context)
-        return output
+def is_log_enabled(level: Qgis.MessageLevel, verbosity: int = Verbosity.Debug) -> bool:
+    """ If a message with this level must be logged according to the verbosity. """
+    if level in (Qgis.MessageLevel.Warning, Qgis.MessageLevel.Critical):
+        return verbosity >= Verbosity.Quiet
+    if level == Qgis.MessageLevel.Success:
+        return verbosity >= Verbosity.Normal
+    return verbosity >= Verbosity.Debug
 
-    expression = QgsExpression(input_string)
-    if expression.hasEvalError() or expression.hasParserError():
-        msg = tr("Invalid QGIS expression : {}").format(input_string)
-        log_message(msg, Qgis.MessageLevel.Critical, feedback)
-        raise QgsProcessingException(msg)
 
-    output = expression.evaluate(context)
-    msg = tr("Output is {}").format(output)
-    log_message(msg, Qgis.MessageLevel.Info, feedback)
+def log_message(
+        msg: str | Callable[[], str],
+        level: Qgis.MessageLevel = Qgis.MessageLevel.Info,
+        feedback: QgsProcessingFeedback = None,
+        verbosity: int = Verbosity.Debug,
+):
+    """ Log a message, either in the log panel, or in the Processing UI panel.
 
-    return output
+    The message can be a callable, to format it only if the message is logged according to the verbosity.
+    """
+    if not is_log_enabled(level, verbosity):
+        return
 
+    if callable(msg):
+        msg = msg()
 
-def log_message(msg: str, level: Qgis.MessageLevel = Qgis.MessageLevel.Info, feedback: QgsProcessingFeedback = None):
-    """ Log a message, either in the log panel, or in the Processing UI panel. """
     # noinspection PyTypeChecker
     QgsMessageLog.logMessage(msg, PLUGIN_MESSAGE, level)
 
@@ -110,6 +282,25 @@ def log_message(msg: str, level: Qgis.MessageLevel = Qgis.MessageLevel.Info, fee
         feedback.pushDebugInfo(msg)
 
 
+def group_features_by_value(
+        source: QgsFeatureSource, field: str, feature_ids: list[int] | None = None) -> dict[object, list[int]]:
+    """ Feature IDs for each value of the field, only this field is fetched. NULL is grouped as None. """
+    request = QgsFeatureRequest()
+    # noinspection PyUnresolvedReferences
+    request.setFlags(QgsFeatureRequest.NoGeometry)
+    request.setSubsetOfAttributes([field], source.fields())
+    if feature_ids is not None:
+        request.setFilterFids(feature_ids)
+
+    groups = {}
+    for feature in source.getFeatures(request):
+        value = feature[field]
+        if value == NULL:
+            value = None
+        groups.setdefault(value, []).append(feature.id())
+    return groups
+
+
 def format_expression(input_text: str, is_expression: bool = True) -> str:
     """ Format the text if it's an expression. """
     if not is_expression:
@@ -149,6 +340,21 @@ def side_car_files(file_path: Path) -> List[Path]:
     return results
 
 
+def media_dirs(file_path: Path) -> list[Path] | None:
+    """ Return the list of Lizmap media folders of the project, None if the Lizmap plugin is not installed. """
+    try:
+        from lizmap.toolbelt.lizmap import sidecar_media_dirs
+    except ImportError:
+        return None
+    return sidecar_media_dirs(file_path)
+
+
+def is_gui_thread() -> bool:
+    """ If the code is running in the main thread of the application. """
+    application = QCoreApplication.instance()
+    return application is not None and QThread.currentThread() == application.thread()
+
+
 def tr(message: str) -> str:
     return QCoreApplication.translate('DynamicLayers', message)
 
@@ -0,0 +1,104 @@
+__copyright__ = 'Copyright 2024, 3Liz'
+__license__ = 'GPL version 3'
+__email__ = 'info@3liz.org'
+
+""" Micro-benchmark about expression evaluations, with and without the shared expression context.
+
+    python3 -m tests.benchmark_expressions --features 2000
+"""
+
+import argparse
+import time
+
+from qgis.core import (
+    QgsApplication,
+    QgsExpressionContextUtils,
+    QgsFeature,
+    QgsProject,
+    QgsVectorLayer,
+    edit,
+)
+
+from dynamic_layers.core.expression_context import DynamicExpressionContext
+from dynamic_layers.tools import ExpressionCache, string_substitution
+
+TEMPLATES = (
+    "concat('fixtures/folder_', \"folder\", '/lines_', \"folder\", '.geojson')",
+    "concat('Title ', \"name\", ' ', @project_variable)",
+    "concat('Abstract ', \"folder\")",
+    "lower(replace(\"name\", ' ', '_'))",
+)
+
+
+def coverage_layer(count: int) -> QgsVectorLayer:
+    """ A memory coverage layer with the given number of features. """
+    layer = QgsVectorLayer(
+        "None?field=id_feature:integer&field=folder:string(20)&field=name:string(20)", "coverage", "memory")
+    with edit(layer):
+        for i in range(count):
+            feature = QgsFeature(layer.fields())
+            feature.setAttributes([i, f"folder_{i}", f"Name {i}"])
+            # noinspection PyArgumentList
+            layer.addFeature(feature)
+    return layer
+
+
+def project_with_variables(count: int) -> QgsProject:
+    """ A project with some project variables, they are read when building the project scope. """
+    # noinspection PyArgumentList
+    project = QgsProject()
+    for i in range(count):
+        QgsExpressionContextUtils.setProjectVariable(project, f'variable_{i}', f'value {i}')
+    QgsExpressionContextUtils.setProjectVariable(project, 'project_variable', 'demo')
+    return project
+
+
+def benchmark_rebuilt(project: QgsProject, layer: QgsVectorLayer) -> int:
+    """ Each evaluation builds a new expression and a new context. """
+    count = 0
+    for feature in layer.getFeatures():
+        for template in TEMPLATES:
+            string_substitution(template, {}, project, layer, feature)
+            count += 1
+    return count
+
+
+def benchmark_shared(project: QgsProject, layer: QgsVectorLayer) -> int:
+    """ Expressions are cached, scopes are built once and only the feature is swapped. """
+    cache = ExpressionCache()
+    expression_context = DynamicExpressionContext(project)
+    count = 0
+    for feature in layer.getFeatures():
+        expression_context.set_feature(feature)
+        for template in TEMPLATES:
+            string_substitution(
+                template, {}, project, layer, feature, cache=cache, context=expression_context.context(layer))
+            count += 1
+    return count
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark of expression evaluations")
+    parser.add_argument('--features', type=int, default=1000, help="Number of features in the coverage layer")
+    parser.add_argument('--variables', type=int, default=50, help="Number of project variables")
+    args = parser.parse_args()
+
+    application = QgsApplication([], False)
+    application.initQgis()
+
+    project = project_with_variables(args.variables)
+    layer = coverage_layer(args.features)
+    project.addMapLayer(layer)
+
+    benchmarks = (("before, rebuilt context", benchmark_rebuilt), ("after, shared context", benchmark_shared))
+    for label, function in benchmarks:
+        start = time.perf_counter()
+        count = function(project, layer)
+        duration = time.perf_counter() - start
+        print(f"{label:<25} : {count} evaluations in {duration:.3f}s, {count / duration:.0f} evaluations/s")
+
+    application.exitQgis()
+
+
+if __name__ == '__main__':
+    main()
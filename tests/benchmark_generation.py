@@ -0,0 +1,376 @@
+__copyright__ = 'Copyright 2024, 3Liz'
+__license__ = 'GPL version 3'
+__email__ = 'info@3liz.org'
+
+""" Benchmark of the generation of projects, with synthetic coverage layers and template projects.
+
+Each scenario runs in its own process, to have its own peak RSS. Results are written as JSON, to be kept as a baseline
+and compared with the next release.
+
+    python3 -m tests.benchmark_generation --features 10,1000,10000 --layers 1,20,200 --output baseline.json
+    python3 -m tests.benchmark_generation --baseline baseline.json
+"""
+
+import argparse
+import gc
+import itertools
+import json
+import multiprocessing
+import os
+import platform
+import sys
+import tempfile
+import time
+
+from pathlib import Path
+from typing import List, Optional
+
+from qgis.core import (
+    Qgis,
+    QgsApplication,
+    QgsCoordinateTransformContext,
+    QgsFeature,
+    QgsGeometry,
+    QgsPointXY,
+    QgsProject,
+    QgsVectorFileWriter,
+    QgsVectorLayer,
+)
+
+from dynamic_layers.definitions import (
+    PLUGIN_SCOPE,
+    CopyStrategy,
+    CustomProperty,
+    GenerationBackend,
+    PluginProjectProperty,
+    Verbosity,
+)
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows
+    resource = None
+
+PROVIDERS = ('memory', 'geojson', 'gpkg', 'spatialite')
+
+# Driver and file extension of each provider stored in a file
+DRIVERS = {
+    'geojson': ('GeoJSON', 'geojson'),
+    'gpkg': ('GPKG', 'gpkg'),
+    'spatialite': ('SQLite', 'sqlite'),
+}
+
+# The QGIS application of the process running a scenario
+_application = None
+
+
+def integers(value: str) -> List[int]:
+    """ A list of integers, from a string separated by commas. """
+    return [int(i) for i in value.split(',') if i.strip()]
+
+
+def providers(value: str) -> List[str]:
+    """ A list of provider names, from a string separated by commas. """
+    names = [i.strip() for i in value.split(',') if i.strip()]
+    for name in names:
+        if name not in PROVIDERS:
+            raise argparse.ArgumentTypeError(f"Unknown provider {name}, it must be one of {', '.join(PROVIDERS)}")
+    return names
+
+
+def peak_rss() -> Optional[int]:
+    """ Peak resident set size of the process and its terminated children, in kB. None if it is not known. """
+    if not resource:
+        return None
+    size = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss + resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    if sys.platform == 'darwin':
+        # In bytes on macOS
+        size //= 1024
+    return size
+
+
+def current_rss() -> Optional[int]:
+    """ Current resident set size of the process, in kB. None if it is not known, only Linux is supported. """
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') // 1024
+    except OSError:
+        return None
+
+
+def memory_layer(count: int, geometry: bool) -> QgsVectorLayer:
+    """ A memory layer with the given number of features, having a line for each feature if needed. """
+    layer = QgsVectorLayer(
+        f"{'LineString?crs=epsg:4326&' if geometry else 'None?'}"
+        f"field=id_feature:integer&field=folder:string(20)&field=name:string(20)",
+        "layer",
+        "memory",
+    )
+    features = []
+    for i in range(1, count + 1):
+        feature = QgsFeature(layer.fields())
+        feature.setAttributes([i, f"folder_{i}", f"Name {i}"])
+        if geometry:
+            x = i % 360 - 180
+            feature.setGeometry(QgsGeometry.fromPolylineXY([QgsPointXY(x, 0), QgsPointXY(x, 1)]))
+        features.append(feature)
+    layer.dataProvider().addFeatures(features)
+    return layer
+
+
+def write_layer(layer: QgsVectorLayer, path: Path, driver: str):
+    """ Write the layer in a file, with the given OGR driver. """
+    options = QgsVectorFileWriter.SaveVectorOptions()
+    options.driverName = driver
+    options.layerName = 'lines'
+    if driver == 'SQLite':
+        options.datasourceOptions = ['SPATIALITE=YES']
+        options.layerOptions = ['GEOMETRY_NAME=geom']
+    result = QgsVectorFileWriter.writeAsVectorFormatV3(layer, str(path), QgsCoordinateTransformContext(), options)
+    if result[0] != QgsVectorFileWriter.WriterError.NoError:
+        raise Exception(f"Impossible to write {path} : {result[1]}")
+
+
+def dynamic_datasource(provider: str, path: Optional[Path]) -> str:
+    """ The template of the datasource, a single table filtered with the value of the feature. """
+    value_filter = "'\"folder\" = ''', \"folder\", ''''"
+    if provider == 'memory':
+        # The memory provider ignores the last parameter, the layer is always empty
+        return "concat('LineString?crs=epsg:4326&field=folder:string(20)&name=', \"folder\")"
+    if provider == 'spatialite':
+        return f"concat('dbname=''{path}'' table=\"lines\" (geom) sql=', {value_filter})"
+    if provider == 'gpkg':
+        return f"concat('{path}|layername=lines|subset=', {value_filter})"
+    return f"concat('{path}|subset=', {value_filter})"
+
+
+def static_datasource(provider: str, path: Optional[Path]) -> str:
+    """ The datasource of the layer in the template project, without any filter. """
+    if provider == 'memory':
+        return "LineString?crs=epsg:4326&field=folder:string(20)"
+    if provider == 'spatialite':
+        return f"dbname='{path}' table=\"lines\" (geom)"
+    if provider == 'gpkg':
+        return f"{path}|layername=lines"
+    return str(path)
+
+
+def write_files(folder: Path, prefix: str, count: int, size: int):
+    """ Write files having the given size in kB. """
+    folder.mkdir(parents=True, exist_ok=True)
+    content = os.urandom(size * 1024)
+    for i in range(count):
+        folder.joinpath(f"{prefix}{i}").write_bytes(content)
+
+
+def template_project(
+        folder: Path, features: int, layers: int, provider_names: List[str], side_car: int, media: int, size: int,
+) -> QgsProject:
+    """ Write the coverage layer, the data of dynamic layers and the template project in the folder. """
+    folder.mkdir(parents=True, exist_ok=True)
+    write_layer(memory_layer(features, False), folder.joinpath('coverage.gpkg'), 'GPKG')
+
+    lines = memory_layer(features, True)
+    paths = {}
+    for provider in provider_names:
+        if provider in DRIVERS:
+            driver, extension = DRIVERS[provider]
+            paths[provider] = folder.joinpath(f"lines.{extension}")
+            write_layer(lines, paths[provider], driver)
+
+    # noinspection PyArgumentList
+    project = QgsProject()
+    coverage = QgsVectorLayer(f"{folder.joinpath('coverage.gpkg')}|layername=lines", "coverage", "ogr")
+    project.addMapLayer(coverage)
+    for i, provider in zip(range(layers), itertools.cycle(provider_names)):
+        path = paths.get(provider)
+        provider_key = {'memory': 'memory', 'spatialite': 'spatialite'}.get(provider, 'ogr')
+        layer = QgsVectorLayer(static_datasource(provider, path), f"Layer {i} {provider}", provider_key)
+        layer.setCustomProperty(CustomProperty.DynamicDatasourceActive, True)
+        layer.setCustomProperty(CustomProperty.DynamicDatasourceContent, dynamic_datasource(provider, path))
+        layer.setCustomProperty(CustomProperty.TitleTemplate, f"concat('Layer {i} ', \"name\")")
+        project.addMapLayer(layer)
+
+    project.writeEntry(PLUGIN_SCOPE, PluginProjectProperty.Title, "concat('Title ', \"name\")")
+    project.writeEntry(PLUGIN_SCOPE, PluginProjectProperty.Abstract, "concat('Abstract ', \"folder\")")
+    project.setFileName(str(folder.joinpath('project.qgs')))
+    if not project.write():
+        raise Exception(f"Impossible to write the project {project.fileName()}")
+
+    # Side-car files, starting with the name of the project, and a Lizmap media folder
+    folder.joinpath('project.qgs.cfg').write_text(json.dumps({'layers': {}}))
+    write_files(folder, 'project.qgs.side_car_', side_car, size)
+    write_files(folder.joinpath('media'), 'media_', media, size)
+    return project
+
+
+def _init_scenario():
+    """ Start a headless QGIS application in the process running a scenario. """
+    global _application
+    os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+    _application = QgsApplication([], False)
+    _application.initQgis()
+
+
+def run_scenario(scenario: dict, options: dict) -> dict:
+    """ Run a single scenario, in its own process. """
+    # Imported once QGIS is ready
+    from dynamic_layers.core.generate_projects import GenerateProjects
+
+    phases = {}
+    with tempfile.TemporaryDirectory(prefix='dynamic_layers_benchmark_') as temp_dir:
+        start = time.perf_counter()
+        project = template_project(
+            Path(temp_dir).joinpath('template'),
+            scenario['features'],
+            scenario['layers'],
+            options['providers'],
+            options['side_car_files'],
+            options['media_files'],
+            options['file_size'],
+        )
+        phases['template'] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        # noinspection PyArgumentList
+        template = QgsProject()
+        template.read(project.fileName())
+        coverage = template.mapLayersByName('coverage')[0]
+        phases['read'] = time.perf_counter() - start
+
+        generator = GenerateProjects(
+            template,
+            coverage,
+            'folder',
+            "concat('project_', \"folder\", '.qgs')",
+            Path(temp_dir).joinpath('output'),
+            True,
+            limit=options['limit'],
+            verbosity=Verbosity.Quiet,
+            workers=options['workers'],
+            backend=options['backend'],
+            copy_strategy=options['copy_strategy'],
+            reuse_provider_metadata=options['reuse_provider_metadata'],
+            reload_interval=options['reload_interval'],
+        )
+        gc.collect()
+        rss_before = current_rss()
+        start = time.perf_counter()
+        success = generator.process()
+        phases['generation'] = time.perf_counter() - start
+        gc.collect()
+        rss_after = current_rss()
+
+    projects = len(generator.generated)
+    return {
+        **scenario,
+        'success': success,
+        'projects': projects,
+        'projects_per_second': projects / phases['generation'] if phases['generation'] else None,
+        'phases': phases,
+        # Phases inside the generation, summed over all features
+        'generation_phases': generator.timings.totals(),
+        'peak_rss_kb': peak_rss(),
+        # With --reload-interval, it must stay low however many features there are
+        'rss_growth_kb': rss_after - rss_before if rss_before and rss_after else None,
+    }
+
+
+def scenario_key(scenario: dict) -> tuple:
+    """ Identity of a scenario, to compare it with the baseline. """
+    return scenario['features'], scenario['layers']
+
+
+def print_results(results: List[dict], baseline: Optional[dict]):
+    """ Print a table of all scenarios on stderr, with the ratio against the baseline if any. """
+    previous = {scenario_key(s): s for s in baseline['scenarios']} if baseline else {}
+    print(
+        f"{'features':>8} {'layers':>6} {'projects':>8} {'projects/s':>10} {'peak RSS MB':>11} {'RSS growth MB':>13} "
+        f"{'vs baseline':>11}", file=sys.stderr)
+    for result in results:
+        speed = result['projects_per_second'] or 0
+        rss = (result['peak_rss_kb'] or 0) / 1024
+        growth = (result['rss_growth_kb'] or 0) / 1024
+        ratio = ''
+        before = previous.get(scenario_key(result))
+        if before and before['projects_per_second']:
+            ratio = f"x{speed / before['projects_per_second']:.2f}"
+        print(
+            f"{result['features']:>8} {result['layers']:>6} {result['projects']:>8} {speed:>10.1f} {rss:>11.0f} "
+            f"{growth:>13.1f} {ratio:>11}", file=sys.stderr)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark of the generation of projects")
+    parser.add_argument(
+        '--features', type=integers, default=[10, 1000],
+        help="Number of features in the coverage layer, separated by commas")
+    parser.add_argument(
+        '--layers', type=integers, default=[1, 20],
+        help="Number of dynamic layers in the template project, separated by commas")
+    parser.add_argument(
+        '--providers', type=providers, default=list(PROVIDERS),
+        help=f"Providers of dynamic layers, used in turn, separated by commas, among {', '.join(PROVIDERS)}")
+    parser.add_argument('--side-car-files', type=int, default=2, help="Number of side-car files of the project")
+    parser.add_argument(
+        '--media-files', type=int, default=0,
+        help="Number of files in the media folder, copied only if the Lizmap plugin is installed")
+    parser.add_argument('--file-size', type=int, default=10, help="Size of side-car and media files, in kB")
+    parser.add_argument('--limit', type=int, default=None, help="Generate only the first projects of each scenario")
+    parser.add_argument('--workers', type=int, default=1, help="Number of processes generating projects")
+    parser.add_argument(
+        '--backend', default=GenerationBackend.Project, choices=(GenerationBackend.Project, GenerationBackend.Xml))
+    parser.add_argument(
+        '--copy-strategy', default=CopyStrategy.Copy,
+        choices=(CopyStrategy.Copy, CopyStrategy.Hardlink, CopyStrategy.Reflink, CopyStrategy.Symlink))
+    parser.add_argument('--reuse-provider-metadata', action='store_true')
+    parser.add_argument(
+        '--reload-interval', type=int, default=0, help="Read the template project again every N features")
+    parser.add_argument('--output', type=Path, help="JSON file of results, to be used as a baseline")
+    parser.add_argument('--baseline', type=Path, help="JSON file of a previous run, to compare with")
+    args = parser.parse_args()
+
+    options = {
+        'providers': args.providers,
+        'side_car_files': args.side_car_files,
+        'media_files': args.media_files,
+        'file_size': args.file_size,
+        'limit': args.limit,
+        'workers': args.workers,
+        'backend': args.backend,
+        'copy_strategy': args.copy_strategy,
+        'reuse_provider_metadata': args.reuse_provider_metadata,
+        'reload_interval': args.reload_interval,
+    }
+
+    results = []
+    context = multiprocessing.get_context('spawn')
+    for features, layers in itertools.product(args.features, args.layers):
+        scenario = {'features': features, 'layers': layers}
+        print(f"Running {features} features with {layers} dynamic layers…", file=sys.stderr)
+        # A new process for each scenario, the peak RSS is not the one of the previous scenario
+        with context.Pool(1, initializer=_init_scenario) as pool:
+            results.append(pool.apply(run_scenario, (scenario, options)))
+
+    output = {
+        'qgis': Qgis.version(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'options': options,
+        'scenarios': results,
+    }
+
+    baseline = None
+    if args.baseline:
+        baseline = json.loads(args.baseline.read_text())
+    print_results(results, baseline)
+
+    if args.output:
+        args.output.write_text(json.dumps(output, indent=4))
+    else:
+        print(json.dumps(output, indent=4))
+
+
+if __name__ == '__main__':
+    main()
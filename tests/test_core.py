@@ -2,28 +2,57 @@ __copyright__ = 'Copyright 2024, 3Liz'
 __license__ = 'GPL version 3'
 __email__ = 'info@3liz.org'
 
+import csv
+import json
+import pstats
+import re
+import shutil
+import tracemalloc
 import unittest
+import zipfile
 
 from pathlib import Path
 
 from qgis.core import (
+    Qgis,
     QgsExpression,
     QgsFeature,
     QgsFeatureRequest,
+    QgsGeometry,
+    QgsGraduatedSymbolRenderer,
+    QgsLineSymbol,
+    QgsProcessingException,
+    QgsProcessingFeedback,
     QgsProject,
+    QgsRasterLayer,
+    QgsRendererRange,
     QgsVectorLayer,
     edit,
 )
 
 from dynamic_layers.core.dynamic_layers_engine import DynamicLayersEngine
+from dynamic_layers.core.expression_context import DynamicExpressionContext
 from dynamic_layers.core.generate_projects import GenerateProjects
+from dynamic_layers.core.generation_task import GenerationTask
+from dynamic_layers.core.journal import JOURNAL_FILE
+from dynamic_layers.core.manifest import MANIFEST_FILE
+from dynamic_layers.core.profiling import MEMORY_FILE, PROFILE_FILE
+from dynamic_layers.core.provider_cache import ProviderMetadataCache
+from dynamic_layers.core.side_car import SideCarFiles, link_or_copy
 from dynamic_layers.definitions import (
     PLUGIN_SCOPE,
+    CopyStrategy,
     CustomProperty,
+    ExtentSource,
+    GenerationBackend,
+    GraduatedClassification,
+    LayerProperty,
+    Phase,
     PluginProjectProperty,
+    Verbosity,
     WmsProjectProperty,
 )
-from dynamic_layers.tools import string_substitution
+from dynamic_layers.tools import ExpressionCache, string_substitution
 from tests.base_tests import BaseTests
 
 
@@ -58,6 +87,24 @@ class TestBasicReplacement(BaseTests):
         self.assertSetEqual({'folder_1', 'folder_2', 'folder_3'}, unique_values)
         return coverage
 
+    def _coverage_file(self, names: dict) -> QgsVectorLayer:
+        """ Internal function for a coverage layer stored in a GeoJSON file. """
+        coverage_path = Path(self.temp_dir).joinpath("coverage.geojson")
+        with open(coverage_path, 'w') as f:
+            json.dump({
+                "type": "FeatureCollection",
+                "features": [
+                    {
+                        "type": "Feature",
+                        "geometry": None,
+                        "properties": {"id_feature": i, "folder": f"folder_{i}", "name": name},
+                    } for i, name in names.items()
+                ],
+            }, f)
+        coverage = QgsVectorLayer(str(coverage_path), "coverage")
+        self.assertTrue(coverage.isValid())
+        return coverage
+
     def test_replacement_feature(self):
         """ Test datasource can be replaced using a feature. """
         # noinspection PyArgumentList
@@ -140,6 +187,267 @@ class TestBasicReplacement(BaseTests):
             project.readEntry(WmsProjectProperty.Capabilities, "/")
         )
 
+    def test_extent_updated_once(self):
+        """ Test the extent is updated only for layers having a new datasource. """
+        # noinspection PyArgumentList
+        project = QgsProject()
+        vector = QgsVectorLayer(str(Path(__file__).parent.joinpath("fixtures/folder_1/lines_1.geojson")), "Layer 1")
+        vector.setCustomProperty(CustomProperty.DynamicDatasourceActive, True)
+        vector.setCustomProperty(
+            CustomProperty.DynamicDatasourceContent,
+            f"concat('{Path(__file__).parent}/fixtures/', \"folder\", '/lines_', \"id_feature\", '.geojson')"
+        )
+        project.addMapLayer(vector)
+        project.addMapLayer(
+            QgsVectorLayer(str(Path(__file__).parent.joinpath("fixtures/folder_3/lines_3.geojson")), "Static"))
+        project.writeEntry(PLUGIN_SCOPE, PluginProjectProperty.ExtentLayer, vector.id())
+
+        engine = DynamicLayersEngine()
+        engine.discover_dynamic_layers_from_project(project)
+        coverage = self._coverage_layer()
+        features = {f['folder']: f for f in coverage.getFeatures()}
+
+        engine.set_layer_and_feature(coverage, features['folder_2'])
+        engine.update_dynamic_layers_datasource()
+        self.assertIsNotNone(engine.update_project_extent())
+        self.assertEqual(1, engine.extent_counters['updates'])
+
+        # Same datasource, nothing to update
+        engine.update_dynamic_layers_datasource()
+        engine.update_project_extent()
+        self.assertEqual(1, engine.extent_counters['updates'])
+
+        engine.set_layer_and_feature(coverage, features['folder_3'])
+        engine.update_dynamic_layers_datasource()
+        engine.update_project_extent()
+        self.assertEqual(2, engine.extent_counters['updates'])
+
+    def test_values_set_only_once(self):
+        """ Test values of layers are not set again if they are the same. """
+        # noinspection PyArgumentList
+        project = QgsProject()
+        vector = QgsVectorLayer(str(Path(__file__).parent.joinpath("fixtures/folder_1/lines_1.geojson")), "Layer 1")
+        vector.setCustomProperty(CustomProperty.DynamicDatasourceActive, True)
+        vector.setCustomProperty(
+            CustomProperty.DynamicDatasourceContent,
+            f"concat('{Path(__file__).parent}/fixtures/', \"folder\", '/lines_', \"id_feature\", '.geojson')"
+        )
+        vector.setCustomProperty(CustomProperty.NameTemplate, "'Constant name'")
+        vector.setCustomProperty(CustomProperty.TitleTemplate, "concat('Title ', \"folder\")")
+        project.addMapLayer(vector)
+
+        engine = DynamicLayersEngine()
+        engine.discover_dynamic_layers_from_project(project)
+        self.assertListEqual([vector.id()], engine.feature_dependent_layers())
+        coverage = self._coverage_layer()
+        features = {f['folder']: f for f in coverage.getFeatures()}
+
+        engine.set_layer_and_feature(coverage, features['folder_2'])
+        engine.update_dynamic_layers_datasource()
+        self.assertEqual('Constant name', vector.name())
+        self.assertEqual('Title 2', vector.title())
+
+        # The constant name is not set again
+        vector.setName('Changed')
+        engine.set_layer_and_feature(coverage, features['folder_3'])
+        engine.update_dynamic_layers_datasource()
+        self.assertEqual('Changed', vector.name())
+        self.assertEqual('Title 3', vector.title())
+        self.assertIn('folder_3', vector.source())
+
+    def test_graduated_classification(self):
+        """ Test the range of a graduated renderer according to the policy of the layer. """
+        # noinspection PyArgumentList
+        project = QgsProject()
+        coverage = self._coverage_layer()
+        features = {f['folder']: f for f in coverage.getFeatures()}
+
+        layers = {}
+        for policy in (
+                GraduatedClassification.Never,
+                GraduatedClassification.Always,
+                GraduatedClassification.Sample,
+                GraduatedClassification.Statistics,
+        ):
+            vector = QgsVectorLayer(str(Path(__file__).parent.joinpath("fixtures/folder_1/lines_1.geojson")), policy)
+            vector.setCustomProperty(CustomProperty.DynamicDatasourceActive, True)
+            vector.setCustomProperty(
+                CustomProperty.DynamicDatasourceContent,
+                f"concat('{Path(__file__).parent}/fixtures/', \"folder\", '/lines_', \"id_feature\", '.geojson')"
+            )
+            vector.setCustomProperty(CustomProperty.GraduatedClassification, policy)
+            # noinspection PyArgumentList
+            symbol = QgsLineSymbol.createSimple({})
+            vector.setRenderer(QgsGraduatedSymbolRenderer('"folder" * 10', [QgsRendererRange(0, 5, symbol, 'Label')]))
+            project.addMapLayer(vector)
+            layers[policy] = vector
+
+        engine = DynamicLayersEngine()
+        engine.discover_dynamic_layers_from_project(project)
+        engine.set_layer_and_feature(coverage, features['folder_2'])
+        engine.update_dynamic_layers_datasource()
+
+        def bounds(layer: QgsVectorLayer) -> tuple:
+            layer_range = layer.renderer().ranges()[0]
+            return layer_range.lowerValue(), layer_range.upperValue()
+
+        self.assertTupleEqual((0, 5), bounds(layers[GraduatedClassification.Never]))
+        self.assertTupleEqual((10, 20), bounds(layers[GraduatedClassification.Always]))
+        self.assertTupleEqual((10, 20), bounds(layers[GraduatedClassification.Sample]))
+        self.assertTupleEqual((10, 20), bounds(layers[GraduatedClassification.Statistics]))
+
+    def test_provider_metadata_cache(self):
+        """ Test the schema of a layer is reused for next datasources. """
+        fixtures = Path(__file__).parent.joinpath("fixtures")
+        # noinspection PyArgumentList
+        project = QgsProject()
+        filtered = QgsVectorLayer(str(fixtures.joinpath("folder_1/lines_1.geojson")), "Filtered")
+        filtered.setCustomProperty(CustomProperty.DynamicDatasourceActive, True)
+        filtered.setCustomProperty(
+            CustomProperty.DynamicDatasourceContent,
+            f"concat('{fixtures}/folder_1/lines_1.geojson|subset=\"folder\" = ', \"id_feature\")"
+        )
+        project.addMapLayer(filtered)
+        moved = QgsVectorLayer(str(fixtures.joinpath("folder_1/lines_1.geojson")), "Moved")
+        moved.setCustomProperty(CustomProperty.DynamicDatasourceActive, True)
+        moved.setCustomProperty(
+            CustomProperty.DynamicDatasourceContent,
+            f"concat('{fixtures}/', \"folder\", '/lines_', \"id_feature\", '.geojson')"
+        )
+        project.addMapLayer(moved)
+
+        provider_cache = ProviderMetadataCache()
+        engine = DynamicLayersEngine(provider_cache=provider_cache)
+        engine.discover_dynamic_layers_from_project(project)
+        coverage = self._coverage_layer()
+        features = {f['folder']: f for f in coverage.getFeatures()}
+
+        # First datasource, the schema is read
+        engine.set_layer_and_feature(coverage, features['folder_1'])
+        engine.update_dynamic_layers_datasource()
+        self.assertEqual({'filters': 0, 'trusted': 0, 'fallbacks': 0}, provider_cache.counters)
+        self.assertEqual(1, filtered.featureCount())
+
+        engine.set_layer_and_feature(coverage, features['folder_2'])
+        engine.update_dynamic_layers_datasource()
+        self.assertEqual({'filters': 1, 'trusted': 1, 'fallbacks': 0}, provider_cache.counters)
+        self.assertTrue(filtered.isValid())
+        self.assertEqual('"folder" = 2', filtered.subsetString())
+        self.assertEqual(1, filtered.featureCount())
+        self.assertTrue(moved.isValid())
+        self.assertTrue(moved.source().endswith('lines_2.geojson'))
+        self.assertListEqual(['folder', 'name'], moved.fields().names())
+
+    def test_raster_datasource(self):
+        """ Test a new datasource for a raster layer, without vector steps. """
+        for i in (1, 2, 3):
+            with open(Path(self.temp_dir).joinpath(f"raster_{i}.asc"), 'w') as f:
+                f.write(f"ncols 2\nnrows 2\nxllcorner {i * 10}\nyllcorner 0\ncellsize 1\n1 2\n3 4\n")
+
+        # noinspection PyArgumentList
+        project = QgsProject()
+        raster = QgsRasterLayer(str(Path(self.temp_dir).joinpath("raster_1.asc")), "Raster")
+        self.assertTrue(raster.isValid())
+        raster.setCustomProperty(CustomProperty.DynamicDatasourceActive, True)
+        raster.setCustomProperty(
+            CustomProperty.DynamicDatasourceContent, f"concat('{self.temp_dir}/raster_', \"id_feature\", '.asc')")
+        renderer = raster.renderer().clone()
+        project.addMapLayer(raster)
+
+        engine = DynamicLayersEngine()
+        engine.discover_dynamic_layers_from_project(project)
+        coverage = self._coverage_layer()
+        features = {f['folder']: f for f in coverage.getFeatures()}
+
+        engine.set_layer_and_feature(coverage, features['folder_2'])
+        engine.update_dynamic_layers_datasource()
+        self.assertTrue(raster.isValid())
+        self.assertTrue(raster.source().endswith('raster_2.asc'))
+        self.assertEqual(20, raster.extent().xMinimum())
+        # The style is kept, and the extent is the one of the provider
+        self.assertEqual(renderer.type(), raster.renderer().type())
+        self.assertEqual(0, engine.extent_counters['updates'])
+
+    def test_raster_datasource_min_max(self):
+        """ Test the min/max values of the raster renderer are kept, whatever the values of the new datasource. """
+        for i in (1, 2, 3):
+            with open(Path(self.temp_dir).joinpath(f"raster_{i}.asc"), 'w') as f:
+                f.write(f"ncols 2\nnrows 2\nxllcorner 0\nyllcorner 0\ncellsize 1\n{i} {i * 10}\n{i * 20} {i * 30}\n")
+
+        # noinspection PyArgumentList
+        project = QgsProject()
+        raster = QgsRasterLayer(str(Path(self.temp_dir).joinpath("raster_1.asc")), "Raster")
+        self.assertTrue(raster.isValid())
+        raster.setCustomProperty(CustomProperty.DynamicDatasourceActive, True)
+        raster.setCustomProperty(
+            CustomProperty.DynamicDatasourceContent, f"concat('{self.temp_dir}/raster_', \"id_feature\", '.asc')")
+        raster.renderer().contrastEnhancement().setMinimumValue(5)
+        raster.renderer().contrastEnhancement().setMaximumValue(50)
+        project.addMapLayer(raster)
+
+        engine = DynamicLayersEngine()
+        engine.discover_dynamic_layers_from_project(project)
+        coverage = self._coverage_layer()
+        features = {f['folder']: f for f in coverage.getFeatures()}
+
+        for folder in ('folder_2', 'folder_3'):
+            engine.set_layer_and_feature(coverage, features[folder])
+            engine.update_dynamic_layers_datasource()
+            self.assertTrue(raster.isValid())
+            self.assertTrue(raster.source().endswith(f"raster_{folder[-1]}.asc"))
+            self.assertEqual(5, raster.renderer().contrastEnhancement().minimumValue())
+            self.assertEqual(50, raster.renderer().contrastEnhancement().maximumValue())
+
+    def test_extent_from_feature(self):
+        """ Test the project extent computed from the geometry of the coverage feature. """
+        coverage = QgsVectorLayer(
+            "Polygon?crs=epsg:2154&field=id_feature:integer&field=folder:string(20)", "coverage", "memory")
+        with edit(coverage):
+            for i in (1, 2):
+                feature = QgsFeature(coverage.fields())
+                feature.setAttributes([i, f"folder_{i}"])
+                feature.setGeometry(QgsGeometry.fromWkt(f"POLYGON(({i} 0, {i + 10} 0, {i + 10} 20, {i} 20, {i} 0))"))
+                # noinspection PyArgumentList
+                coverage.addFeature(feature)
+
+        # noinspection PyArgumentList
+        project = QgsProject()
+        vector = QgsVectorLayer(str(Path(__file__).parent.joinpath("fixtures/folder_1/lines_1.geojson")), "Layer 1")
+        vector.setCustomProperty(CustomProperty.DynamicDatasourceActive, True)
+        vector.setCustomProperty(
+            CustomProperty.DynamicDatasourceContent,
+            f"concat('{Path(__file__).parent}/fixtures/', \"folder\", '/lines_', \"id_feature\", '.geojson')"
+        )
+        project.addMapLayer(vector)
+        project.writeEntry(PLUGIN_SCOPE, PluginProjectProperty.ExtentLayer, vector.id())
+        project.writeEntry(PLUGIN_SCOPE, PluginProjectProperty.ExtentSource, ExtentSource.Feature)
+        project.setFileName(str(Path(self.temp_dir).joinpath("parent.qgs")))
+        self.assertTrue(project.write())
+
+        engine = DynamicLayersEngine()
+        engine.discover_dynamic_layers_from_project(project)
+        self.assertTrue(engine.referenced_columns()[1])
+        feature = coverage.getFeature(1)
+        engine.set_layer_and_feature(coverage, feature)
+        self.assertListEqual(['1.0', '0.0', '11.0', '20.0'], engine.update_project_extent())
+
+        project.writeEntry(PLUGIN_SCOPE, PluginProjectProperty.ExtentSource, ExtentSource.Expression)
+        project.writeEntry(PLUGIN_SCOPE, PluginProjectProperty.ExtentExpression, "translate($geometry, 100, 0)")
+        self.assertListEqual(['101.0', '0.0', '111.0', '20.0'], engine.update_project_extent())
+
+        # The geometry is fetched from the coverage layer during the generation
+        project.writeEntry(PLUGIN_SCOPE, PluginProjectProperty.ExtentSource, ExtentSource.Feature)
+        destination = Path(self.temp_dir).joinpath("extent")
+        generator = GenerateProjects(
+            project, coverage, "folder", "concat('project_', \"folder\", '.qgs')", destination, False)
+        self.assertTrue(generator.process())
+        child_project = QgsProject()
+        self.assertTrue(child_project.read(str(destination.joinpath('project_folder_2.qgs'))))
+        self.assertListEqual(
+            ['2', '0', '12', '20'],
+            [str(int(float(i))) for i in child_project.readListEntry(WmsProjectProperty.Extent, "/")[0]],
+        )
+
     def test_replacement_variables(self):
         """ Test datasource can be replaced using variables. """
         # noinspection PyArgumentList
@@ -293,6 +601,866 @@ class TestBasicReplacement(BaseTests):
                 child_project.readEntry(WmsProjectProperty.Abstract, "/")
             )
 
+    def test_generate_projects_xml_backend(self):
+        """ Test generate projects by patching the XML of the template project. """
+        # noinspection PyArgumentList
+        project = QgsProject()
+        layer_name = "Layer 1"
+        vector = QgsVectorLayer(str(Path(__file__).parent.joinpath("fixtures/folder_1/lines_1.geojson")), layer_name)
+        vector.setCustomProperty(CustomProperty.DynamicDatasourceActive, True)
+        vector.setCustomProperty(
+            CustomProperty.DynamicDatasourceContent,
+            f"concat('{Path(__file__).parent}/fixtures/', \"folder\", '/lines_', \"id_feature\", '.geojson')"
+        )
+        vector.setCustomProperty(CustomProperty.TitleTemplate, "concat('Title ', \"name\")")
+        project.addMapLayer(vector)
+        project.writeEntry(PLUGIN_SCOPE, PluginProjectProperty.Abstract, "concat('Abstract ', \"folder\")")
+        project.writeEntry(PLUGIN_SCOPE, PluginProjectProperty.ExtentLayer, vector.id())
+        project.setFileName(str(Path(self.temp_dir).joinpath("parent.qgs")))
+        self.assertTrue(project.write())
+
+        coverage = self._coverage_layer()
+        destination = Path(self.temp_dir).joinpath("xml")
+        generator = GenerateProjects(
+            project,
+            coverage,
+            "folder",
+            "concat('project_', \"folder\", '.qgs')",
+            destination,
+            False,
+            backend=GenerationBackend.Xml,
+        )
+        self.assertTrue(generator.process())
+
+        # The template project has not been modified
+        self.assertIn('folder_1', vector.source())
+
+        for feature in coverage.getFeatures():
+            child_project = QgsProject()
+            self.assertTrue(child_project.read(str(destination.joinpath(f"project_{feature['folder']}.qgs"))))
+            layer = child_project.mapLayersByName(layer_name)[0]
+            self.assertIn(feature['folder'], layer.source())
+            self.assertEqual(f"Title {feature['name']}", layer.title())
+            self.assertTupleEqual(
+                (f"Abstract {feature['folder']}", True),
+                child_project.readEntry(WmsProjectProperty.Abstract, "/")
+            )
+            self.assertTrue(child_project.readListEntry(WmsProjectProperty.Extent, "/")[1])
+
+    def test_generate_projects_xml_backend_relative_paths(self):
+        """ Test relative paths of other layers are rebased to the folder of each new project, with the XML. """
+        data = Path(self.temp_dir).joinpath("data")
+        data.mkdir()
+        static_path = data.joinpath("static.geojson")
+        shutil.copy(Path(__file__).parent.joinpath("fixtures/folder_2/lines_2.geojson"), static_path)
+
+        # noinspection PyArgumentList
+        project = QgsProject()
+        vector = QgsVectorLayer(str(Path(__file__).parent.joinpath("fixtures/folder_1/lines_1.geojson")), "Layer 1")
+        vector.setCustomProperty(CustomProperty.DynamicDatasourceActive, True)
+        vector.setCustomProperty(
+            CustomProperty.DynamicDatasourceContent,
+            f"concat('{Path(__file__).parent}/fixtures/', \"folder\", '/lines_', \"id_feature\", '.geojson')"
+        )
+        project.addMapLayer(vector)
+        static = QgsVectorLayer(str(static_path), "Static")
+        self.assertTrue(static.isValid())
+        project.addMapLayer(static)
+        project.setFilePathStorage(Qgis.FilePathType.Relative)
+        project.setFileName(str(Path(self.temp_dir).joinpath("parent.qgs")))
+        self.assertTrue(project.write())
+
+        destination = Path(self.temp_dir).joinpath("output")
+        generator = GenerateProjects(
+            project,
+            self._coverage_layer(),
+            "folder",
+            "concat(\"folder\", '/project_', \"folder\", '.qgs')",
+            destination,
+            False,
+            backend=GenerationBackend.Xml,
+        )
+        self.assertTrue(generator.process())
+
+        for folder in ('folder_1', 'folder_2', 'folder_3'):
+            project_path = destination.joinpath(folder, f"project_{folder}.qgs")
+            self.assertIn('../../data/static.geojson', project_path.read_text())
+
+            # noinspection PyArgumentList
+            child_project = QgsProject()
+            self.assertTrue(child_project.read(str(project_path)))
+            layer = child_project.mapLayer(static.id())
+            self.assertTrue(layer.isValid())
+            self.assertEqual(static_path.resolve(), Path(layer.source()).resolve())
+
+    def test_generate_projects_xml_backend_qgz(self):
+        """ Test a QGZ template is refused by the XML backend, before writing anything in the destination. """
+        # noinspection PyArgumentList
+        project = QgsProject()
+        vector = QgsVectorLayer(str(Path(__file__).parent.joinpath("fixtures/folder_1/lines_1.geojson")), "Layer 1")
+        vector.setCustomProperty(CustomProperty.DynamicDatasourceActive, True)
+        vector.setCustomProperty(
+            CustomProperty.DynamicDatasourceContent,
+            f"concat('{Path(__file__).parent}/fixtures/', \"folder\", '/lines_', \"id_feature\", '.geojson')"
+        )
+        project.addMapLayer(vector)
+        project.setFileName(str(Path(self.temp_dir).joinpath("parent.qgz")))
+        self.assertTrue(project.write())
+
+        destination = Path(self.temp_dir).joinpath("xml_qgz")
+        with self.assertRaises(QgsProcessingException):
+            GenerateProjects(
+                project,
+                self._coverage_layer(),
+                "folder",
+                "concat('project_', \"folder\", '.qgs')",
+                destination,
+                False,
+                backend=GenerationBackend.Xml,
+            )
+        self.assertFalse(destination.exists())
+
+    def test_generate_projects_layer_name_variable(self):
+        """ Test @layer_name is the new name of the layer for each feature, in the title template. """
+        # noinspection PyArgumentList
+        project = QgsProject()
+        vector = QgsVectorLayer(str(Path(__file__).parent.joinpath("fixtures/folder_1/lines_1.geojson")), "Layer 1")
+        vector.setCustomProperty(CustomProperty.DynamicDatasourceActive, True)
+        vector.setCustomProperty(
+            CustomProperty.DynamicDatasourceContent,
+            f"concat('{Path(__file__).parent}/fixtures/', \"folder\", '/lines_', \"id_feature\", '.geojson')"
+        )
+        vector.setCustomProperty(CustomProperty.NameTemplate, "concat('Lines ', \"name\")")
+        vector.setCustomProperty(CustomProperty.TitleTemplate, "concat('Title of ', @layer_name)")
+        project.addMapLayer(vector)
+        project.setFileName(str(Path(self.temp_dir).joinpath("parent.qgs")))
+        self.assertTrue(project.write())
+
+        coverage = self._coverage_layer()
+        destination = Path(self.temp_dir).joinpath("layer_name")
+        generator = GenerateProjects(
+            project,
+            coverage,
+            "folder",
+            "concat('project_', \"folder\", '.qgs')",
+            destination,
+            False,
+        )
+        self.assertTrue(generator.process())
+
+        for feature in coverage.getFeatures():
+            # noinspection PyArgumentList
+            child_project = QgsProject()
+            self.assertTrue(child_project.read(str(destination.joinpath(f"project_{feature['folder']}.qgs"))))
+            layer = child_project.mapLayer(vector.id())
+            self.assertEqual(f"Lines {feature['name']}", layer.name())
+            self.assertEqual(f"Title of Lines {feature['name']}", layer.title())
+
+    def test_expression_cache(self):
+        """ Test expressions are parsed once and the cache is bounded. """
+        coverage = self._coverage_layer()
+        cache = ExpressionCache(max_size=2)
+        results = []
+        for feature in coverage.getFeatures():
+            results.append(string_substitution(
+                input_string="concat('Name ', \"folder\")",
+                variables={},
+                layer=coverage,
+                feature=feature,
+                cache=cache,
+            ))
+        self.assertListEqual(['Name folder_1', 'Name folder_2', 'Name folder_3'], results)
+        self.assertEqual(1, len(cache))
+
+        for template in ("'a'", "'b'", "'c'"):
+            string_substitution(input_string=template, variables={}, cache=cache)
+        self.assertEqual(2, len(cache))
+
+    def test_expression_cache_variables(self):
+        """ Test a cached expression is evaluated with the new values of variables. """
+        cache = ExpressionCache()
+        results = [
+            string_substitution(input_string="concat('Name ', @x)", variables={'x': value}, cache=cache)
+            for value in ('A', 'B')
+        ]
+        self.assertListEqual(['Name A', 'Name B'], results)
+        self.assertEqual(1, len(cache))
+
+    def test_shared_expression_context(self):
+        """ Test the feature and the variables can be swapped in a shared context. """
+        coverage = self._coverage_layer()
+        cache = ExpressionCache()
+        expression_context = DynamicExpressionContext()
+        expression_context.set_variables({'x': 'A'})
+        results = []
+        for feature in coverage.getFeatures():
+            expression_context.set_feature(feature)
+            results.append(string_substitution(
+                input_string="concat(@x, ' ', \"name\")",
+                variables={},
+                layer=coverage,
+                feature=feature,
+                cache=cache,
+                context=expression_context.context(coverage),
+            ))
+            expression_context.set_variables({'x': 'B'})
+        self.assertListEqual(['A Name 1', 'B Name 2', 'B Name 3'], results)
+
+    def test_generate_projects_invalid_expression(self):
+        """ Test an invalid expression is reported before writing any project. """
+        # noinspection PyArgumentList
+        project = QgsProject()
+        vector = QgsVectorLayer(
+            str(Path(__file__).parent.joinpath("fixtures/folder_1/lines_1.geojson")), "Layer 1")
+        vector.setCustomProperty(CustomProperty.DynamicDatasourceActive, True)
+        vector.setCustomProperty(CustomProperty.DynamicDatasourceContent, "concat('fixtures/folder_', \"folder\"")
+        project.addMapLayer(vector)
+        project.setFileName(str(Path(self.temp_dir).joinpath("parent.qgs")))
+        self.assertTrue(project.write())
+
+        destination = Path(self.temp_dir).joinpath("output")
+        generator = GenerateProjects(
+            project, self._coverage_layer(), "folder", "concat(\"folder\", '.qgs')", destination, False)
+        with self.assertRaises(QgsProcessingException):
+            generator.process()
+        self.assertFalse(destination.exists())
+
+    def test_generate_projects_parallel(self):
+        """ Test projects generated with many processes are the same as with a single process. """
+        # A coverage layer stored in a file, to be opened by each process
+        coverage = self._coverage_file({1: "Name 1", 2: "Name 2", 3: "Name 3"})
+
+        # noinspection PyArgumentList
+        project = QgsProject()
+        vector = QgsVectorLayer(str(Path(__file__).parent.joinpath("fixtures/folder_1/lines_1.geojson")), "Layer 1")
+        vector.setCustomProperty(CustomProperty.DynamicDatasourceActive, True)
+        vector.setCustomProperty(
+            CustomProperty.DynamicDatasourceContent,
+            f"concat('{Path(__file__).parent}/fixtures/', \"folder\", '/lines_', \"id_feature\", '.geojson')"
+        )
+        project.addMapLayer(vector)
+        project.writeEntry(PLUGIN_SCOPE, PluginProjectProperty.Abstract, "concat('Abstract ', \"folder\")")
+        project.setFileName(str(Path(self.temp_dir).joinpath("parent.qgs")))
+        self.assertTrue(project.write())
+
+        template_destination = "concat('project_', \"folder\", '.qgs')"
+        serial = Path(self.temp_dir).joinpath("serial")
+        parallel = Path(self.temp_dir).joinpath("parallel")
+        self.assertTrue(GenerateProjects(project, coverage, "folder", template_destination, serial, False).process())
+        self.assertTrue(
+            GenerateProjects(
+                project, coverage, "folder", template_destination, parallel, False, workers=2).process())
+
+        expected = sorted(f.name for f in serial.iterdir())
+        self.assertListEqual(['project_folder_1.qgs', 'project_folder_2.qgs', 'project_folder_3.qgs'], expected)
+        self.assertListEqual(expected, sorted(f.name for f in parallel.iterdir()))
+
+        for name in expected:
+            serial_project = QgsProject()
+            serial_project.read(str(serial.joinpath(name)))
+            parallel_project = QgsProject()
+            parallel_project.read(str(parallel.joinpath(name)))
+            self.assertEqual(
+                serial_project.mapLayersByName("Layer 1")[0].source(),
+                parallel_project.mapLayersByName("Layer 1")[0].source(),
+            )
+            self.assertTupleEqual(
+                serial_project.readEntry(WmsProjectProperty.Abstract, "/"),
+                parallel_project.readEntry(WmsProjectProperty.Abstract, "/"),
+            )
+
+    def test_generation_task(self):
+        """ Test the task generating projects from a copy of the saved project. """
+        # noinspection PyArgumentList
+        project = QgsProject()
+        vector = QgsVectorLayer(str(Path(__file__).parent.joinpath("fixtures/folder_1/lines_1.geojson")), "Layer 1")
+        vector.setCustomProperty(CustomProperty.DynamicDatasourceActive, True)
+        vector.setCustomProperty(
+            CustomProperty.DynamicDatasourceContent,
+            f"concat('{Path(__file__).parent}/fixtures/', \"folder\", '/lines_', \"id_feature\", '.geojson')"
+        )
+        project.addMapLayer(vector)
+        coverage = self._coverage_layer()
+        project.addMapLayer(coverage)
+        project.setFileName(str(Path(self.temp_dir).joinpath("parent.qgs")))
+        self.assertTrue(project.write())
+
+        destination = Path(self.temp_dir).joinpath("output")
+        messages = []
+        task = GenerationTask(project, coverage, "folder", "concat('project_', \"folder\", '.qgs')", destination, False)
+        task.message.connect(lambda method, text: messages.append(method))
+
+        # Run in the current thread, as the task manager would do in its own thread
+        self.assertTrue(task.run())
+        self.assertTrue(task.success)
+        self.assertListEqual(
+            ['project_folder_1.qgs', 'project_folder_2.qgs', 'project_folder_3.qgs'],
+            sorted(f.name for f in destination.iterdir()),
+        )
+        self.assertEqual(3, len(task.generated))
+        self.assertIn('pushInfo', messages)
+
+        # The project of the main thread is not modified
+        self.assertFalse(project.isDirty())
+        self.assertIn('folder_1', vector.source())
+
+        # Any error is sent to the dialog, such as a destination which is a file
+        destination = Path(self.temp_dir).joinpath("file")
+        destination.touch()
+        messages = []
+        task = GenerationTask(project, coverage, "folder", "concat('project_', \"folder\", '.qgs')", destination, False)
+        task.message.connect(lambda method, text: messages.append(method))
+        self.assertFalse(task.run())
+        self.assertIn('reportError', messages)
+
+        # Feature IDs of a memory layer are the original ones, not the ones of its copy in the task
+        with edit(coverage):
+            coverage.deleteFeature(1)
+        project.write()
+        destination = Path(self.temp_dir).joinpath("ids")
+        task = GenerationTask(
+            project, coverage, "folder", "concat('project_', \"folder\", '.qgs')", destination, False, feature_ids=[3])
+        self.assertTrue(task.run())
+        self.assertDictEqual({3: destination.joinpath('project_folder_3.qgs')}, task.generated)
+
+    def test_generate_projects_timings(self):
+        """ Test timings of each phase, and the trace of each feature. """
+        # noinspection PyArgumentList
+        project = QgsProject()
+        vector = QgsVectorLayer(str(Path(__file__).parent.joinpath("fixtures/folder_1/lines_1.geojson")), "Layer 1")
+        vector.setCustomProperty(CustomProperty.DynamicDatasourceActive, True)
+        vector.setCustomProperty(
+            CustomProperty.DynamicDatasourceContent,
+            f"concat('{Path(__file__).parent}/fixtures/', \"folder\", '/lines_', \"id_feature\", '.geojson')"
+        )
+        project.addMapLayer(vector)
+        project.setFileName(str(Path(self.temp_dir).joinpath("parent.qgs")))
+
+        trace = Path(self.temp_dir).joinpath("trace.csv")
+        generator = GenerateProjects(
+            project,
+            self._coverage_layer(),
+            "folder",
+            "concat('project_', \"folder\", '.qgs')",
+            Path(self.temp_dir).joinpath("output"),
+            False,
+            trace=trace,
+        )
+        self.assertTrue(generator.process())
+
+        for phase in (Phase.Evaluation, Phase.Datasource, Phase.ProjectExtent, Phase.Write):
+            self.assertIn(phase, generator.timings.totals())
+        self.assertEqual(3, generator.timings.counts[Phase.Write])
+        self.assertEqual(3, generator.timings.counts[Phase.Datasource])
+        self.assertIn(Phase.Datasource, generator.timings.layers[vector.id()])
+
+        with open(trace, newline='') as f:
+            rows = list(csv.DictReader(f))
+        self.assertEqual(3, len(rows))
+        self.assertIn(Phase.Write, rows[0])
+        self.assertSetEqual(
+            {str(feature.id()) for feature in generator.coverage.getFeatures()}, {row['feature_id'] for row in rows})
+
+    def test_generate_projects_plan(self):
+        """ Test templates evaluated before generating projects, the dry run and errors of all features. """
+        # noinspection PyArgumentList
+        project = QgsProject()
+        vector = QgsVectorLayer(str(Path(__file__).parent.joinpath("fixtures/folder_1/lines_1.geojson")), "Layer 1")
+        vector.setCustomProperty(CustomProperty.DynamicDatasourceActive, True)
+        vector.setCustomProperty(
+            CustomProperty.DynamicDatasourceContent,
+            f"concat('{Path(__file__).parent}/fixtures/', \"folder\", '/lines_', \"id_feature\", '.geojson')"
+        )
+        vector.setCustomProperty(CustomProperty.TitleTemplate, "concat('Title ', \"folder\")")
+        project.addMapLayer(vector)
+        project.writeEntry(PLUGIN_SCOPE, PluginProjectProperty.Title, "concat('Project ', \"name\")")
+        project.setFileName(str(Path(self.temp_dir).joinpath("parent.qgs")))
+
+        # Dry run
+        destination = Path(self.temp_dir).joinpath("output")
+        plan_path = Path(self.temp_dir).joinpath("plan.json")
+        generator = GenerateProjects(
+            project,
+            self._coverage_layer(),
+            "folder",
+            "concat('project_', \"folder\", '.qgs')",
+            destination,
+            False,
+            dry_run=plan_path,
+        )
+        self.assertTrue(generator.process())
+        self.assertFalse(destination.exists())
+        self.assertDictEqual({}, generator.generated)
+
+        plan = json.loads(plan_path.read_text())
+        self.assertListEqual([], plan['errors'])
+        self.assertEqual(3, len(plan['rows']))
+        row = [row for row in plan['rows'] if row['key'] == 'folder_2'][0]
+        self.assertEqual('project_folder_2.qgs', row['destination'])
+        self.assertEqual('Title folder_2', row[f'{vector.id()}:{LayerProperty.Title}'])
+        self.assertTrue(row[f'{vector.id()}:{LayerProperty.Datasource}'].endswith('folder_2/lines_2.geojson'))
+        self.assertEqual('Project Name 2', row[f'project:{WmsProjectProperty.Title}'])
+
+        # Values of the plan are used for projects
+        generator.dry_run = None
+        self.assertTrue(generator.process())
+        self.assertEqual(3, len(generator.plan))
+        self.assertIn(Phase.Plan, generator.timings.totals())
+        self.assertNotIn(Phase.Evaluation, generator.timings.totals())
+        # noinspection PyArgumentList
+        child_project = QgsProject()
+        self.assertTrue(child_project.read(str(destination.joinpath('project_folder_2.qgs'))))
+        self.assertEqual('Title folder_2', child_project.mapLayer(vector.id()).title())
+
+        # Errors of all features are reported, before generating any project
+        destination = Path(self.temp_dir).joinpath("errors")
+        generator = GenerateProjects(
+            project,
+            self._coverage_layer(),
+            "folder",
+            "if(\"folder\" = 'folder_3', 'project.txt', if(\"folder\" = 'folder_2', '', 'project.qgs'))",
+            destination,
+            False,
+        )
+        with self.assertRaises(QgsProcessingException):
+            generator.process()
+        self.assertFalse(destination.exists())
+        self.assertEqual(2, len(generator.plan.errors))
+        self.assertEqual(1, len(generator.plan))
+
+        # The CSV of the dry run has the errors too
+        plan_path = Path(self.temp_dir).joinpath("plan.csv")
+        generator.dry_run = plan_path
+        self.assertFalse(generator.process())
+        with open(plan_path, newline='') as f:
+            rows = list(csv.DictReader(f))
+        self.assertEqual(3, len(rows))
+        self.assertEqual(2, len([row for row in rows if row['error']]))
+
+        # The same destination for many features is only a warning, the last project is kept
+        destination = Path(self.temp_dir).joinpath("same")
+        generator = GenerateProjects(
+            project,
+            self._coverage_layer(),
+            "folder",
+            "'project.qgs'",
+            destination,
+            False,
+        )
+        self.assertTrue(generator.process())
+        self.assertListEqual([], generator.plan.errors)
+        self.assertEqual(2, len(generator.plan.warnings))
+        self.assertEqual(3, len(generator.plan))
+        self.assertListEqual([destination.joinpath('project.qgs')], list(destination.glob('*.qgs')))
+
+    def test_generate_projects_profile(self):
+        """ Test the CPU profile and memory allocations written in the destination folder. """
+        # noinspection PyArgumentList
+        project = QgsProject()
+        vector = QgsVectorLayer(str(Path(__file__).parent.joinpath("fixtures/folder_1/lines_1.geojson")), "Layer 1")
+        vector.setCustomProperty(CustomProperty.DynamicDatasourceActive, True)
+        vector.setCustomProperty(
+            CustomProperty.DynamicDatasourceContent,
+            f"concat('{Path(__file__).parent}/fixtures/', \"folder\", '/lines_', \"id_feature\", '.geojson')"
+        )
+        project.addMapLayer(vector)
+        project.setFileName(str(Path(self.temp_dir).joinpath("parent.qgs")))
+
+        destination = Path(self.temp_dir).joinpath("output")
+        generator = GenerateProjects(
+            project,
+            self._coverage_layer(),
+            "folder",
+            "concat('project_', \"folder\", '.qgs')",
+            destination,
+            False,
+            profile=True,
+            profile_interval=2,
+        )
+        self.assertTrue(generator.process())
+        self.assertFalse(tracemalloc.is_tracing())
+
+        stats = pstats.Stats(str(destination.joinpath(PROFILE_FILE.format(''))))
+        self.assertTrue(any(function[2] == '_process' for function in stats.stats.keys()))
+
+        memory = destination.joinpath(MEMORY_FILE.format('')).read_text()
+        self.assertIn('at the start', memory)
+        self.assertIn('After 2 features', memory)
+        self.assertIn('After 3 features', memory)
+
+    def test_generate_projects_profile_parallel(self):
+        """ Test each worker process keeps a single profile for all its slices. """
+        coverage = self._coverage_file({i: f"Name {i}" for i in range(1, 7)})
+
+        # noinspection PyArgumentList
+        project = QgsProject()
+        vector = QgsVectorLayer(str(Path(__file__).parent.joinpath("fixtures/folder_1/lines_1.geojson")), "Layer 1")
+        vector.setCustomProperty(CustomProperty.DynamicDatasourceActive, True)
+        vector.setCustomProperty(
+            CustomProperty.DynamicDatasourceContent,
+            f"concat('{Path(__file__).parent}/fixtures/folder_', (\"id_feature\" % 3) + 1, "
+            f"'/lines_', (\"id_feature\" % 3) + 1, '.geojson')"
+        )
+        project.addMapLayer(vector)
+        project.setFileName(str(Path(self.temp_dir).joinpath("parent.qgs")))
+        self.assertTrue(project.write())
+
+        destination = Path(self.temp_dir).joinpath("output")
+        generator = GenerateProjects(
+            project,
+            coverage,
+            "folder",
+            "concat('project_', \"folder\", '.qgs')",
+            destination,
+            False,
+            workers=2,
+            profile=True,
+            profile_interval=2,
+        )
+        self.assertTrue(generator.process())
+        self.assertEqual(6, len(generator.generated))
+
+        # The profile of the main process, and one for each worker process, with slices of a single feature
+        self.assertTrue(destination.joinpath(PROFILE_FILE.format('')).exists())
+        memory_files = list(destination.glob(MEMORY_FILE.format('_*')))
+        self.assertTrue(memory_files)
+        self.assertEqual(len(memory_files), len(list(destination.glob(PROFILE_FILE.format('_*')))))
+
+        counts = []
+        for path in memory_files:
+            memory = path.read_text()
+            self.assertIn('at the start', memory)
+            counts.append(max(int(count) for count in re.findall(r'After (\d+) features', memory)))
+        # Features are counted across slices, and periodic snapshots are taken in workers
+        self.assertEqual(6, sum(counts))
+        self.assertTrue(any('After 2 features' in path.read_text() for path in memory_files))
+
+    def test_generate_projects_reload(self):
+        """ Test the template project is read again every N features. The RSS growth is in the benchmark. """
+        coverage = self._coverage_file({i: f"Name {i}" for i in range(1, 6)})
+
+        # noinspection PyArgumentList
+        project = QgsProject()
+        vector = QgsVectorLayer(str(Path(__file__).parent.joinpath("fixtures/folder_1/lines_1.geojson")), "Layer 1")
+        vector.setCustomProperty(CustomProperty.DynamicDatasourceActive, True)
+        vector.setCustomProperty(
+            CustomProperty.DynamicDatasourceContent,
+            f"concat('{Path(__file__).parent}/fixtures/folder_', (\"id_feature\" % 3) + 1, "
+            f"'/lines_', (\"id_feature\" % 3) + 1, '.geojson')"
+        )
+        vector.setCustomProperty(CustomProperty.TitleTemplate, "concat('Title ', \"name\")")
+        project.addMapLayer(vector)
+        project.setFileName(str(Path(self.temp_dir).joinpath("parent.qgs")))
+        self.assertTrue(project.write())
+
+        destination = Path(self.temp_dir).joinpath("output")
+        generator = GenerateProjects(
+            project, coverage, "folder", "concat('project_', \"folder\", '.qgs')", destination, False,
+            verbosity=Verbosity.Quiet, reload_interval=2)
+        self.assertTrue(generator.process())
+
+        self.assertEqual(5, len(generator.generated))
+        # After the 2nd and the 4th features, not after the last one
+        self.assertEqual(2, generator.reloads)
+        for i in range(1, 6):
+            # noinspection PyArgumentList
+            child_project = QgsProject()
+            self.assertTrue(child_project.read(str(destination.joinpath(f"project_folder_{i}.qgs"))))
+            self.assertEqual(f"Title Name {i}", child_project.mapLayer(vector.id()).title())
+
+    def test_generate_projects_incremental(self):
+        """ Test only projects having new inputs are generated again. """
+        # noinspection PyArgumentList
+        project = QgsProject()
+        vector = QgsVectorLayer(str(Path(__file__).parent.joinpath("fixtures/folder_1/lines_1.geojson")), "Layer 1")
+        vector.setCustomProperty(CustomProperty.DynamicDatasourceActive, True)
+        vector.setCustomProperty(
+            CustomProperty.DynamicDatasourceContent,
+            f"concat('{Path(__file__).parent}/fixtures/', \"folder\", '/lines_', \"id_feature\", '.geojson')"
+        )
+        project.addMapLayer(vector)
+        project.writeEntry(PLUGIN_SCOPE, PluginProjectProperty.Abstract, "concat('Abstract ', \"name\")")
+        project_path = str(Path(self.temp_dir).joinpath("parent.qgs"))
+        project.setFileName(project_path)
+        self.assertTrue(project.write())
+
+        destination = Path(self.temp_dir).joinpath("incremental")
+        template_destination = "concat('project_', \"folder\", '.qgs')"
+
+        def generate(coverage_layer: QgsVectorLayer) -> GenerateProjects:
+            # A fresh copy of the template, as in a new QGIS session
+            template = QgsProject()
+            self.assertTrue(template.read(project_path))
+            generator = GenerateProjects(
+                template, coverage_layer, "folder", template_destination, destination, False, incremental=True)
+            self.assertTrue(generator.process())
+            return generator
+
+        generator = generate(self._coverage_file({1: "Name 1", 2: "Name 2", 3: "Name 3"}))
+        self.assertEqual(3, len(generator.generated))
+        self.assertTrue(destination.joinpath(MANIFEST_FILE).exists())
+        stats = {f.name: f.stat().st_mtime_ns for f in destination.glob('*.qgs')}
+        self.assertEqual(3, len(stats))
+
+        # Nothing has changed
+        generator = generate(self._coverage_file({1: "Name 1", 2: "Name 2", 3: "Name 3"}))
+        self.assertDictEqual({}, generator.generated)
+        self.assertDictEqual(stats, {f.name: f.stat().st_mtime_ns for f in destination.glob('*.qgs')})
+
+        # One feature is edited, one is removed
+        generator = generate(self._coverage_file({1: "Name 1", 2: "New name 2"}))
+        self.assertEqual(1, len(generator.generated))
+        self.assertListEqual(
+            ['project_folder_1.qgs', 'project_folder_2.qgs'], sorted(f.name for f in destination.glob('*.qgs')))
+        self.assertEqual(stats['project_folder_1.qgs'], destination.joinpath('project_folder_1.qgs').stat().st_mtime_ns)
+
+        child_project = QgsProject()
+        self.assertTrue(child_project.read(str(destination.joinpath('project_folder_2.qgs'))))
+        self.assertTupleEqual(("Abstract New name 2", True), child_project.readEntry(WmsProjectProperty.Abstract, "/"))
+
+    def test_generate_projects_incremental_same_value(self):
+        """ Test features having the same value in the field have their own entry in the manifest. """
+        # noinspection PyArgumentList
+        project = QgsProject()
+        vector = QgsVectorLayer(str(Path(__file__).parent.joinpath("fixtures/folder_1/lines_1.geojson")), "Layer 1")
+        vector.setCustomProperty(CustomProperty.DynamicDatasourceActive, True)
+        vector.setCustomProperty(
+            CustomProperty.DynamicDatasourceContent,
+            f"concat('{Path(__file__).parent}/fixtures/', \"folder\", '/lines_', \"id_feature\", '.geojson')"
+        )
+        project.addMapLayer(vector)
+        project_path = str(Path(self.temp_dir).joinpath("parent.qgs"))
+        project.setFileName(project_path)
+        self.assertTrue(project.write())
+
+        destination = Path(self.temp_dir).joinpath("incremental_same_value")
+        template_destination = "concat('project_', \"folder\", '.qgs')"
+
+        def generate(coverage_layer: QgsVectorLayer) -> GenerateProjects:
+            # A fresh copy of the template, as in a new QGIS session
+            template = QgsProject()
+            self.assertTrue(template.read(project_path))
+            generator = GenerateProjects(
+                template, coverage_layer, "name", template_destination, destination, False, incremental=True)
+            self.assertTrue(generator.process())
+            return generator
+
+        # The field "name" has the same value for all features, without the deduplicate option
+        generator = generate(self._coverage_file({1: "Name", 2: "Name", 3: "Name"}))
+        self.assertEqual(3, len(generator.generated))
+        stats = {f.name: f.stat().st_mtime_ns for f in destination.glob('*.qgs')}
+        self.assertEqual(3, len(stats))
+
+        # Nothing has changed
+        generator = generate(self._coverage_file({1: "Name", 2: "Name", 3: "Name"}))
+        self.assertDictEqual({}, generator.generated)
+        self.assertDictEqual(stats, {f.name: f.stat().st_mtime_ns for f in destination.glob('*.qgs')})
+
+        # Only the project of the removed feature is removed
+        generator = generate(self._coverage_file({1: "Name", 2: "Name"}))
+        self.assertDictEqual({}, generator.generated)
+        self.assertListEqual(
+            ['project_folder_1.qgs', 'project_folder_2.qgs'], sorted(f.name for f in destination.glob('*.qgs')))
+
+    def test_generate_projects_resume(self):
+        """ Test a cancelled run can be resumed. """
+        # noinspection PyArgumentList
+        project = QgsProject()
+        vector = QgsVectorLayer(str(Path(__file__).parent.joinpath("fixtures/folder_1/lines_1.geojson")), "Layer 1")
+        vector.setCustomProperty(CustomProperty.DynamicDatasourceActive, True)
+        vector.setCustomProperty(
+            CustomProperty.DynamicDatasourceContent,
+            f"concat('{Path(__file__).parent}/fixtures/', \"folder\", '/lines_', \"id_feature\", '.geojson')"
+        )
+        project.addMapLayer(vector)
+        project.setFileName(str(Path(self.temp_dir).joinpath("parent.qgs")))
+        self.assertTrue(project.write())
+
+        class CancelAfterFirstProject(QgsProcessingFeedback):
+            """ Cancel the run when the progress is updated after the first project. """
+
+            def __init__(self):
+                super().__init__()
+                self.count = 0
+
+            def setProgress(self, progress):
+                self.count += 1
+                if self.count == 2:
+                    self.cancel()
+                super().setProgress(progress)
+
+        coverage = self._coverage_layer()
+        destination = Path(self.temp_dir).joinpath("resume")
+        template_destination = "concat('project_', \"folder\", '.qgs')"
+
+        generator = GenerateProjects(
+            project, coverage, "folder", template_destination, destination, False, CancelAfterFirstProject())
+        self.assertTrue(generator.process())
+        self.assertEqual(1, len(generator.generated))
+        self.assertTrue(destination.joinpath(JOURNAL_FILE).exists())
+        self.assertListEqual(['project_folder_1.qgs'], sorted(f.name for f in destination.glob('*.qgs')))
+        first_project = destination.joinpath('project_folder_1.qgs').stat().st_mtime_ns
+
+        generator = GenerateProjects(
+            project, coverage, "folder", template_destination, destination, False, resume=True)
+        self.assertTrue(generator.process())
+        self.assertEqual(2, len(generator.generated))
+        self.assertFalse(destination.joinpath(JOURNAL_FILE).exists())
+        self.assertListEqual(
+            ['project_folder_1.qgs', 'project_folder_2.qgs', 'project_folder_3.qgs'],
+            sorted(f.name for f in destination.glob('*.qgs')),
+        )
+        self.assertEqual(first_project, destination.joinpath('project_folder_1.qgs').stat().st_mtime_ns)
+
+    def test_generate_projects_qgz(self):
+        """ Test files inside a QGZ archive have the final name of the project, not the temporary one. """
+        # noinspection PyArgumentList
+        project = QgsProject()
+        vector = QgsVectorLayer(str(Path(__file__).parent.joinpath("fixtures/folder_1/lines_1.geojson")), "Layer 1")
+        vector.setCustomProperty(CustomProperty.DynamicDatasourceActive, True)
+        vector.setCustomProperty(
+            CustomProperty.DynamicDatasourceContent,
+            f"concat('{Path(__file__).parent}/fixtures/', \"folder\", '/lines_', \"id_feature\", '.geojson')"
+        )
+        project.addMapLayer(vector)
+        project.setFileName(str(Path(self.temp_dir).joinpath("parent.qgs")))
+
+        destination = Path(self.temp_dir).joinpath("qgz")
+        generator = GenerateProjects(
+            project,
+            self._coverage_layer(),
+            "folder",
+            "concat('project_', \"folder\", '.qgz')",
+            destination,
+            False,
+        )
+        self.assertTrue(generator.process())
+
+        self.assertListEqual(
+            ['project_folder_1.qgz', 'project_folder_2.qgz', 'project_folder_3.qgz'],
+            sorted(f.name for f in destination.iterdir()),
+        )
+        with zipfile.ZipFile(destination.joinpath('project_folder_2.qgz')) as archive:
+            names = archive.namelist()
+        self.assertIn('project_folder_2.qgs', names)
+        self.assertFalse([name for name in names if '.part' in name])
+
+        # noinspection PyArgumentList
+        child_project = QgsProject()
+        self.assertTrue(child_project.read(str(destination.joinpath('project_folder_2.qgz'))))
+        self.assertIn('folder_2', child_project.mapLayer(vector.id()).source())
+
+    def test_generate_projects_deduplicate(self):
+        """ Test a single project is generated for each value of the field. """
+        # noinspection PyArgumentList
+        project = QgsProject()
+        vector = QgsVectorLayer(str(Path(__file__).parent.joinpath("fixtures/folder_1/lines_1.geojson")), "Layer 1")
+        vector.setCustomProperty(CustomProperty.DynamicDatasourceActive, True)
+        vector.setCustomProperty(
+            CustomProperty.DynamicDatasourceContent,
+            f"concat('{Path(__file__).parent}/fixtures/', \"folder\", '/lines_', \"id_feature\", '.geojson')"
+        )
+        project.addMapLayer(vector)
+        project.writeEntry(PLUGIN_SCOPE, PluginProjectProperty.Abstract, "concat('Abstract ', \"name\")")
+        project.setFileName(str(Path(self.temp_dir).joinpath("parent.qgs")))
+        self.assertTrue(project.write())
+
+        coverage = self._coverage_layer()
+        with edit(coverage):
+            feature = QgsFeature(coverage.fields())
+            feature.setAttributes([1, "folder_1", "Duplicated name 1"])
+            # noinspection PyArgumentList
+            coverage.addFeature(feature)
+        self.assertEqual(4, coverage.featureCount())
+
+        destination = Path(self.temp_dir).joinpath("deduplicate")
+        generator = GenerateProjects(
+            project,
+            coverage,
+            "folder",
+            "concat('project_', \"folder\", '.qgs')",
+            destination,
+            False,
+            deduplicate=True,
+        )
+        self.assertTrue(generator.process())
+        self.assertEqual(3, len(generator.generated))
+
+        # The feature having the lowest ID is used
+        child_project = QgsProject()
+        self.assertTrue(child_project.read(str(destination.joinpath('project_folder_1.qgs'))))
+        self.assertTupleEqual(("Abstract Name 1", True), child_project.readEntry(WmsProjectProperty.Abstract, "/"))
+
+    def test_side_car_files(self):
+        """ Test side-car files are listed and read once. """
+        folder = Path(self.temp_dir).joinpath("side_car")
+        folder.mkdir()
+        project_path = folder.joinpath("project.qgs")
+        project_path.touch()
+        folder.joinpath("project.qgs.cfg").write_text('{"options": {}}')
+        folder.joinpath("project.qgs.png").write_bytes(b'png')
+        folder.joinpath("other.qgs.png").write_bytes(b'other')
+
+        side_car = SideCarFiles(project_path)
+        self.assertListEqual(
+            [folder.joinpath("project.qgs.cfg"), folder.joinpath("project.qgs.png")], side_car.files)
+        self.assertEqual(2, len(side_car.contents))
+
+        # The template file is removed, but its content is still in memory
+        folder.joinpath("project.qgs.png").unlink()
+        new_path = folder.joinpath("new.qgs")
+        for a_file in side_car.files:
+            side_car.copy_file(a_file, side_car.file_destination(a_file, new_path))
+        self.assertEqual(b'png', folder.joinpath("new.qgs.png").read_bytes())
+        self.assertListEqual(
+            [folder.joinpath("new.qgs.cfg"), folder.joinpath("new.qgs.png")], side_car.outputs(new_path)[0:2])
+
+    def test_side_car_copy_strategy(self):
+        """ Test side-car files can be linked instead of copied. """
+        folder = Path(self.temp_dir).joinpath("strategy")
+        folder.mkdir()
+        source = folder.joinpath("source.png")
+        source.write_bytes(b'png')
+
+        destination = folder.joinpath("hardlink.png")
+        self.assertEqual(CopyStrategy.Hardlink, link_or_copy(source, destination, CopyStrategy.Hardlink))
+        self.assertEqual(source.stat().st_ino, destination.stat().st_ino)
+
+        # An existing link is replaced, the source is never written
+        self.assertEqual(CopyStrategy.Copy, link_or_copy(source, destination, CopyStrategy.Copy))
+        self.assertNotEqual(source.stat().st_ino, destination.stat().st_ino)
+
+        destination = folder.joinpath("symlink.png")
+        self.assertEqual(CopyStrategy.Symlink, link_or_copy(source, destination, CopyStrategy.Symlink))
+        self.assertTrue(destination.is_symlink())
+
+        # The source is never removed, even from another path
+        for strategy in (CopyStrategy.Copy, CopyStrategy.Hardlink, CopyStrategy.Symlink, CopyStrategy.Reflink):
+            self.assertEqual(strategy, link_or_copy(source, source, strategy))
+            self.assertEqual(strategy, link_or_copy(source, folder.joinpath("..", folder.name, source.name), strategy))
+            self.assertEqual(b'png', source.read_bytes())
+            self.assertFalse(source.is_symlink())
+
+        # Either a reflink or a copy, according to the file system
+        destination = folder.joinpath("reflink.png")
+        self.assertIn(
+            link_or_copy(source, destination, CopyStrategy.Reflink), (CopyStrategy.Reflink, CopyStrategy.Copy))
+        self.assertEqual(b'png', destination.read_bytes())
+
+        # The Lizmap configuration file is always copied
+        project_path = folder.joinpath("project.qgs")
+        project_path.touch()
+        folder.joinpath("project.qgs.cfg").write_text('{"options": {}}')
+        folder.joinpath("project.qgs.png").write_bytes(b'png')
+        side_car = SideCarFiles(project_path, CopyStrategy.Hardlink)
+        new_path = folder.joinpath("new.qgs")
+        for a_file in side_car.files:
+            side_car.copy_file(a_file, side_car.file_destination(a_file, new_path))
+        self.assertEqual(
+            folder.joinpath("project.qgs.png").stat().st_ino, folder.joinpath("new.qgs.png").stat().st_ino)
+        self.assertNotEqual(
+            folder.joinpath("project.qgs.cfg").stat().st_ino, folder.joinpath("new.qgs.cfg").stat().st_ino)
+
 
 if __name__ == '__main__':
     unittest.main()
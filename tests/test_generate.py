@@ -0,0 +1,73 @@
+__copyright__ = 'Copyright 2024, 3Liz'
+__license__ = 'GPL version 3'
+__email__ = 'info@3liz.org'
+
+import io
+import json
+
+from pathlib import Path
+
+from qgis.core import QgsProject, QgsVectorLayer
+
+from dynamic_layers.definitions import CustomProperty
+from dynamic_layers.generate import main
+from tests.base_tests import BaseTests
+
+
+class TestCommandLine(BaseTests):
+
+    def test_generate_projects(self):
+        """ Test to generate projects from the command line. """
+        coverage_path = Path(self.temp_dir).joinpath("coverage.geojson")
+        with open(coverage_path, 'w') as f:
+            json.dump({
+                "type": "FeatureCollection",
+                "features": [
+                    {"type": "Feature", "geometry": None, "properties": {"folder": f"folder_{i}"}} for i in (1, 2)
+                ],
+            }, f)
+
+        # noinspection PyArgumentList
+        project = QgsProject()
+        vector = QgsVectorLayer(str(Path(__file__).parent.joinpath("fixtures/folder_1/lines_1.geojson")), "Layer 1")
+        vector.setCustomProperty(CustomProperty.DynamicDatasourceActive, True)
+        vector.setCustomProperty(
+            CustomProperty.DynamicDatasourceContent,
+            f"concat('{Path(__file__).parent}/fixtures/', \"folder\", '/lines_1.geojson')"
+        )
+        project.addMapLayer(vector)
+        project_path = Path(self.temp_dir).joinpath("parent.qgs")
+        project.setFileName(str(project_path))
+        self.assertTrue(project.write())
+
+        destination = Path(self.temp_dir).joinpath("output")
+        stream = io.StringIO()
+        exit_code = main([
+            str(project_path),
+            '--coverage', str(coverage_path),
+            '--field', 'folder',
+            '--expression', "concat('project_', \"folder\", '.qgs')",
+            '--destination', str(destination),
+        ], stream)
+        self.assertEqual(0, exit_code)
+
+        lines = [json.loads(line) for line in stream.getvalue().splitlines()]
+        self.assertEqual(100, [line for line in lines if line['type'] == 'progress'][-1]['progress'])
+        result = lines[-1]
+        self.assertEqual('result', result['type'])
+        self.assertTrue(result['success'])
+        self.assertEqual(2, len(result['projects']))
+        self.assertTrue(destination.joinpath("project_folder_1.qgs").exists())
+        self.assertTrue(destination.joinpath("project_folder_2.qgs").exists())
+
+        # Wrong field
+        stream = io.StringIO()
+        exit_code = main([
+            str(project_path),
+            '--coverage', str(coverage_path),
+            '--field', 'unknown',
+            '--expression', "concat('project_', \"folder\", '.qgs')",
+            '--destination', str(destination),
+        ], stream)
+        self.assertEqual(1, exit_code)
+        self.assertEqual('error', json.loads(stream.getvalue().splitlines()[-1])['type'])
@@ -0,0 +1,127 @@
+__copyright__ = 'Copyright 2024, 3Liz'
+__license__ = 'GPL version 3'
+__email__ = 'info@3liz.org'
+
+import json
+
+from pathlib import Path
+
+from qgis.core import (
+    QgsProcessingContext,
+    QgsProcessingFeedback,
+    QgsProject,
+    QgsVectorLayer,
+)
+
+from dynamic_layers.definitions import CustomProperty, Phase
+from dynamic_layers.processing_provider.generate_projects import (
+    GenerateProjectsAlgorithm,
+)
+from tests.base_tests import BaseTests
+
+
+class TestProcessing(BaseTests):
+
+    def test_generate_projects_algorithm(self):
+        """ Test the Processing algorithm, with a project of its own. """
+        coverage_path = Path(self.temp_dir).joinpath("coverage.geojson")
+        with open(coverage_path, 'w') as f:
+            json.dump({
+                "type": "FeatureCollection",
+                "features": [
+                    {"type": "Feature", "geometry": None, "properties": {"folder": f"folder_{i}"}} for i in (1, 2, 3)
+                ],
+            }, f)
+
+        # noinspection PyArgumentList
+        project = QgsProject()
+        vector = QgsVectorLayer(str(Path(__file__).parent.joinpath("fixtures/folder_1/lines_1.geojson")), "Layer 1")
+        vector.setCustomProperty(CustomProperty.DynamicDatasourceActive, True)
+        vector.setCustomProperty(
+            CustomProperty.DynamicDatasourceContent,
+            f"concat('{Path(__file__).parent}/fixtures/', \"folder\", '/lines_1.geojson')"
+        )
+        project.addMapLayer(vector)
+        coverage = QgsVectorLayer(str(coverage_path), "coverage")
+        project.addMapLayer(coverage)
+        project.setFileName(str(Path(self.temp_dir).joinpath("parent.qgs")))
+        self.assertTrue(project.write())
+
+        algorithm = GenerateProjectsAlgorithm()
+        algorithm.initAlgorithm()
+        context = QgsProcessingContext()
+        context.setProject(project)
+        feedback = QgsProcessingFeedback()
+        destination = Path(self.temp_dir).joinpath("output")
+        parameters = {
+            'INPUT': coverage.id(),
+            'FIELD': 'folder',
+            'TEMPLATE_DESTINATION': "concat('project_', \"folder\", '.qgs')",
+            'LIMIT': 2,
+            'OUTPUT': str(destination),
+        }
+        ok, msg = algorithm.checkParameterValues(parameters, context)
+        self.assertTrue(ok, msg)
+        results, ok = algorithm.run(parameters, context, feedback)
+        self.assertTrue(ok)
+        self.assertEqual(2, results['PROJECTS'])
+        self.assertIn(Phase.Write, json.loads(results['TIMINGS']))
+        self.assertTrue(destination.joinpath("project_folder_1.qgs").exists())
+        self.assertTrue(destination.joinpath("project_folder_2.qgs").exists())
+        self.assertFalse(destination.joinpath("project_folder_3.qgs").exists())
+
+        # The project of the context is not modified
+        self.assertFalse(project.isDirty())
+        self.assertIn('folder_1', vector.source())
+
+    def test_generate_projects_algorithm_duplicates(self):
+        """ Test values which are not unique are only a warning, unless a single project is generated for each. """
+        coverage_path = Path(self.temp_dir).joinpath("coverage.geojson")
+        with open(coverage_path, 'w') as f:
+            json.dump({
+                "type": "FeatureCollection",
+                "features": [
+                    {"type": "Feature", "geometry": None, "properties": {"folder": f"folder_{i}"}} for i in (1, 1, 2)
+                ],
+            }, f)
+
+        # noinspection PyArgumentList
+        project = QgsProject()
+        vector = QgsVectorLayer(str(Path(__file__).parent.joinpath("fixtures/folder_1/lines_1.geojson")), "Layer 1")
+        vector.setCustomProperty(CustomProperty.DynamicDatasourceActive, True)
+        vector.setCustomProperty(
+            CustomProperty.DynamicDatasourceContent,
+            f"concat('{Path(__file__).parent}/fixtures/', \"folder\", '/lines_1.geojson')"
+        )
+        project.addMapLayer(vector)
+        coverage = QgsVectorLayer(str(coverage_path), "coverage")
+        project.addMapLayer(coverage)
+        project.setFileName(str(Path(self.temp_dir).joinpath("parent.qgs")))
+        self.assertTrue(project.write())
+
+        algorithm = GenerateProjectsAlgorithm()
+        algorithm.initAlgorithm()
+        context = QgsProcessingContext()
+        context.setProject(project)
+        parameters = {
+            'INPUT': coverage.id(),
+            'FIELD': 'folder',
+            'TEMPLATE_DESTINATION': "concat('project_', \"folder\", '.qgs')",
+            'OUTPUT': str(Path(self.temp_dir).joinpath("output")),
+        }
+        ok, msg = algorithm.checkParameterValues(parameters, context)
+        self.assertTrue(ok, msg)
+
+        warnings = []
+        feedback = QgsProcessingFeedback()
+        feedback.pushWarning = warnings.append
+        results, ok = algorithm.run(parameters, context, feedback)
+        self.assertTrue(ok)
+        # A project for each feature, by default
+        self.assertEqual(3, results['PROJECTS'])
+        self.assertTrue(any('does not have unique values' in warning for warning in warnings))
+
+        parameters['DEDUPLICATE'] = True
+        results, ok = algorithm.run(parameters, context, QgsProcessingFeedback())
+        self.assertTrue(ok)
+        self.assertEqual(2, results['PROJECTS'])
@@ -7,7 +7,16 @@ import unittest
 
 from pathlib import Path
 
-from dynamic_layers.tools import side_car_files, string_substitution
+from qgis.core import Qgis, QgsFeatureRequest
+
+from dynamic_layers.definitions import TemplateDependency, Verbosity
+from dynamic_layers.tools import (
+    is_log_enabled,
+    referenced_columns,
+    side_car_files,
+    string_substitution,
+    template_dependency,
+)
 
 
 class TestTools(unittest.TestCase):
@@ -30,7 +39,41 @@ class TestTools(unittest.TestCase):
             expected = [side_1, side_2]
             expected.sort()
             self.assertListEqual(expected, side_car_files(test))
+
+    def test_log_enabled(self):
+        """ Test messages are filtered according to the verbosity. """
+        self.assertTrue(is_log_enabled(Qgis.MessageLevel.Critical, Verbosity.Quiet))
+        self.assertFalse(is_log_enabled(Qgis.MessageLevel.Success, Verbosity.Quiet))
+        self.assertTrue(is_log_enabled(Qgis.MessageLevel.Success, Verbosity.Normal))
+        self.assertFalse(is_log_enabled(Qgis.MessageLevel.Info, Verbosity.Normal))
+        self.assertTrue(is_log_enabled(Qgis.MessageLevel.Info, Verbosity.Debug))
     #
+    def test_referenced_columns(self):
+        """ Test columns and geometry used by many expressions. """
+        self.assertTupleEqual(
+            ({'folder', 'name'}, False),
+            referenced_columns(["concat('a', \"folder\")", "\"name\" || \"folder\"", "'constant'", ""]),
+        )
+        self.assertTupleEqual(
+            ({'folder'}, True),
+            referenced_columns(["\"folder\"", "area($geometry)"]),
+        )
+        columns, _ = referenced_columns(["attributes(@feature)"])
+        self.assertIn(QgsFeatureRequest.ALL_ATTRIBUTES, columns)
+
+    def test_template_dependency(self):
+        """ Test what a template depends on. """
+        self.assertEqual(TemplateDependency.Constant, template_dependency(""))
+        self.assertEqual(TemplateDependency.Constant, template_dependency("'Layer title'"))
+        self.assertEqual(TemplateDependency.Constant, template_dependency("'Layer ' || 'title'"))
+        self.assertEqual(TemplateDependency.Run, template_dependency("concat('Layer ', @project_title)"))
+        self.assertEqual(TemplateDependency.Run, template_dependency("upper('title')"))
+        self.assertEqual(TemplateDependency.Feature, template_dependency("concat('Layer ', \"folder\")"))
+        self.assertEqual(TemplateDependency.Feature, template_dependency("area($geometry)"))
+        self.assertEqual(TemplateDependency.Feature, template_dependency("attribute(@feature, 'folder')"))
+        self.assertEqual(TemplateDependency.Feature, template_dependency("$id"))
+        self.assertEqual(TemplateDependency.Feature, template_dependency("uuid()"))
+
     # def test_string_substitution_template(self):
     #     """ Test string substitution template. """
     #     self.assertEqual(